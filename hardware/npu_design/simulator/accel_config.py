@@ -0,0 +1,208 @@
+from bfly_accelerator import Butterfly_Accelerator
+from efficient_att_accelerator import make_att_accelerator
+from hbm import hbm_streams
+from resource_model import design_resources, fits_board
+from traffic_stats import load_energy_table
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+
+# Hardware and model presets shared by simulator_bfly.py, simulator_att.py and the description files
+MODEL_VERSIONS = {
+    "base": {"num_layer": 12, "hidden_dim": 768, "ffn_inner_dim": 3072},
+    "large": {"num_layer": 24, "hidden_dim": 1024, "ffn_inner_dim": 4096},
+}
+OFFCHIP_MEMS = {
+    "hbm": {"indata_dram_bw": 2048, "coef_dram_bw": 256, "outdata_dram_bw": 2048},
+    "ddr3": {"indata_dram_bw": 64, "coef_dram_bw": 64, "outdata_dram_bw": 128},
+    "hbm_pc": {}, # Pseudo-channel model, the streams are built by hbm_streams
+}
+BOARD_PARALLELISM = {
+    "zcu128": {"parallesm_bu": 4, "parallesm_be": 128},
+    "zynq7045": {"parallesm_bu": 4, "parallesm_be": 32},
+}
+
+# Fields of a description and their defaults, None means taken from the version/offchip_mem/fpga_board presets
+DEFAULT_DESCRIPTION = {
+    "name": None, "accelerator": "bfly", "version": "base", "num_layer": None, "hidden_dim": None, "ffn_inner_dim": None,
+    "head_dim": 32, "num_len": 512, "batch_size": 1, "fpga_board": "zcu128", "parallesm_bu": None, "parallesm_be": None,
+    "offchip_mem": "hbm", "indata_dram_bw": None, "coef_dram_bw": None, "outdata_dram_bw": None, "hbm_channels": [8, 1, 8],
+    "data_bit_width": 16, "coef_bit_width": 16, "acc_bit_width": 16,
+    "dram_bw": 2048, "attention": "dense", "linformer_k": 256, "num_landmarks": 64, "conv_kernel_size": 35,
+    "frequency": 200, "efficiency": 0.85, "energy_table": "",
+}
+RESULT_FIELDS = ["name", "accelerator", "attention", "version", "num_len", "batch_size", "fpga_board", "offchip_mem", "parallesm_be",
+                 "fits", "bram18", "dsp", "lut", "cycles", "latency_ms", "throughput", "energy_uj", "dram_mb"]
+
+
+def model_dims(version):
+    if version not in MODEL_VERSIONS:
+        raise NotImplementedError("Not supported version.")
+    return dict(MODEL_VERSIONS[version])
+
+
+def offchip_bandwidths(offchip_mem):
+    if offchip_mem not in OFFCHIP_MEMS:
+        raise NotImplementedError("Not supported off-chip memory.")
+    return dict(OFFCHIP_MEMS[offchip_mem])
+
+
+def board_parallelism(fpga_board):
+    if fpga_board not in BOARD_PARALLELISM:
+        raise NotImplementedError("Not supported FPGA board")
+    return dict(BOARD_PARALLELISM[fpga_board])
+
+
+def resolve_description(description):
+    """
+    Fill a description with the defaults and the presets of its version, offchip_mem and fpga_board.
+    Fields given explicitly (e.g. hidden_dim or coef_dram_bw) override the presets.
+    """
+    unknown = set(description) - set(DEFAULT_DESCRIPTION)
+    if unknown:
+        raise ValueError("Unknown fields %s in description %s" % (sorted(unknown), description.get("name")))
+    resolved = dict(DEFAULT_DESCRIPTION)
+    resolved.update(model_dims(description.get("version", resolved["version"])))
+    if description.get("accelerator", resolved["accelerator"]) == "bfly":
+        resolved.update(offchip_bandwidths(description.get("offchip_mem", resolved["offchip_mem"])))
+        resolved.update(board_parallelism(description.get("fpga_board", resolved["fpga_board"])))
+    resolved.update({key: value for key, value in description.items() if value is not None})
+    if resolved["name"] is None:
+        resolved["name"] = "%s_%s_len%d_%s_%s" % (resolved["accelerator"], resolved["version"], resolved["num_len"],
+                                                  resolved["fpga_board"], resolved["offchip_mem"])
+    return resolved
+
+
+def expand_descriptions(document):
+    """
+    A description file is a list of descriptions, or a dict with optional "defaults" applied to every entry of "configs".
+    An entry may have a "sweep" dict of field -> list of values, it is expanded to the cartesian product of the values.
+    """
+    if isinstance(document, list):
+        document = {"configs": document}
+    defaults = document.get("defaults", {})
+    descriptions = []
+    for config in document.get("configs", [{}]):
+        config = dict(defaults, **config)
+        sweep = config.pop("sweep", {})
+        keys = list(sweep)
+        for values in itertools.product(*[sweep[key] for key in keys]):
+            description = dict(config, **dict(zip(keys, values)))
+            if "name" in config and keys: # Keep the names of the swept points unique
+                description["name"] = config["name"] + "".join("_%s" % value for value in values)
+            descriptions.append(resolve_description(description))
+    return descriptions
+
+
+def load_descriptions(path):
+    # Read a .json or .yaml/.yml description file, PyYAML is only needed for yaml
+    with open(path) as f:
+        if os.path.splitext(path)[1] in [".yaml", ".yml"]:
+            import yaml
+            document = yaml.safe_load(f)
+        else:
+            document = json.load(f)
+    descriptions = expand_descriptions(document)
+    logging.info("Loaded %d descriptions from %s" % (len(descriptions), path))
+    return descriptions
+
+
+def run_description(description):
+    """
+    Simulate one FABNet (bfly) or Transformer (att, with dense/linformer/nystrom attention) layer with the analytical
+    model and scale it to the network.
+    Returns a row of RESULT_FIELDS. Butterfly designs that do not fit fpga_board are reported with fits=False and
+    without latency.
+    """
+    d = description
+    result = {key: d.get(key) for key in RESULT_FIELDS}
+    if d["accelerator"] == "bfly":
+        offchip_streams = hbm_streams(*d["hbm_channels"]) if d["offchip_mem"] == "hbm_pc" else {}
+        design = Butterfly_Accelerator(d["head_dim"], d["hidden_dim"], d["num_len"], d["ffn_inner_dim"],
+                                        parallesm_bu=d["parallesm_bu"], parallesm_be=d["parallesm_be"],
+                                        indata_dram_bw=d["indata_dram_bw"], coef_dram_bw=d["coef_dram_bw"],
+                                        outdata_dram_bw=d["outdata_dram_bw"], batch_size=d["batch_size"], analytical=True,
+                                        data_bit_width=d["data_bit_width"], coef_bit_width=d["coef_bit_width"],
+                                        acc_bit_width=d["acc_bit_width"],
+                                        **offchip_streams)
+        resources = design_resources(design)
+        feasible, _ = fits_board(resources, d["fpga_board"])
+        result.update(attention=None, fits=bool(feasible), bram18=int(resources["bram18"]), dsp=int(resources["dsp"]), lut=int(resources["lut"]))
+        if not feasible:
+            logging.warning("%s does not fit %s" % (d["name"], d["fpga_board"]))
+            return result
+        design.run_fft(complex_input=False, complex_output=True) # 1st dimension FFT
+        design.run_fft(complex_input=True, complex_output=False) # 2nd dimension FFT
+        design.run_bfly(design.num_len, design.hidden_dim, design.ffn_inner_dim)
+        design.run_bfly(design.num_len, design.ffn_inner_dim, design.hidden_dim)
+        energy_mem = "hbm" if d["offchip_mem"] == "hbm_pc" else d["offchip_mem"]
+    elif d["accelerator"] == "att":
+        design = make_att_accelerator(d["attention"], d["head_dim"], d["hidden_dim"], d["num_len"], d["ffn_inner_dim"],
+                                      linformer_k=d["linformer_k"], num_landmarks=d["num_landmarks"], conv_kernel_size=d["conv_kernel_size"],
+                                      dram_bw=d["dram_bw"], batch_size=d["batch_size"], analytical=True)
+        design.run_att()
+        design.run_lp()
+        design.run_fc1()
+        design.run_fc2()
+        energy_mem = "hbm"
+    else:
+        raise NotImplementedError("Not supported accelerator %s" % d["accelerator"])
+
+    network_run_cost = d["num_layer"] * design.run_cycles
+    ms_per_clock = (1.0/d["frequency"]/1000) / d["efficiency"]
+    report = design.traffic.report(load_energy_table(energy_mem, d["energy_table"]), num_layer=d["num_layer"], batch_size=d["batch_size"])
+    result.update(cycles=int(network_run_cost), latency_ms=network_run_cost*ms_per_clock,
+                  throughput=d["batch_size"] * 1000 / (network_run_cost*ms_per_clock),
+                  energy_uj=report["per_inference"]["energy_uj"], dram_mb=report["per_inference"]["dram_bytes"] / 2**20)
+    return result
+
+
+def format_table(results):
+    # Fixed-width text table of the result rows
+    def cell(value):
+        if isinstance(value, float): return "%.4g" % value
+        return "" if value is None else str(value)
+    rows = [RESULT_FIELDS] + [[cell(result[key]) for key in RESULT_FIELDS] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(RESULT_FIELDS))]
+    return "\n".join("  ".join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def save_results(results, path):
+    if os.path.splitext(path)[1] == ".json":
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def main(args):
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+    descriptions = [description for path in args.configs for description in load_descriptions(path)]
+    results = [run_description(description) for description in descriptions]
+    print (format_table(results))
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("configs", type=str, nargs="+", help="Accelerator description files (.json, .yaml or .yml)")
+    parser.add_argument("--output", default="", type=str, help="Dump the results table to this csv (or .json) file")
+    parser.add_argument("--debug", action="store_true")
+
+    args = parser.parse_args()
+
+    main(args)
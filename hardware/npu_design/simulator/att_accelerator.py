@@ -1,6 +1,7 @@
 from bram import Bram
 from dram import Dram
 from compute_engine import CE
+from traffic_stats import Traffic_Stats
 import logging
 import math
 
@@ -9,11 +10,13 @@ logger = logging.getLogger(__name__)
 
 class Att_Accelerator:
     def __init__(self, head_dim, hidden_dim, num_len, ffn_inner_dim, pr_lt=1, pv_lt=64, pv_ln=8, mac_factor=1, bit_width=16,
-                    dram_bw=2048, softmax_delay=72, p_head = 8):
+                    dram_bw=2048, softmax_delay=72, p_head = 8, batch_size=1, dram=None, analytical=False):
         self.head_dim = head_dim
         self.hidden_dim = hidden_dim
         self.ffn_inner_dim = ffn_inner_dim
         self.num_len = num_len
+        self.batch_size = batch_size # Sequences per batch, weights are loaded once and reused by all of them
+        self.analytical = analytical # Simulate one row of the row-wise pipelines and repeat it in closed form
         self.pv_lt = pv_lt # parallelism vector of linear transformation
         self.pr_lt = pr_lt # parallelism row of linear transformation
         self.pc_lt = 1
@@ -32,7 +35,7 @@ class Att_Accelerator:
         self.pv_sv = self.pv_qk
         self.pc_sv = self.mac_factor
         ############################# Define Dram #############################
-        self.dram = Dram(self.dram_bw)
+        self.dram = Dram(self.dram_bw) if dram is None else dram # e.g. hbm.Hbm(16) for 16 HBM pseudo-channels
 
         ############################# Define Bram #############################
         # Data BRAM with size num_len * hidden_dim * bit_with
@@ -60,7 +63,7 @@ class Att_Accelerator:
         self.score_brams = []
         for i in range(self.p_head):
             # Score BRAM with size num_len * num_len
-            self.score_bram = Bram(self.num_len * self.num_len // (self.pv_sv * self.pr_sv), self.bit_width, self.pv_sv * self.pr_sv, "score_bram%d"%(i)) 
+            self.score_bram = Bram(self.num_score() // (self.pv_sv * self.pr_sv), self.bit_width, self.pv_sv * self.pr_sv, "score_bram%d"%(i)) 
             self.score_brams.append(self.score_bram)
         
         ####################### Define Compute Engine #########################
@@ -80,26 +83,140 @@ class Att_Accelerator:
         logging.info("Linear Transform Parallelism Row %d, Parallelism Colmn %d, Parallelism Vector %d"%(self.pr_lt, self.pc_lt, self.pv_lt))
         logging.info("Query * Key Parallelism Row %d, Parallelism Colmn %d, Parallelism Vector %d"%(self.pr_qk, self.pc_qk, self.pv_qk))
         logging.info("Score * Value Parallelism Row %d, Parallelism Colmn %d, Parallelism Vector %d"%(self.pr_sv, self.pc_sv, self.pv_sv))
+        self.traffic = Traffic_Stats([self.dram, self.data_bram, self.coef_bram] + self.query_brams + self.key_brams + self.value_brams + self.score_brams)
 
     def reset_stat(self):
         self.run_cycles = 0
+        for memory in self.traffic.memories: memory.reset_stat()
+        self.traffic.reset()
+
+    def dram_read(self, height, width, bit_width):
+        # Cycles and accesses of a dram read, they differ on an Hbm (row, CAS and burst overheads)
+        num_read = self.dram.num_read_access
+        read_cycles = self.dram.read(height, width, bit_width)
+        return read_cycles, self.dram.num_read_access - num_read
+
+    def count_batch(self, dram_data_read_access):
+        # The accesses of an op are counted for one sequence, the other sequences in the batch reload their data
+        # and go through the data bram, the coef are loaded once and read by every sequence
+        self.dram.add_stat((self.batch_size - 1) * dram_data_read_access)
+        self.traffic.repeat_op([self.data_bram], self.batch_size)
+        self.traffic.repeat_op([self.coef_bram], self.batch_size, 1)
+
+    def num_score(self):
+        # Elements of the attention matrix of one head, sizes the score brams
+        return self.num_len * self.num_len
+
+    def num_sim_row(self, num_row):
+        # Rows replayed by the row-wise loops, every row has the same costs so the analytical mode only replays one
+        return 1 if self.analytical else num_row
+
+    def row_snapshot(self, memories):
+        return [(memory, memory.num_read_access, memory.num_write_access) for memory in memories]
+
+    def repeat_accesses(self, snapshot, num_repeat):
+        # The accesses since the snapshot happen num_repeat times in total
+        for memory, num_read, num_write in snapshot:
+            memory.add_stat((num_repeat - 1) * (memory.num_read_access - num_read),
+                            (num_repeat - 1) * (memory.num_write_access - num_write))
+
+    def repeat_rows(self, snapshot, num_row):
+        # In analytical mode, the accesses of the replayed row happen once per row
+        if self.analytical: self.repeat_accesses(snapshot, num_row)
+
+    def run_kv_projection(self):
+        """
+        Extra work of the efficient attention engines after the linear transformation of a head group.
+        Returns the cycles added to the key/value engines and the cycles of the transfers overlapped with them.
+        """
+        return 0, 0
+
+    def run_att_rows(self):
+        # Third-level pipeline of a head group, returns the cycles of the first group and of the following ones
+        return self.run_score_rows(self.num_len, self.num_len)
+
+    def run_score_rows(self, num_row, num_key, sv_len=None):
+        """
+        Row-wise pipeline of QK, softmax and SV: every one of the num_row queries is multiplied with num_key keys,
+        and its num_key scores with sv_len (by default num_key) rows of values.
+        Returns the cycles of the first pass (with the pipeline fill) and of a pass overlapped with the previous one.
+        """
+        if sv_len is None: sv_len = num_key
+        # Start to compute Query * Keys, row-wise pipeline
+        qk_cycles = []
+        snapshot = self.row_snapshot(self.query_brams + self.key_brams)
+        for i in range(self.num_sim_row(num_row)):
+            for i in range(self.p_head):
+                bram_query_read_cycles_per_row = self.query_brams[i].read(1, self.head_dim, self.bit_width, num_key / self.pc_qk, 1)
+                bram_key_read_cycles_per_row = self.key_brams[i].read(num_key, self.head_dim, self.bit_width, 1, 1)
+            initial_compute_delay_score, score_compute_time_per_row = self.qk_ce.run(1, num_key, self.head_dim)
+            qk_cycles.append(max(bram_query_read_cycles_per_row, bram_key_read_cycles_per_row,
+                                score_compute_time_per_row))# Pipeline, obtain max cycles as the real cycle
+        self.repeat_rows(snapshot, num_row)
+        initial_2in1_delay = 3
+        initial_smart_mem_delay = 1
+        initial_qk_delay = initial_compute_delay_score + initial_2in1_delay + initial_smart_mem_delay
+        trd_pipeline_cost = qk_cycles[0] + initial_qk_delay
+        logging.info("Initial QK in Self Attention (third-level pipeline) takes %d + %d cycles"%(qk_cycles[0], initial_qk_delay))
+
+        # Start to compute softmax        
+        softmax_cycles = []
+        initial_softmax_delay = self.softmax_delay
+        snapshot = self.row_snapshot(self.score_brams)
+        for i in range(self.num_sim_row(num_row)):
+            softmax_time = num_key
+            for i in range(self.p_head):
+                bram_score_write_cycles_per_row = self.score_brams[i].write(1, num_key, self.bit_width)
+            softmax_cycles.append(max(softmax_time, bram_score_write_cycles_per_row))
+        self.repeat_rows(snapshot, num_row)
+        trd_pipeline_cost += max(qk_cycles[-1], softmax_cycles[0] + initial_softmax_delay)
+        logging.info("Initial Softmax in Self Attention (third-level pipeline) takes %d cycles", max(qk_cycles[-1], softmax_cycles[0] + initial_softmax_delay))
+
+        # Start to compute Score * Value
+        sv_cycles = []
+        snapshot = self.row_snapshot(self.score_brams + self.value_brams)
+        for i in range(self.num_sim_row(num_row)):
+            for i in range(self.p_head):
+                bram_score_read_cycles_per_row = self.score_brams[i].read(1, num_key, self.bit_width, self.head_dim / self.pc_sv, 1) #Score stay, value repeat
+                bram_value_read_cycles_per_row = self.value_brams[i].read(self.head_dim, num_key, self.bit_width, 1, 1)
+            initial_compute_delay_sv, sv_compute_time_per_row = self.sv_ce.run(1, self.head_dim, sv_len)
+            # Write back to Dram directly
+            sv_cycles.append(max(bram_score_read_cycles_per_row, bram_value_read_cycles_per_row, sv_compute_time_per_row))
+        self.repeat_rows(snapshot, num_row)
+        trd_pipeline_cost += initial_compute_delay_sv
+        logging.info("Initial SV in Self Attention (third-level pipeline) takes %d cycles", initial_compute_delay_sv)
+
+        # Calculate the runtime row by row in third stage
+        if self.analytical:
+            trd_pipeline_cost += max(0, num_row - 2) * max(qk_cycles[0], softmax_cycles[0], sv_cycles[0]) # No steady state below 3 rows
+            trd_pipeline_cost += max(softmax_cycles[0], sv_cycles[0])
+            trd_pipeline_cost += sv_cycles[0]
+        else:
+            for i in range(2, num_row):
+                trd_pipeline_cost += max(qk_cycles[i], softmax_cycles[i-1], sv_cycles[i-2])
+                #self.run_cycles += max(qk_cycles[i], softmax_cycles[i-1], sv_cycles[i-2])# Pipeline, obtain max cycles as the real cycle
+            trd_pipeline_cost += max(softmax_cycles[num_row-1], sv_cycles[num_row-2])
+            trd_pipeline_cost += sv_cycles[num_row-1]
+        return trd_pipeline_cost, num_row * max(qk_cycles[-1], softmax_cycles[-1], sv_cycles[-1])
 
     def run_att(self):
         logging.info("Running self-attention layer")
         start_cycle = self.run_cycles
-        num_run = math.ceil(self.hidden_dim / self.head_dim / self.p_head)
+        self.traffic.begin_op("attention")
+        # Heads are processed group by group, all the sequences in the batch reuse the coef of a group
+        num_run = math.ceil(self.hidden_dim / self.head_dim / self.p_head) * self.batch_size
         ############################# First Level Pipelining #############################
         # Get data from dram to bram
-        dram_data_read_cycles = self.dram.read(self.num_len, self.hidden_dim, self.bit_width) # Read from dram
+        dram_data_read_cycles, dram_data_read_access = self.dram_read(self.num_len, self.hidden_dim, self.bit_width) # Read from dram
         bram_data_write_cycles = self.data_bram.write(self.num_len, self.hidden_dim, self.bit_width) # Write fromo bram
-        fst_pipeline_cost = max(dram_data_read_cycles, bram_data_write_cycles) 
+        fst_data_cost = max(dram_data_read_cycles, bram_data_write_cycles) 
         # Get coef from dram to bram
-        dram_coef_read_cycles = self.dram.read(self.p_head * self.head_dim, self.hidden_dim, self.bit_width) # Read from dram
+        dram_coef_read_cycles, dram_coef_read_access = self.dram_read(self.p_head * self.head_dim, self.hidden_dim, self.bit_width) # Read from dram
         bram_coef_write_cycles = self.coef_bram.write(self.p_head * self.head_dim, self.hidden_dim, self.bit_width) # Write fromo bram
-        fst_pipeline_cost += max(dram_coef_read_cycles, bram_coef_write_cycles)  
+        fst_pipeline_cost = fst_data_cost + max(dram_coef_read_cycles, bram_coef_write_cycles)  
         logging.info("First-level Pipeline: Loading data/coef from Dram takes %d cycles", fst_pipeline_cost)
 
-        fst_pipeline_costs = [fst_pipeline_cost for i in range(num_run)]
+        fst_pipeline_costs = [fst_pipeline_cost if i % self.batch_size == 0 else fst_data_cost for i in range(num_run)]
         # Padding
         for i in range(2): fst_pipeline_costs.append(0)
         self.run_cycles += fst_pipeline_costs[0]  # Pipeline, obtain max cycles as the real cycle 
@@ -118,9 +235,12 @@ class Att_Accelerator:
             bram_key_write_cycles = self.key_brams[i].write(self.num_len, self.head_dim, self.bit_width)
             bram_value_write_cycles = self.value_brams[i].write(self.num_len, self.head_dim, self.bit_width)
 
+        snapshot = self.row_snapshot([self.dram])
+        kv_projection_time, kv_projection_transfer_cycles = self.run_kv_projection()
+        self.repeat_accesses(snapshot, num_run) # Repeated by every head group and sequence
         snd_pipeline_cost = max(bram_data_read_cycles, bram_coef_read_cycles,
-                                q_compute_time, k_compute_time,
-                                bram_query_write_cycles, bram_key_write_cycles) 
+                                q_compute_time, k_compute_time + kv_projection_time,
+                                bram_query_write_cycles, bram_key_write_cycles, kv_projection_transfer_cycles) 
         logging.info("Second-level Pipeline: Linear Transformation takes %d cycles", snd_pipeline_cost)
         logging.info("Initial Linear Transformation (second-level pipeline) takes %d cycles", initial_compute_delay_value)
 
@@ -132,53 +252,10 @@ class Att_Accelerator:
         self.run_cycles += max(fst_pipeline_costs[1], snd_pipeline_costs[0]) # Pipeline, obtain max cycles as the real cycle
 
         ############################# Third Level Pipelining #############################
-        # Start to compute Query * Keys, row-wise pipeline
-        qk_cycles = []
-        for i in range(self.num_len):
-            for i in range(self.p_head):
-                bram_query_read_cycles_per_row = self.query_brams[i].read(1, self.head_dim, self.bit_width, self.num_len / self.pc_qk, 1)
-                bram_key_read_cycles_per_row = self.key_brams[i].read(self.num_len, self.head_dim, self.bit_width, 1, 1)
-            initial_compute_delay_score, score_compute_time_per_row = self.qk_ce.run(1, self.num_len, self.head_dim)
-            qk_cycles.append(max(bram_query_read_cycles_per_row, bram_key_read_cycles_per_row,
-                                score_compute_time_per_row))# Pipeline, obtain max cycles as the real cycle
-        initial_2in1_delay = 3
-        initial_smart_mem_delay = 1
-        initial_qk_delay = initial_compute_delay_score + initial_2in1_delay + initial_smart_mem_delay
-        trd_pipeline_cost = qk_cycles[0] + initial_qk_delay
-        logging.info("Initial QK in Self Attention (third-level pipeline) takes %d + %d cycles"%(qk_cycles[0], initial_qk_delay))
-
-        # Start to compute softmax        
-        softmax_cycles = []
-        initial_softmax_delay = self.softmax_delay
-        for i in range(self.num_len):
-            softmax_time = self.num_len
-            for i in range(self.p_head):
-                bram_score_write_cycles_per_row = self.score_brams[i].write(1, self.num_len, self.bit_width)
-            softmax_cycles.append(max(softmax_time, bram_score_write_cycles_per_row))
-        trd_pipeline_cost += max(qk_cycles[1], softmax_cycles[0] + initial_softmax_delay)
-        logging.info("Initial Softmax in Self Attention (third-level pipeline) takes %d cycles", max(qk_cycles[1], softmax_cycles[0] + initial_softmax_delay))
-
-        # Start to compute Score * Value
-        sv_cycles = []
-        for i in range(self.num_len):
-            for i in range(self.p_head):
-                bram_score_read_cycles_per_row = self.score_brams[i].read(1, self.num_len, self.bit_width, self.head_dim / self.pc_sv, 1) #Score stay, value repeat
-                bram_value_read_cycles_per_row = self.value_brams[i].read(self.head_dim, self.num_len, self.bit_width, 1, 1)
-            initial_compute_delay_sv, sv_compute_time_per_row = self.sv_ce.run(1, self.head_dim, self.num_len)
-            # Write back to Dram directly
-            sv_cycles.append(max(bram_score_read_cycles_per_row, bram_value_read_cycles_per_row, sv_compute_time_per_row))
-        trd_pipeline_cost += initial_compute_delay_sv
-        logging.info("Initial SV in Self Attention (third-level pipeline) takes %d cycles", initial_compute_delay_sv)
-
-        # Calculate the runtime row by row in third stage
-        for i in range(2, self.num_len):
-            trd_pipeline_cost += max(qk_cycles[i], softmax_cycles[i-1], sv_cycles[i-2])
-            #self.run_cycles += max(qk_cycles[i], softmax_cycles[i-1], sv_cycles[i-2])# Pipeline, obtain max cycles as the real cycle
-        trd_pipeline_cost += max(softmax_cycles[self.num_len-1], sv_cycles[self.num_len-2])
-        trd_pipeline_cost += sv_cycles[self.num_len-1]
+        trd_pipeline_cost, trd_overlap_cost = self.run_att_rows()
         trd_pipeline_costs = [trd_pipeline_cost]
         for i in range(num_run-1):
-            trd_pipeline_costs.append(self.num_len * max(qk_cycles[-1], softmax_cycles[-1], sv_cycles[-1]))
+            trd_pipeline_costs.append(trd_overlap_cost)
 
         self.run_cycles += max(fst_pipeline_costs[2], snd_pipeline_costs[1], trd_pipeline_costs[0])
         logging.info("Second-level Pipeline: Self Attention takes %d cycles", trd_pipeline_costs[0])
@@ -187,10 +264,16 @@ class Att_Accelerator:
 
         for i in range(1, num_run):
             self.run_cycles += max(fst_pipeline_costs[i+2], snd_pipeline_costs[i+1], trd_pipeline_costs[i])
+        # The accesses above are for one head group of one sequence, the coef of a group are loaded once per batch
+        num_group = num_run // self.batch_size
+        self.dram.add_stat((num_run - 1) * dram_data_read_access + (num_group - 1) * dram_coef_read_access)
+        self.traffic.repeat_op([self.data_bram] + self.query_brams + self.key_brams + self.value_brams + self.score_brams, num_run)
+        self.traffic.repeat_op([self.coef_bram], num_run, num_group)
         # print (fst_pipeline_costs)
         # print (snd_pipeline_costs)
         # print (trd_pipeline_costs)
         logging.info("Runtime cost of self attention takes %d cycles"%(self.run_cycles-start_cycle))
+        self.traffic.end_op(self.run_cycles-start_cycle)
         return self.run_cycles-start_cycle
 
 
@@ -198,9 +281,10 @@ class Att_Accelerator:
     def run_lp(self): # Linear projection layer after attention
         logging.info("Running linear projection layer")
         start_cycle = self.run_cycles
+        self.traffic.begin_op("linear_projection")
         ############################# First Level Pipelining #############################
         # Get data from dram to bram
-        dram_data_read_cycles = self.dram.read(self.num_len, self.hidden_dim, self.bit_width) # Read from dram
+        dram_data_read_cycles, dram_data_read_access = self.dram_read(self.num_len, self.hidden_dim, self.bit_width) # Read from dram
         bram_data_write_cycles = self.data_bram.write(self.num_len, self.hidden_dim, self.bit_width) # Write fromo bram
         # print (dram_data_read_cycles, bram_data_write_cycles)
         fst_pipeline_cost = max(dram_data_read_cycles, bram_data_write_cycles) 
@@ -210,12 +294,15 @@ class Att_Accelerator:
         # print (dram_coef_read_cycles, bram_coef_write_cycles)
         fst_pipeline_cost += max(dram_coef_read_cycles, bram_coef_write_cycles)  
         logging.info("First-level Pipeline: Loading data/coef from Dram takes %d cycles", fst_pipeline_cost)
-        self.run_cycles += fst_pipeline_cost
+        # The other sequences in the batch only load their data
+        self.run_cycles += fst_pipeline_cost + (self.batch_size - 1) * max(dram_data_read_cycles, bram_data_write_cycles)
+        num_row = self.num_len * self.batch_size
 
         # Start to compute the linear projection layer
         ############################# Second Level Pipelining #############################
         # Data stay, Coef repeat
-        for i in range(self.num_len):
+        snapshot = self.row_snapshot([self.data_bram, self.coef_bram])
+        for i in range(self.num_sim_row(self.num_len)):
             bram_data_read_cycles = self.data_bram.read(1, self.hidden_dim, self.bit_width, 1, 1) # Read to data bram
             bram_coef_read_cycles = self.coef_bram.read(self.hidden_dim, self.hidden_dim, self.bit_width, 1, 1)
             initial_compute_delay_fc_qeury_ce, fc_query_ce_compute_time = self.q_ce.run(1, self.hidden_dim/4, self.hidden_dim) # Heigh, Width
@@ -223,6 +310,7 @@ class Att_Accelerator:
             initial_compute_delay_fc_value_ce, fc_value_ce_compute_time = self.v_ce.run(1, self.hidden_dim/4, self.hidden_dim) # Heigh, Width
             initial_compute_delay_fc_qk_ce, fc_qk_ce_compute_time = self.qk_ce.run(1, self.hidden_dim/8/self.p_head, self.hidden_dim) # Heigh, Width, There are p_head number of ce, so divide it by p_head
             initial_compute_delay_fc_sv_ce, fc_sv_ce_compute_time = self.sv_ce.run(1, self.hidden_dim/8/self.p_head, self.hidden_dim) # Heigh, Width, There are p_head number of ce, so divide it by p_head
+        self.repeat_rows(snapshot, self.num_len)
 
         initial_compute_delay_fc = max(initial_compute_delay_fc_qeury_ce, initial_compute_delay_fc_key_ce, initial_compute_delay_fc_value_ce,
                                         initial_compute_delay_fc_qk_ce, initial_compute_delay_fc_sv_ce)
@@ -233,7 +321,7 @@ class Att_Accelerator:
         snd_pipeline_cost = max(bram_data_read_cycles, bram_coef_read_cycles, fc_compute_time)
         # print (bram_data_read_cycles, bram_coef_read_cycles, fc_compute_time)
         self.run_cycles += initial_compute_delay_fc + snd_pipeline_cost
-        snd_pipeline_costs = [snd_pipeline_cost for i in range(self.num_len)]
+        snd_pipeline_costs = [snd_pipeline_cost] * num_row
 
         logging.info("Second-level Pipeline: Linear Projection takes %d cycles", snd_pipeline_cost)
         logging.info("Initial Linear Projection (second-level pipeline) takes %d cycles", initial_compute_delay_fc)
@@ -249,20 +337,25 @@ class Att_Accelerator:
         var_delay = sub_delay + square_delay + math.log(self.pv_ln) + (self.hidden_dim//self.pv_ln) + root_delay + div_delay
         trd_pipeline_cost = mean_delay + var_delay # initial cost
         self.run_cycles += max(snd_pipeline_costs[0], trd_pipeline_cost)
-        trd_pipeline_costs = [(self.hidden_dim//self.pv_ln) * (self.hidden_dim//self.pv_lt) for i in range(self.num_len)]
+        trd_pipeline_costs = [(self.hidden_dim//self.pv_ln) * (self.hidden_dim//self.pv_lt)] * num_row
         logging.info("Third-level Pipeline: Linear Normalization takes %d cycles", trd_pipeline_cost)
 
         forth_pipeline_cost = self.hidden_dim//self.pv_ln # initial cost
         self.run_cycles += max(snd_pipeline_costs[1], trd_pipeline_costs[0], forth_pipeline_cost)
-        forth_pipeline_costs = [self.hidden_dim//self.pv_ln for i in range(self.num_len)]
+        forth_pipeline_costs = [self.hidden_dim//self.pv_ln] * num_row
         # Simpley add together as that is a single run
 
-        for i in range(self.num_len-2):
-            self.run_cycles += max(snd_pipeline_costs[i+2], trd_pipeline_costs[i+1], forth_pipeline_costs[i])
+        if self.analytical:
+            self.run_cycles += (num_row - 2) * max(snd_pipeline_costs[-1], trd_pipeline_costs[-1], forth_pipeline_costs[-1])
+        else:
+            for i in range(num_row-2):
+                self.run_cycles += max(snd_pipeline_costs[i+2], trd_pipeline_costs[i+1], forth_pipeline_costs[i])
         # print (snd_pipeline_costs)
         # print (trd_pipeline_costs)
         # print (forth_pipeline_costs)
         logging.info("Runtime cost of linear projection takes %d cycles"%(self.run_cycles - start_cycle))
+        self.count_batch(dram_data_read_access)
+        self.traffic.end_op(self.run_cycles - start_cycle)
         return self.run_cycles-start_cycle
         
 
@@ -270,9 +363,10 @@ class Att_Accelerator:
     def run_fc1(self):
         logging.info("Running the first fc layer in FFN")
         start_cycle = self.run_cycles
+        self.traffic.begin_op("fc1")
         ############################# First Level Pipelining #############################
         # Get data from dram to bram
-        dram_data_read_cycles = self.dram.read(self.num_len, self.hidden_dim, self.bit_width) # Read from dram
+        dram_data_read_cycles, dram_data_read_access = self.dram_read(self.num_len, self.hidden_dim, self.bit_width) # Read from dram
         bram_data_write_cycles = self.data_bram.write(self.num_len, self.hidden_dim, self.bit_width) # Write fromo bram
         fst_pipeline_cost = max(dram_data_read_cycles, bram_data_write_cycles) 
         # Get coef from dram to bram
@@ -284,7 +378,8 @@ class Att_Accelerator:
         # Start to compute the first FC layer
         ############################# Second Level Pipelining #############################
         # Data stay, Coef repeat
-        for i in range(self.num_len):
+        snapshot = self.row_snapshot([self.data_bram, self.coef_bram])
+        for i in range(self.num_sim_row(self.num_len)):
             bram_data_read_cycles = self.data_bram.read(1, self.hidden_dim, self.bit_width, 1, 1) # Read to data bram
             bram_coef_read_cycles = self.coef_bram.read(self.ffn_inner_dim, self.hidden_dim, self.bit_width, 1, 1)
             initial_compute_delay_fc_qeury_ce, fc_query_ce_compute_time = self.q_ce.run(1, self.ffn_inner_dim/4, self.hidden_dim) # Heigh, Width
@@ -292,6 +387,7 @@ class Att_Accelerator:
             initial_compute_delay_fc_value_ce, fc_value_ce_compute_time = self.v_ce.run(1, self.ffn_inner_dim/4, self.hidden_dim) # Heigh, Width
             initial_compute_delay_fc_qk_ce, fc_qk_ce_compute_time = self.qk_ce.run(1, self.ffn_inner_dim/8/self.p_head, self.hidden_dim) # Heigh, Width
             initial_compute_delay_fc_sv_ce, fc_sv_ce_compute_time = self.sv_ce.run(1, self.ffn_inner_dim/8/self.p_head, self.hidden_dim) # Heigh, Width
+        self.repeat_rows(snapshot, self.num_len)
 
         initial_compute_delay_fc = max(initial_compute_delay_fc_qeury_ce, initial_compute_delay_fc_key_ce, initial_compute_delay_fc_value_ce,
                                         initial_compute_delay_fc_qk_ce, initial_compute_delay_fc_sv_ce)
@@ -302,20 +398,26 @@ class Att_Accelerator:
         logging.info("Second-level Pipeline: FC1 takes %d cycles", snd_pipeline_cost)
         logging.info("Initial FC1 (second-level pipeline) takes %d cycles", initial_compute_delay_fc)
 
-        # Simpley add together as that is a single run
-        self.run_cycles += fst_pipeline_cost
-        for i in range(self.num_len):
-            self.run_cycles += snd_pipeline_cost
+        # Simpley add together as that is a single run, the other sequences in the batch only load their data
+        self.run_cycles += fst_pipeline_cost + (self.batch_size - 1) * max(dram_data_read_cycles, bram_data_write_cycles)
+        if self.analytical:
+            self.run_cycles += self.num_len * self.batch_size * snd_pipeline_cost
+        else:
+            for i in range(self.num_len * self.batch_size):
+                self.run_cycles += snd_pipeline_cost
         logging.info("Runtime cost of the first FC in FFN takes %d cycles"%(self.run_cycles - start_cycle))
+        self.count_batch(dram_data_read_access)
+        self.traffic.end_op(self.run_cycles - start_cycle)
         return self.run_cycles-start_cycle
 
 
     def run_fc2(self): # Run the second FC layer in FFN
         logging.info("Running the second fc layer in FFN")
         start_cycle = self.run_cycles
+        self.traffic.begin_op("fc2")
         ############################# First Level Pipelining #############################
         # Get data from dram to bram
-        dram_data_read_cycles = self.dram.read(self.num_len, self.ffn_inner_dim, self.bit_width) # Read from dram
+        dram_data_read_cycles, dram_data_read_access = self.dram_read(self.num_len, self.ffn_inner_dim, self.bit_width) # Read from dram
         bram_data_write_cycles = self.data_bram.write(self.num_len, self.ffn_inner_dim, self.bit_width) # Write fromo bram
         fst_pipeline_cost = max(dram_data_read_cycles, bram_data_write_cycles) 
         # Get coef from dram to bram
@@ -327,7 +429,8 @@ class Att_Accelerator:
         # Start to compute the linear projection layer
         ############################# Second Level Pipelining #############################
         # Data stay, Coef repeat
-        for i in range(self.num_len):
+        snapshot = self.row_snapshot([self.data_bram, self.coef_bram])
+        for i in range(self.num_sim_row(self.num_len)):
             bram_data_read_cycles = self.data_bram.read(1, self.ffn_inner_dim, self.bit_width, 1, 1) # Read to data bram
             bram_coef_read_cycles = self.coef_bram.read(self.hidden_dim, self.ffn_inner_dim, self.bit_width, 1, 1)
             initial_compute_delay_fc_qeury_ce, fc_query_ce_compute_time = self.q_ce.run(1, self.hidden_dim/4, self.ffn_inner_dim) # Heigh, Width
@@ -335,6 +438,7 @@ class Att_Accelerator:
             initial_compute_delay_fc_value_ce, fc_value_ce_compute_time = self.v_ce.run(1, self.hidden_dim/4, self.ffn_inner_dim) # Heigh, Width
             initial_compute_delay_fc_qk_ce, fc_qk_ce_compute_time = self.qk_ce.run(1, self.hidden_dim/8/self.p_head, self.ffn_inner_dim) # Heigh, Width
             initial_compute_delay_fc_sv_ce, fc_sv_ce_compute_time = self.sv_ce.run(1, self.hidden_dim/8/self.p_head, self.ffn_inner_dim) # Heigh, Width
+        self.repeat_rows(snapshot, self.num_len)
 
         initial_compute_delay_fc = max(initial_compute_delay_fc_qeury_ce, initial_compute_delay_fc_key_ce, initial_compute_delay_fc_value_ce,
                                         initial_compute_delay_fc_qk_ce, initial_compute_delay_fc_sv_ce)
@@ -343,7 +447,8 @@ class Att_Accelerator:
         snd_pipeline_cost = max(bram_data_read_cycles, bram_coef_read_cycles, fc_compute_time)
         # print ((bram_data_read_cycles, bram_coef_read_cycles, fc_compute_time))
         self.run_cycles += initial_compute_delay_fc + snd_pipeline_cost
-        snd_pipeline_costs = [snd_pipeline_cost for i in range(self.num_len)]
+        num_row = self.num_len * self.batch_size
+        snd_pipeline_costs = [snd_pipeline_cost] * num_row
 
         logging.info("Second-level Pipeline: FC2 takes %d cycles", snd_pipeline_cost)
         logging.info("Initial  FC2 (second-level pipeline) takes %d cycles", initial_compute_delay_fc)
@@ -359,31 +464,37 @@ class Att_Accelerator:
         var_delay = sub_delay + square_delay + math.log(self.pv_ln) + (self.hidden_dim//self.pv_ln) + root_delay + div_delay
         trd_pipeline_cost = mean_delay + var_delay # initial cost
         self.run_cycles += max(snd_pipeline_costs[0], trd_pipeline_cost)
-        trd_pipeline_costs = [(self.hidden_dim//self.pv_ln) * (self.hidden_dim//self.pv_lt) for i in range(self.num_len)]
+        trd_pipeline_costs = [(self.hidden_dim//self.pv_ln) * (self.hidden_dim//self.pv_lt)] * num_row
 
         forth_pipeline_cost = self.hidden_dim//self.pv_ln # initial cost
         self.run_cycles += max(snd_pipeline_costs[1], trd_pipeline_costs[0], forth_pipeline_cost)
-        forth_pipeline_costs = [self.hidden_dim//self.pv_ln for i in range(self.num_len)]
+        forth_pipeline_costs = [self.hidden_dim//self.pv_ln] * num_row
         # Simpley add together as that is a single run
 
-        for i in range(self.num_len-2):
-            self.run_cycles += max(snd_pipeline_costs[i+2], trd_pipeline_costs[i+1], forth_pipeline_costs[i])
+        if self.analytical:
+            self.run_cycles += (num_row - 2) * max(snd_pipeline_costs[-1], trd_pipeline_costs[-1], forth_pipeline_costs[-1])
+        else:
+            for i in range(num_row-2):
+                self.run_cycles += max(snd_pipeline_costs[i+2], trd_pipeline_costs[i+1], forth_pipeline_costs[i])
 
         # print (snd_pipeline_costs)
         # print (trd_pipeline_costs)
         # print (forth_pipeline_costs)
 
         logging.info("Runtime cost of the first FC in FFN takes %d cycles"%(self.run_cycles - start_cycle))
+        self.count_batch(dram_data_read_access)
+        self.traffic.end_op(self.run_cycles - start_cycle)
         return self.run_cycles-start_cycle
 
 
     def run_fft(self, complex_input=False, complex_output=True):
         logging.info("Running FFT on baseline design, equivalent ot running FC layer")
         start_cycle = self.run_cycles
+        self.traffic.begin_op("fft")
         ############################# First Level Pipelining #############################
         # Get data from dram to bram
-        if (complex_input): dram_data_read_cycles = self.dram.read(self.num_len, self.hidden_dim, self.bit_width*2) # Read from dram
-        else: dram_data_read_cycles = self.dram.read(self.num_len, self.hidden_dim, self.bit_width*2) # Read from dram
+        if (complex_input): dram_data_read_cycles, dram_data_read_access = self.dram_read(self.num_len, self.hidden_dim, self.bit_width*2) # Read from dram
+        else: dram_data_read_cycles, dram_data_read_access = self.dram_read(self.num_len, self.hidden_dim, self.bit_width*2) # Read from dram
         if (complex_output): bram_data_write_cycles = self.data_bram.write(self.num_len, self.hidden_dim, self.bit_width*2) # Write fromo bram
         else: bram_data_write_cycles = self.data_bram.write(self.num_len, self.hidden_dim, self.bit_width) # Write fromo bram
         fst_pipeline_cost = max(dram_data_read_cycles, bram_data_write_cycles) 
@@ -396,7 +507,8 @@ class Att_Accelerator:
         # Start to compute the first FC layer
         ############################# Second Level Pipelining #############################
         # Data stay, Coef repeat
-        for i in range(self.num_len):
+        snapshot = self.row_snapshot([self.data_bram, self.coef_bram])
+        for i in range(self.num_sim_row(self.num_len)):
             bram_data_read_cycles = self.data_bram.read(1, self.hidden_dim, self.bit_width, 1, 1) # Read to data bram
             bram_coef_read_cycles = self.coef_bram.read(self.hidden_dim, self.hidden_dim, self.bit_width, 1, 1)
             initial_compute_delay_fc_qeury_ce, fc_query_ce_compute_time = self.q_ce.run(1, self.hidden_dim/4, self.hidden_dim) # Heigh, Width
@@ -404,6 +516,7 @@ class Att_Accelerator:
             initial_compute_delay_fc_value_ce, fc_value_ce_compute_time = self.v_ce.run(1, self.hidden_dim/4, self.hidden_dim) # Heigh, Width
             initial_compute_delay_fc_qk_ce, fc_qk_ce_compute_time = self.qk_ce.run(1, self.hidden_dim/8/self.p_head, self.hidden_dim) # Heigh, Width
             initial_compute_delay_fc_sv_ce, fc_sv_ce_compute_time = self.sv_ce.run(1, self.hidden_dim/8/self.p_head, self.hidden_dim) # Heigh, Width
+        self.repeat_rows(snapshot, self.num_len)
 
         initial_compute_delay_fc = max(initial_compute_delay_fc_qeury_ce, initial_compute_delay_fc_key_ce, initial_compute_delay_fc_value_ce,
                                         initial_compute_delay_fc_qk_ce, initial_compute_delay_fc_sv_ce)
@@ -414,9 +527,47 @@ class Att_Accelerator:
         logging.info("Second-level Pipeline: FC1 takes %d cycles", snd_pipeline_cost)
         logging.info("Initial FC1 (second-level pipeline) takes %d cycles", initial_compute_delay_fc)
 
-        # Simpley add together as that is a single run
-        self.run_cycles += fst_pipeline_cost
-        for i in range(self.num_len):
-            self.run_cycles += snd_pipeline_cost
+        # Simpley add together as that is a single run, the other sequences in the batch only load their data
+        self.run_cycles += fst_pipeline_cost + (self.batch_size - 1) * max(dram_data_read_cycles, bram_data_write_cycles)
+        if self.analytical:
+            self.run_cycles += self.num_len * self.batch_size * snd_pipeline_cost
+        else:
+            for i in range(self.num_len * self.batch_size):
+                self.run_cycles += snd_pipeline_cost
         logging.info("Runtime cost of the FFT on baseline design takes %d cycles"%(self.run_cycles - start_cycle))
-        return self.run_cycles-start_cycle
\ No newline at end of file
+        self.count_batch(dram_data_read_access)
+        self.traffic.end_op(self.run_cycles - start_cycle)
+        return self.run_cycles-start_cycle
+
+def unit_test():
+    # Check the analytical row pipelines against the row-by-row replay
+    configs = [(64, 768, 64, 3072, 64, 8, 1, 2048), (64, 768, 512, 3072, 64, 8, 1, 2048), (64, 1024, 1000, 4096, 64, 8, 4, 2048),
+               (32, 512, 128, 2048, 32, 4, 2, 512), (64, 768, 16, 3072, 64, 8, 1, 2048), (64, 256, 300, 1024, 128, 2, 3, 64)]
+    for head_dim, hidden_dim, num_len, ffn_inner_dim, pv_lt, p_head, batch_size, dram_bw in configs:
+        cycles, traffic = [], []
+        for analytical in [False, True]:
+            design = Att_Accelerator(head_dim, hidden_dim, num_len, ffn_inner_dim, pv_lt=pv_lt, p_head=p_head, batch_size=batch_size,
+                                     dram_bw=dram_bw, analytical=analytical)
+            cycles.append([design.run_att(), design.run_lp(), design.run_fc1(), design.run_fc2(),
+                           design.run_fft(complex_input=False, complex_output=True), design.run_fft(complex_input=True, complex_output=False)])
+            traffic.append(design.traffic.report({"dram_read": 1, "dram_write": 1, "bram_read": 1, "bram_write": 1})["total"])
+        assert all(math.isclose(a, b) for a, b in zip(*cycles)), "Mismatch for %s: %s" % (
+            (head_dim, hidden_dim, num_len, ffn_inner_dim, pv_lt, p_head, batch_size), cycles)
+        assert all(math.isclose(traffic[0][key], traffic[1][key]) for key in ["dram_bytes", "bram_bytes"]), traffic
+    # Pipelines of one and two rows have no steady state
+    for num_row in [1, 2, 3]:
+        cycles = [Att_Accelerator(64, 768, 128, 3072, analytical=analytical).run_score_rows(num_row, 128) for analytical in [False, True]]
+        assert cycles[0] == cycles[1], (num_row, cycles)
+    # Batched reads count the accesses of an Hbm, not its cycles, so the same bytes give the same dram reads as a Dram
+    from hbm import Hbm
+    num_read = []
+    for dram in [Hbm(8), Dram(2048)]:
+        design = Att_Accelerator(64, 768, 512, 3072, batch_size=2, dram=dram, analytical=True)
+        design.run_att(), design.run_lp(), design.run_fc1(), design.run_fc2(), design.run_fft()
+        num_read.append(dram.num_read_access)
+    assert num_read[0] == num_read[1], num_read
+    print ("Analytical model matches the row-by-row replay on %d configurations" % len(configs))
+
+
+if __name__ == "__main__":
+    unit_test()
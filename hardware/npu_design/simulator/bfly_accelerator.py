@@ -1,7 +1,10 @@
 import enum
+import functools
+import numpy as np
 from bram import Bram
 from dram import Dram
 from bfly_engine import bfly_engine
+from traffic_stats import Traffic_Stats
 import logging
 import math
 
@@ -11,16 +14,46 @@ def ceil_power2(x):
     shift_bits = (x-1).bit_length() - 1
     return 2 << shift_bits
 
+def pipeline_drain(num_run, is_last, stage_costs, reuse_cost=None, batch_size=1):
+    # Closed form of the "Calcumulate stage by stage" loops below. stage_costs are ordered from the first to the
+    # last pipeline stage, stage k still has work in iteration i only while i < num_run-(num_stage-1-k)
+    # With batch_size > 1, only every batch_size-th tile loads coefficients, the others cost reuse_cost in the first stage
+    # All the arguments may also be numpy arrays of configurations, evaluated element-wise (see sweep.py)
+    num_stage = len(stage_costs)
+    reuse_cost = stage_costs[0] if reuse_cost is None else reuse_cost
+    num_iter = np.where(is_last, num_run, num_run - 1)
+    drain_cycles = 0
+    for drained in range(num_stage):
+        lo = 1 if drained == 0 else np.maximum(1, num_run - num_stage + drained)
+        hi = np.minimum(num_iter - 1, num_run - num_stage + drained)
+        count = np.maximum(0, hi - lo + 1)
+        if drained == 0:
+            # Tiles seen by the first stage are lo+num_stage-1 .. hi+num_stage-1, every batch_size-th loads coefficients
+            first, last = lo + num_stage - 1, hi + num_stage - 1
+            num_coef = np.where(count > 0, last // batch_size - (first - 1) // batch_size, 0)
+            drain_cycles = drain_cycles + num_coef * functools.reduce(np.maximum, stage_costs) \
+                + (count - num_coef) * functools.reduce(np.maximum, [reuse_cost] + list(stage_costs[1:]))
+        else:
+            drain_cycles = drain_cycles + count * functools.reduce(np.maximum, stage_costs[drained:])
+    return drain_cycles.item() if np.ndim(drain_cycles) == 0 else drain_cycles
+
 class Butterfly_Accelerator:
     def __init__(self, head_dim, hidden_dim, num_len, ffn_inner_dim, parallesm_bu=4, parallesm_be=128, bit_width=16, 
-                    indata_dram_bw=2048, coef_dram_bw=256, outdata_dram_bw=2048):
+                    indata_dram_bw=2048, coef_dram_bw=256, outdata_dram_bw=2048, analytical=False, batch_size=1,
+                    indata_dram=None, coef_dram=None, outdata_dram=None, data_bit_width=None, coef_bit_width=None, acc_bit_width=None):
         self.head_dim = head_dim
         self.hidden_dim = ceil_power2(hidden_dim)
         self.ffn_inner_dim = ceil_power2(ffn_inner_dim)
         self.num_len = num_len
+        self.batch_size = batch_size # Sequences per batch, coefficients are loaded once and reused by all of them
         self.parallesm_bu = parallesm_bu # parallelism of butterfly unite
         self.parallesm_be = parallesm_be # parallelism row of butterfly engine
         self.bit_width = bit_width
+        # Activations in dram, twiddle/butterfly coefficients and intermediate complex values between the butterfly
+        # stages (data brams), all default to bit_width
+        self.data_bit_width = bit_width if data_bit_width is None else data_bit_width
+        self.coef_bit_width = bit_width if coef_bit_width is None else coef_bit_width
+        self.acc_bit_width = bit_width if acc_bit_width is None else acc_bit_width
         self.indata_dram_bw = indata_dram_bw
         self.coef_dram_bw = coef_dram_bw
         self.outdata_dram_bw = outdata_dram_bw
@@ -28,44 +61,93 @@ class Butterfly_Accelerator:
         self.max_length = max(ceil_power2(self.ffn_inner_dim), ceil_power2(self.num_len))
         self.fft_pipeline_stage = 2
         self.bfly_pipeline_stage = 3
+        self.analytical = analytical # Use the closed-form cycle model instead of replaying the pipeline
+        self.trace = None # chrome_trace.Chrome_Trace recording a span per op
         ############################# Define Dram #############################
-        self.indata_dram = Dram(self.indata_dram_bw)
-        self.coef_dram = Dram(self.coef_dram_bw)
-        self.outdata_dram = Dram(self.outdata_dram_bw)
+        # The streams can also be mapped onto a given memory model, e.g. HBM pseudo-channels from hbm.hbm_streams
+        self.indata_dram = Dram(self.indata_dram_bw, "indata_dram") if indata_dram is None else indata_dram
+        self.coef_dram = Dram(self.coef_dram_bw, "coef_dram") if coef_dram is None else coef_dram
+        self.outdata_dram = Dram(self.outdata_dram_bw, "outdata_dram") if outdata_dram is None else outdata_dram
         ############################# Define Bram #############################
         # Each Butterfly engine has two bram banks for Pingpong or Complex/Real
-        # Each bram bank has (2*parallesm_bu) bram. Each bram has width "bit_width" and depth "max_length/(2*parallesm_bu)"
+        # Each bram bank has (2*parallesm_bu) bram. Each bram has width "acc_bit_width" and depth "max_length/(2*parallesm_bu)"
         # height, width_per_bank, number of bank
-        self.data_bram_a = [Bram(self.max_length/(2*self.parallesm_bu), self.bit_width, 2*self.parallesm_bu, "data_bram_a %d"%i) for i in range(self.parallesm_be)]
-        self.data_bram_b = [Bram(self.max_length/(2*self.parallesm_bu), self.bit_width, 2*self.parallesm_bu, "data_bram_b %d"%i) for i in range(self.parallesm_be)]
+        self.data_bram_a = [Bram(self.max_length/(2*self.parallesm_bu), self.acc_bit_width, 2*self.parallesm_bu, "data_bram_a %d"%i) for i in range(self.parallesm_be)]
+        self.data_bram_b = [Bram(self.max_length/(2*self.parallesm_bu), self.acc_bit_width, 2*self.parallesm_bu, "data_bram_b %d"%i) for i in range(self.parallesm_be)]
 
         # Coef BRAM with size hidden_dim * p_h * head_dim * bit_with
-        self.coef_bram = Bram((2*self.max_length)/(4*self.parallesm_bu)*((self.max_length).bit_length()-1), 2*self.bit_width, 4*self.parallesm_bu, "coef_bram") # complex + real
+        self.coef_bram = Bram((2*self.max_length)/(4*self.parallesm_bu)*((self.max_length).bit_length()-1), 2*self.coef_bit_width, 4*self.parallesm_bu, "coef_bram") # complex + real
         
         ####################### Define Compute Engine #########################
         self.bfly_engines = [bfly_engine(self.parallesm_bu) for i in range(self.parallesm_be)]
         logging.info("Numb of butterfly unit per butterply is %d, Numb of butterfly engine is %d"%(self.parallesm_bu, self.parallesm_be))
+        self.traffic = Traffic_Stats([self.indata_dram, self.coef_dram, self.outdata_dram, self.coef_bram] + self.data_bram_a + self.data_bram_b)
 
     def reset_stat(self):
         self.run_cycles = 0
+        for memory in self.traffic.memories: memory.reset_stat()
+        self.traffic.reset()
+
+    def trace_op(self, op_name, start_cycle, **stage_cycles):
+        # Span of the op on the timeline of the design, with the cycles of its pipeline stages per tile
+        if self.trace is not None:
+            self.trace.add(op_name, "bfly_accelerator", "ops", start_cycle, self.run_cycles - start_cycle, op_name, stage_cycles)
+
+    def count_tiles(self, num_run):
+        # The accesses of an op are counted for one tile, scale them to the num_run tiles (coef only once per batch)
+        # The analytical path only counts the data bram of engine 0
+        data_bram_repeat = num_run * self.parallesm_be if self.analytical else num_run
+        self.traffic.repeat_op([self.indata_dram, self.outdata_dram], num_run)
+        self.traffic.repeat_op(self.data_bram_a + self.data_bram_b, data_bram_repeat)
+        self.traffic.repeat_op([self.coef_dram, self.coef_bram], num_run // self.batch_size)
+
+    def fft_tile_costs(self, complex_input=False, complex_output=False):
+        # Cycles of every pipeline stage for one tile (parallesm_be rows) of run_fft, the access statistics are not updated
+        num_stage = (self.hidden_dim).bit_length()-1
+        in_bit_width = 2*self.data_bit_width if complex_input else self.data_bit_width
+        out_bit_width = 2*self.data_bit_width if complex_output else self.data_bit_width
+        return {"num_run": int(math.ceil(float(self.num_len) / self.parallesm_be)) * self.batch_size,
+                "input_data_cycles": max(self.indata_dram.transfer_cycles(self.hidden_dim, self.parallesm_be, in_bit_width), self.hidden_dim),
+                "weight_data_cycles": max(self.coef_dram.transfer_cycles(num_stage, self.hidden_dim, 2*self.coef_bit_width),
+                                          self.coef_bram.access_cycles(num_stage, self.hidden_dim, 2*self.coef_bit_width)),
+                "compute_cycles": max(self.bfly_engines[0].run(self.hidden_dim),
+                                      self.data_bram_a[0].access_cycles(self.hidden_dim, 1, self.acc_bit_width, 1, num_stage)),
+                "output_data_cycles": max(self.outdata_dram.transfer_cycles(self.hidden_dim, self.parallesm_be, out_bit_width), self.hidden_dim),
+                "coef_bram_depth": self.coef_bram.access_cycles(num_stage, self.hidden_dim, 2*self.coef_bit_width)}
+
+    def bfly_tile_costs(self, height, width1, width2):
+        # Cycles of every pipeline stage for one tile (parallesm_be rows) of run_bfly, the access statistics are not updated
+        multi_width = int(width2 / width1) if width1 < width2 else 1
+        width = width1
+        num_stage = (width).bit_length()-1
+        return {"num_run": int(math.ceil(float(height) / self.parallesm_be)) * multi_width * self.batch_size,
+                "input_data_cycles": max(self.indata_dram.transfer_cycles(width, self.parallesm_be, self.data_bit_width), width),
+                "weight_data_cycles": max(self.coef_dram.transfer_cycles(num_stage, 2*width, self.coef_bit_width),
+                                          self.coef_bram.access_cycles(num_stage, 2*width, self.coef_bit_width)),
+                "compute_cycles": max(self.bfly_engines[0].run(width),
+                                      self.data_bram_a[0].access_cycles(width, 1, self.acc_bit_width, 1, num_stage)),
+                "output_data_cycles": max(self.outdata_dram.transfer_cycles(width, self.parallesm_be, self.data_bit_width), width),
+                "coef_bram_depth": self.coef_bram.access_cycles(num_stage, 2*width, self.coef_bit_width)}
 
     def run_fft(self, is_last=False, complex_input=False, complex_output=False):
+        if self.analytical: return self.run_fft_analytical(is_last, complex_input, complex_output)
         current_cycle = self.run_cycles
         logging.info("Running Fourier layer")
-        num_run = int(math.ceil(float(self.num_len) / self.parallesm_be))
+        self.traffic.begin_op("fft")
+        num_run = int(math.ceil(float(self.num_len) / self.parallesm_be)) * self.batch_size
         ############################# First Level Pipelining #############################
         # Get data from dram to bram
-        if (complex_input): dram_data_read_cycles = self.indata_dram.read(self.hidden_dim, self.parallesm_be, 2*self.bit_width) # Read from dram, complex + real
-        else: dram_data_read_cycles = self.indata_dram.read(self.hidden_dim, self.parallesm_be, self.bit_width) # Read from dram
+        if (complex_input): dram_data_read_cycles = self.indata_dram.read(self.hidden_dim, self.parallesm_be, 2*self.data_bit_width) # Read from dram, complex + real
+        else: dram_data_read_cycles = self.indata_dram.read(self.hidden_dim, self.parallesm_be, self.data_bit_width) # Read from dram
         for i in range(self.parallesm_be):
-            self.data_bram_a[i].write(self.hidden_dim, 1, self.bit_width)
-            self.data_bram_b[i].write(self.hidden_dim, 1, self.bit_width)
+            self.data_bram_a[i].write(self.hidden_dim, 1, self.acc_bit_width)
+            self.data_bram_b[i].write(self.hidden_dim, 1, self.acc_bit_width)
         bram_data_write_cycles = self.hidden_dim #  Due to Serial to Parallel module, input data comes in one by one
         input_data_cycles = max(dram_data_read_cycles, bram_data_write_cycles) 
 
         # Get coef from dram to bram
-        dram_coef_read_cycles = self.coef_dram.read((self.hidden_dim).bit_length()-1, self.hidden_dim, 2*self.bit_width) # symmetric, Log(N) * N parameters, complex + real
-        bram_coef_write_cycles = self.coef_bram.write((self.hidden_dim).bit_length()-1, self.hidden_dim, 2*self.bit_width) # symmetric, Log(N) * N parameters, complex + real
+        dram_coef_read_cycles = self.coef_dram.read((self.hidden_dim).bit_length()-1, self.hidden_dim, 2*self.coef_bit_width) # symmetric, Log(N) * N parameters, complex + real
+        bram_coef_write_cycles = self.coef_bram.write((self.hidden_dim).bit_length()-1, self.hidden_dim, 2*self.coef_bit_width) # symmetric, Log(N) * N parameters, complex + real
         weight_data_cycles = max(dram_coef_read_cycles, bram_coef_write_cycles)
         print ("input_data transfer cycles:", input_data_cycles)
         print ("weight_data transfer cycles:", weight_data_cycles)
@@ -75,8 +157,8 @@ class Butterfly_Accelerator:
             bram_a_data_read_cycles = 0
             bram_b_data_read_cycles = 0
             for j in range((self.hidden_dim).bit_length()-1):
-                bram_a_data_read_cycles += self.data_bram_a[i].read(self.hidden_dim, 1, self.bit_width)
-                bram_b_data_read_cycles += self.data_bram_b[i].read(self.hidden_dim, 1, self.bit_width)
+                bram_a_data_read_cycles += self.data_bram_a[i].read(self.hidden_dim, 1, self.acc_bit_width)
+                bram_b_data_read_cycles += self.data_bram_b[i].read(self.hidden_dim, 1, self.acc_bit_width)
             bram_data_read_cycles.append(bram_a_data_read_cycles)
             bram_data_read_cycles.append(bram_b_data_read_cycles)
         bram_data_read_cycles = max(bram_data_read_cycles)
@@ -86,23 +168,25 @@ class Butterfly_Accelerator:
 
         print ("fft compute cycles:", fft_time)
         fst_pipeline_cost = fft_time + max(input_data_cycles, weight_data_cycles)
+        fst_reuse_cost = fft_time + input_data_cycles # The other sequences in the batch reuse the coef
         logging.info("First-level Pipeline: Loading data/coef from Dram and fft computetakes %d cycles", fst_pipeline_cost)
 
-        fst_pipeline_costs = [fst_pipeline_cost for i in range(num_run)]
+        fst_pipeline_costs = [fst_pipeline_cost if i % self.batch_size == 0 else fst_reuse_cost for i in range(num_run)]
         # Padding
         for i in range(self.fft_pipeline_stage-1): fst_pipeline_costs.append(0)
         self.run_cycles += fst_pipeline_costs[0]  # Pipeline, obtain max cycles as the real cycle 
 
         # Output data from bram to dram
-        if (complex_output): dram_data_write_cycles = self.outdata_dram.write(self.hidden_dim, self.parallesm_be, 2*self.bit_width) # Write dram, real + complex
-        else: dram_data_write_cycles = self.outdata_dram.write(self.hidden_dim, self.parallesm_be, self.bit_width) # Write dram, real + complex
+        if (complex_output): dram_data_write_cycles = self.outdata_dram.write(self.hidden_dim, self.parallesm_be, 2*self.data_bit_width) # Write dram, real + complex
+        else: dram_data_write_cycles = self.outdata_dram.write(self.hidden_dim, self.parallesm_be, self.data_bit_width) # Write dram, real + complex
         for i in range(self.parallesm_be):
-            self.data_bram_a[i].read(self.hidden_dim, 1, self.bit_width)
-            self.data_bram_b[i].read(self.hidden_dim, 1, self.bit_width)
+            self.data_bram_a[i].read(self.hidden_dim, 1, self.acc_bit_width)
+            self.data_bram_b[i].read(self.hidden_dim, 1, self.acc_bit_width)
         bram_data_read_cycles =  self.hidden_dim # Due to Parallel to Serial module, output one by one
         output_data_cycles = max(dram_data_write_cycles, bram_data_read_cycles)
 
         snd_pipeline_costs = [output_data_cycles for i in range(num_run)]
+        self.count_tiles(num_run)
         
         ############################# Calcumulate stage by stage in total #############################
         # if not the last layer, the output can be also overlap with the input of next layer, the time spend on last outputing can be saved
@@ -113,30 +197,35 @@ class Butterfly_Accelerator:
         # print (snd_pipeline_costs)
         # print (trd_pipeline_costs)
         logging.info("Runtime cost of FFT takes %d cycles"%(self.run_cycles - current_cycle))
+        self.traffic.end_op(self.run_cycles - current_cycle)
+        self.trace_op("fft", current_cycle, input_data_cycles=input_data_cycles, weight_data_cycles=weight_data_cycles,
+                      compute_cycles=fft_time, output_data_cycles=output_data_cycles)
         logging.info("Total Runtime cost is %d cycles"%(self.run_cycles))
         logging.info("##############")
         return self.run_cycles - current_cycle
 
 
     def run_bfly(self, height, width1, width2,is_last=False, ): # Linear projection layer after attention
+        if self.analytical: return self.run_bfly_analytical(height, width1, width2, is_last)
         current_cycle = self.run_cycles
         logging.info("Running Butterfly layer")
+        self.traffic.begin_op("bfly")
         if width1 < width2: multi_width = int(width2 / width1)
         else: multi_width = 1
-        num_run = int(math.ceil(float(height) / self.parallesm_be)) * multi_width
+        num_run = int(math.ceil(float(height) / self.parallesm_be)) * multi_width * self.batch_size
         width = width1
         ############################# First Level Pipelining #############################
         # Get data from dram to bram
-        dram_data_read_cycles = self.indata_dram.read(width, self.parallesm_be, self.bit_width) # Read from dram
+        dram_data_read_cycles = self.indata_dram.read(width, self.parallesm_be, self.data_bit_width) # Read from dram
         for i in range(self.parallesm_be):
-            self.data_bram_a[i].write(width, 1, self.bit_width)
-            self.data_bram_b[i].write(width, 1, self.bit_width)
+            self.data_bram_a[i].write(width, 1, self.acc_bit_width)
+            self.data_bram_b[i].write(width, 1, self.acc_bit_width)
         bram_data_write_cycles = width #  Due to Serial to Parallel module, input data comes in one by one
         input_data_cycles = max(dram_data_read_cycles, bram_data_write_cycles) 
 
         # Get coef from dram to bram
-        dram_coef_read_cycles = self.coef_dram.read((width).bit_length()-1, 2*width, self.bit_width) # non-symmetric, Log(N) * 2 * N parameters
-        bram_coef_write_cycles = self.coef_bram.write((width).bit_length()-1, 2*width, self.bit_width) # non-Log(N) 2* * N parameters
+        dram_coef_read_cycles = self.coef_dram.read((width).bit_length()-1, 2*width, self.coef_bit_width) # non-symmetric, Log(N) * 2 * N parameters
+        bram_coef_write_cycles = self.coef_bram.write((width).bit_length()-1, 2*width, self.coef_bit_width) # non-Log(N) 2* * N parameters
         weight_data_cycles = max(dram_coef_read_cycles, bram_coef_write_cycles)
         print ("input_data transfer cycles:", input_data_cycles)
         print ("weight_data transfer cycles:", weight_data_cycles)
@@ -145,7 +234,7 @@ class Butterfly_Accelerator:
         fst_pipeline_cost = max(input_data_cycles, weight_data_cycles) 
         logging.info("First-level Pipeline: Loading data/coef from Dram and fft computetakes %d cycles", fst_pipeline_cost)
 
-        fst_pipeline_costs = [fst_pipeline_cost for i in range(num_run)]
+        fst_pipeline_costs = [fst_pipeline_cost if i % self.batch_size == 0 else input_data_cycles for i in range(num_run)]
         # Padding
         for i in range(self.bfly_pipeline_stage-1): fst_pipeline_costs.append(0)
         self.run_cycles += fst_pipeline_costs[0]  # Pipeline, obtain max cycles as the real cycle
@@ -156,8 +245,8 @@ class Butterfly_Accelerator:
             bram_a_data_read_cycles = 0
             bram_b_data_read_cycles = 0
             for j in range((width).bit_length()-1):
-                bram_a_data_read_cycles += self.data_bram_a[i].read(width, 1, self.bit_width)
-                bram_b_data_read_cycles += self.data_bram_b[i].read(width, 1, self.bit_width)
+                bram_a_data_read_cycles += self.data_bram_a[i].read(width, 1, self.acc_bit_width)
+                bram_b_data_read_cycles += self.data_bram_b[i].read(width, 1, self.acc_bit_width)
             bram_data_read_cycles.append(bram_a_data_read_cycles)
             bram_data_read_cycles.append(bram_b_data_read_cycles)
         bram_data_read_cycles = max(bram_data_read_cycles)
@@ -170,18 +259,19 @@ class Butterfly_Accelerator:
 
         snd_pipeline_costs = [snd_pipeline_cost for i in range(num_run)]
         # Padding
-        for i in range(self.fft_pipeline_stage-2): snd_pipeline_costs.append(0)
+        for i in range(self.bfly_pipeline_stage-2): snd_pipeline_costs.append(0)
         self.run_cycles += snd_pipeline_costs[0]  # Pipeline, obtain max cycles as the real cycle 
 
         # Output data from bram to dram
-        dram_data_write_cycles = self.outdata_dram.write(width, self.parallesm_be, self.bit_width) # Write dram, real + complex
+        dram_data_write_cycles = self.outdata_dram.write(width, self.parallesm_be, self.data_bit_width) # Write dram, real + complex
         for i in range(self.parallesm_be):
-            self.data_bram_a[i].read(width, 1, self.bit_width)
-            self.data_bram_b[i].read(width, 1, self.bit_width)
+            self.data_bram_a[i].read(width, 1, self.acc_bit_width)
+            self.data_bram_b[i].read(width, 1, self.acc_bit_width)
         bram_data_read_cycles =  width # Due to Parallel to Serial module, output one by one
         output_data_cycles = max(dram_data_write_cycles, bram_data_read_cycles)
 
         trd_pipeline_costs = [output_data_cycles for i in range(num_run)]
+        self.count_tiles(num_run)
         
         ############################# Calcumulate stage by stage in total #############################
         # if not the last layer, the output can be also overlap with the input of next layer, the time spend on last outputing can be saved
@@ -192,6 +282,144 @@ class Butterfly_Accelerator:
         # print (snd_pipeline_costs)
         # print (trd_pipeline_costs)
         logging.info("Runtime cost of Butterfly takes %d cycles"%(self.run_cycles - current_cycle))
+        self.traffic.end_op(self.run_cycles - current_cycle)
+        self.trace_op("bfly", current_cycle, input_data_cycles=input_data_cycles, weight_data_cycles=weight_data_cycles,
+                      compute_cycles=snd_pipeline_cost, output_data_cycles=output_data_cycles)
         logging.info("Total Runtime cost is %d cycles"%(self.run_cycles))
         logging.info("##############")
         return self.run_cycles - current_cycle
+
+
+    def run_fft_analytical(self, is_last=False, complex_input=False, complex_output=False):
+        # Same cycles as run_fft, but every butterfly engine and every stage is identical, so only
+        # one engine is evaluated and the pipeline is accumulated in closed form
+        current_cycle = self.run_cycles
+        logging.info("Running Fourier layer (analytical)")
+        self.traffic.begin_op("fft")
+        num_run = int(math.ceil(float(self.num_len) / self.parallesm_be)) * self.batch_size
+        num_stage = (self.hidden_dim).bit_length()-1
+        ############################# First Level Pipelining #############################
+        data_bit_width = 2*self.data_bit_width if complex_input else self.data_bit_width
+        dram_data_read_cycles = self.indata_dram.read(self.hidden_dim, self.parallesm_be, data_bit_width)
+        self.data_bram_a[0].write(self.hidden_dim, 1, self.acc_bit_width)
+        self.data_bram_b[0].write(self.hidden_dim, 1, self.acc_bit_width)
+        bram_data_write_cycles = self.hidden_dim #  Due to Serial to Parallel module, input data comes in one by one
+        input_data_cycles = max(dram_data_read_cycles, bram_data_write_cycles)
+
+        dram_coef_read_cycles = self.coef_dram.read(num_stage, self.hidden_dim, 2*self.coef_bit_width) # symmetric, Log(N) * N parameters, complex + real
+        bram_coef_write_cycles = self.coef_bram.write(num_stage, self.hidden_dim, 2*self.coef_bit_width)
+        weight_data_cycles = max(dram_coef_read_cycles, bram_coef_write_cycles)
+
+        # Bram a and b have the same geometry, reading all the stages at once equals to the sum over stages
+        bram_data_read_cycles = max(self.data_bram_a[0].read(self.hidden_dim, 1, self.acc_bit_width, 1, num_stage),
+                                    self.data_bram_b[0].read(self.hidden_dim, 1, self.acc_bit_width, 1, num_stage))
+        fft_compute_time = self.bfly_engines[0].run(self.hidden_dim)
+        fft_time = max(fft_compute_time, bram_data_read_cycles)
+        fst_pipeline_cost = fft_time + max(input_data_cycles, weight_data_cycles)
+        logging.info("First-level Pipeline: Loading data/coef from Dram and fft computetakes %d cycles", fst_pipeline_cost)
+        self.run_cycles += fst_pipeline_cost
+
+        ############################# Second Level Pipelining #############################
+        data_bit_width = 2*self.data_bit_width if complex_output else self.data_bit_width
+        dram_data_write_cycles = self.outdata_dram.write(self.hidden_dim, self.parallesm_be, data_bit_width)
+        self.data_bram_a[0].read(self.hidden_dim, 1, self.acc_bit_width)
+        self.data_bram_b[0].read(self.hidden_dim, 1, self.acc_bit_width)
+        bram_data_read_cycles = self.hidden_dim # Due to Parallel to Serial module, output one by one
+        output_data_cycles = max(dram_data_write_cycles, bram_data_read_cycles)
+        self.count_tiles(num_run)
+
+        self.run_cycles += pipeline_drain(num_run, is_last, [fst_pipeline_cost, output_data_cycles],
+                                          fft_time + input_data_cycles, self.batch_size)
+        logging.info("Runtime cost of FFT takes %d cycles"%(self.run_cycles - current_cycle))
+        self.traffic.end_op(self.run_cycles - current_cycle)
+        self.trace_op("fft", current_cycle, input_data_cycles=input_data_cycles, weight_data_cycles=weight_data_cycles,
+                      compute_cycles=fft_time, output_data_cycles=output_data_cycles)
+        logging.info("Total Runtime cost is %d cycles"%(self.run_cycles))
+        return self.run_cycles - current_cycle
+
+
+    def run_bfly_analytical(self, height, width1, width2, is_last=False):
+        # Same cycles as run_bfly, evaluated on one butterfly engine with the pipeline accumulated in closed form
+        current_cycle = self.run_cycles
+        logging.info("Running Butterfly layer (analytical)")
+        self.traffic.begin_op("bfly")
+        if width1 < width2: multi_width = int(width2 / width1)
+        else: multi_width = 1
+        num_run = int(math.ceil(float(height) / self.parallesm_be)) * multi_width * self.batch_size
+        width = width1
+        num_stage = (width).bit_length()-1
+        ############################# First Level Pipelining #############################
+        dram_data_read_cycles = self.indata_dram.read(width, self.parallesm_be, self.data_bit_width)
+        self.data_bram_a[0].write(width, 1, self.acc_bit_width)
+        self.data_bram_b[0].write(width, 1, self.acc_bit_width)
+        bram_data_write_cycles = width #  Due to Serial to Parallel module, input data comes in one by one
+        input_data_cycles = max(dram_data_read_cycles, bram_data_write_cycles)
+
+        dram_coef_read_cycles = self.coef_dram.read(num_stage, 2*width, self.coef_bit_width) # non-symmetric, Log(N) * 2 * N parameters
+        bram_coef_write_cycles = self.coef_bram.write(num_stage, 2*width, self.coef_bit_width)
+        weight_data_cycles = max(dram_coef_read_cycles, bram_coef_write_cycles)
+        fst_pipeline_cost = max(input_data_cycles, weight_data_cycles)
+        logging.info("First-level Pipeline: Loading data/coef from Dram takes %d cycles", fst_pipeline_cost)
+        self.run_cycles += fst_pipeline_cost
+
+        ############################# Second Level Pipelining #############################
+        bram_data_read_cycles = max(self.data_bram_a[0].read(width, 1, self.acc_bit_width, 1, num_stage),
+                                    self.data_bram_b[0].read(width, 1, self.acc_bit_width, 1, num_stage))
+        bfly_compute_time = self.bfly_engines[0].run(width)
+        snd_pipeline_cost = max(bfly_compute_time, bram_data_read_cycles)
+        logging.info("Second-level Pipeline: Butterfly computation takes %d cycles", snd_pipeline_cost)
+        self.run_cycles += snd_pipeline_cost
+
+        ############################# Third Level Pipelining #############################
+        dram_data_write_cycles = self.outdata_dram.write(width, self.parallesm_be, self.data_bit_width)
+        self.data_bram_a[0].read(width, 1, self.acc_bit_width)
+        self.data_bram_b[0].read(width, 1, self.acc_bit_width)
+        bram_data_read_cycles = width # Due to Parallel to Serial module, output one by one
+        output_data_cycles = max(dram_data_write_cycles, bram_data_read_cycles)
+        self.count_tiles(num_run)
+
+        self.run_cycles += pipeline_drain(num_run, is_last, [fst_pipeline_cost, snd_pipeline_cost, output_data_cycles],
+                                          input_data_cycles, self.batch_size)
+        logging.info("Runtime cost of Butterfly takes %d cycles"%(self.run_cycles - current_cycle))
+        self.traffic.end_op(self.run_cycles - current_cycle)
+        self.trace_op("bfly", current_cycle, input_data_cycles=input_data_cycles, weight_data_cycles=weight_data_cycles,
+                      compute_cycles=snd_pipeline_cost, output_data_cycles=output_data_cycles)
+        logging.info("Total Runtime cost is %d cycles"%(self.run_cycles))
+        return self.run_cycles - current_cycle
+
+
+def unit_test():
+    # Check the analytical model against the pipeline replay
+    import contextlib
+    import io
+    configs = [(768, 3072, 128, 4, 128, 2048, 256, 2048, 1), (1024, 4096, 1024, 4, 120, 2048, 256, 2048, 1),
+               (768, 3072, 512, 4, 20, 64, 64, 128, 1), (1024, 4096, 4000, 8, 64, 2048, 2048, 2048, 1),
+               (64, 64, 4000, 32, 16, 2048, 2048, 2048, 1), (256, 768, 100, 4, 128, 512, 512, 512, 1),
+               (768, 3072, 128, 4, 128, 2048, 256, 2048, 8), (768, 3072, 512, 4, 20, 64, 64, 128, 3),
+               (1024, 4096, 1000, 4, 128, 2048, 64, 2048, 5)]
+    # Data, coefficient and accumulator widths, 12-bit values do not divide the dram bandwidth
+    bit_widths = [(16, 16, 16)] * len(configs) + [(12, 12, 24), (8, 12, 16)]
+    configs += [(768, 3072, 512, 4, 20, 64, 64, 128, 1), (768, 3072, 128, 4, 128, 2048, 256, 2048, 2)]
+    for config, (data_bit_width, coef_bit_width, acc_bit_width) in zip(configs, bit_widths):
+        hidden_dim, ffn_inner_dim, num_len, parallesm_bu, parallesm_be, indata_dram_bw, coef_dram_bw, outdata_dram_bw, batch_size = config
+        for is_last in [False, True]:
+            cycles, traffic = [], []
+            for analytical in [False, True]:
+                design = Butterfly_Accelerator(32, hidden_dim, num_len, ffn_inner_dim, parallesm_bu=parallesm_bu, parallesm_be=parallesm_be,
+                                                indata_dram_bw=indata_dram_bw, coef_dram_bw=coef_dram_bw, outdata_dram_bw=outdata_dram_bw,
+                                                analytical=analytical, batch_size=batch_size, data_bit_width=data_bit_width,
+                                                coef_bit_width=coef_bit_width, acc_bit_width=acc_bit_width)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    cycles.append([design.run_fft(is_last=is_last, complex_input=False, complex_output=True),
+                                   design.run_fft(is_last=is_last, complex_input=True, complex_output=False),
+                                   design.run_bfly(design.num_len, design.hidden_dim, design.ffn_inner_dim, is_last=is_last),
+                                   design.run_bfly(design.num_len, design.ffn_inner_dim, design.hidden_dim, is_last=is_last)])
+                traffic.append(design.traffic.report({"dram_read": 1, "dram_write": 1, "bram_read": 1, "bram_write": 1})["total"])
+            assert all(math.isclose(a, b) for a, b in zip(*cycles)), "Mismatch for %s: %s" % (
+                (hidden_dim, ffn_inner_dim, num_len, parallesm_bu, parallesm_be, batch_size, is_last), cycles)
+            assert all(math.isclose(traffic[0][key], traffic[1][key]) for key in ["dram_bytes", "bram_bytes"]), traffic
+    print ("Analytical model matches the pipeline replay on %d configurations" % (2*len(configs)))
+
+
+if __name__ == "__main__":
+    unit_test()
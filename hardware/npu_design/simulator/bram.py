@@ -15,6 +15,15 @@ class Bram:
         self.num_read_access = 0
         self.num_write_access = 0
 
+    def add_stat(self, num_read_access=0, num_write_access=0): # Accesses of transfers that are repeated without being re-simulated
+        self.num_read_access += num_read_access
+        self.num_write_access += num_write_access
+
+    def access_cycles(self, height, width, bit_width, num_reuse=1, num_repeat=1): # Without counting the access
+        depth = (width * bit_width) / self.bram_width
+        assert depth * height <= self.bram_height
+        return depth * height * num_reuse * num_repeat
+
     def read(self, read_height, read_width, bit_width, num_reuse=1, num_repeat=1):
         #assert (read_width * bit_width) % self.bram_width == 0, "%d, %d, %d" % (read_width, bit_width, self.bram_width)
         read_depth = (read_width * bit_width) / self.bram_width  # If read width * bitwidth larege than bram width, split the data
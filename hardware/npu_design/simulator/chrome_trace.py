@@ -0,0 +1,44 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Chrome_Trace:
+    """
+    Timeline of the simulated stages in the Chrome trace event format, open it with chrome://tracing or ui.perfetto.dev
+    like the traces of prof.export_chrome_trace. Every event is a complete event ("ph": "X") on a process/thread pair,
+    e.g. ("event_sim", "indata_dram"). Cycles are converted to us with the design frequency in MHz.
+    """
+    def __init__(self, frequency=200):
+        self.frequency = frequency
+        self.events = []
+        self.processes = {}
+        self.threads = {}
+
+    def _pid(self, process):
+        if process not in self.processes:
+            self.processes[process] = len(self.processes)
+            self.events.append({"name": "process_name", "ph": "M", "pid": self.processes[process], "args": {"name": process}})
+        return self.processes[process]
+
+    def _tid(self, process, thread):
+        pid = self._pid(process)
+        if (process, thread) not in self.threads:
+            self.threads[(process, thread)] = len(self.threads)
+            self.events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": self.threads[(process, thread)], "args": {"name": thread}})
+            # Keep the threads in creation order
+            self.events.append({"name": "thread_sort_index", "ph": "M", "pid": pid, "tid": self.threads[(process, thread)],
+                                "args": {"sort_index": self.threads[(process, thread)]}})
+        return self.threads[(process, thread)]
+
+    def add(self, name, process, thread, start_cycle, duration_cycles, category="", args=None):
+        event = {"name": name, "cat": category, "ph": "X", "pid": self._pid(process), "tid": self._tid(process, thread),
+                 "ts": start_cycle / self.frequency, "dur": duration_cycles / self.frequency}
+        if args: event["args"] = args
+        self.events.append(event)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ns"}, f)
+        logging.info("Saved %d trace events to %s" % (len(self.events), path))
@@ -0,0 +1,190 @@
+from bfly_accelerator import Butterfly_Accelerator
+from event_sim import Event_Pipeline
+from resource_model import bfly_resources, fits_board
+from sweep import sweep_bfly
+import argparse
+import bisect
+import glob
+import json
+import logging
+import os
+import re
+import numpy as np
+
+logger = logging.getLogger()
+
+# Log files written by software/accuracy/code/run_tasks.py
+LOG_NAME = re.compile(r"(?P<task>.+)_output_ratio(?P<ratio>[0-9_]+)_layer(?P<layer>\d+)_dim(?P<dim>\d+)_prob(?P<prob>[0-9_]+)\.log$")
+
+
+def load_accuracy_logs(log_dir, task=None):
+    """
+    Read the test accuracy (in %) of every model trained by run_tasks.py in log_dir.
+    Returns a dict {(ffn_ratio, hidden_dim, num_layer): accuracy}, the last test summary of each log is used.
+    """
+    accuracy = {}
+    for path in sorted(glob.glob(os.path.join(log_dir, "*.log"))):
+        match = LOG_NAME.match(os.path.basename(path))
+        if match is None or (task is not None and not match.group("task").startswith(task + "_")): continue
+        test_accu = None
+        with open(path) as f:
+            for line in f:
+                try: summary = json.loads(line)
+                except ValueError: continue
+                if summary.get("component") == "test": test_accu = summary["accu"]
+        if test_accu is None: continue
+        key = (float(match.group("ratio").replace("_", ".")), int(match.group("dim")), int(match.group("layer")))
+        accuracy[key] = 100 * test_accu
+    logging.info("Loaded the accuracy of %d models from %s" % (len(accuracy), log_dir))
+    return accuracy
+
+
+def pareto_mask(costs):
+    # Mask of the pareto-efficient points of an (n_points, 2) array of costs to minimize, O(n log n)
+    costs = np.asarray(costs)
+    order = np.lexsort((costs[:, 1], costs[:, 0]))
+    mask = np.zeros(len(costs), dtype=bool)
+    best = np.inf
+    for i in order:
+        if costs[i, 1] < best:
+            mask[i] = True
+            best = costs[i, 1]
+    return mask
+
+
+class Pareto_Front:
+    """
+    Incremental latency/accuracy front, kept sorted by increasing latency (and so increasing accuracy).
+    Every insertion costs O(log n) plus the number of points it removes from the front.
+    """
+    def __init__(self):
+        self.latency = []
+        self.accuracy = []
+        self.points = []
+
+    def __len__(self):
+        return len(self.points)
+
+    def dominates(self, latency, accuracy):
+        # True if a point of the front is at least as fast and as accurate
+        i = bisect.bisect_right(self.latency, latency)
+        return i > 0 and self.accuracy[i-1] >= accuracy
+
+    def add(self, latency, accuracy, point=None):
+        if self.dominates(latency, accuracy): return False
+        i = bisect.bisect_left(self.latency, latency)
+        j = i
+        while j < len(self.latency) and self.accuracy[j] <= accuracy: j += 1
+        self.latency[i:j] = [latency]
+        self.accuracy[i:j] = [accuracy]
+        self.points[i:j] = [point]
+        return True
+
+
+def event_latency(hidden_dim, ffn_inner_dim, num_len, parallesm_bu, parallesm_be, dram_bw, num_layer,
+                  head_dim=32, frequency=200, efficiency=0.85, shared_dram=False):
+    # Latency (ms) of the network with the discrete-event pipeline model
+    design = Butterfly_Accelerator(head_dim, hidden_dim, num_len, ffn_inner_dim, parallesm_bu=parallesm_bu, parallesm_be=parallesm_be,
+                                    indata_dram_bw=dram_bw, coef_dram_bw=dram_bw, outdata_dram_bw=dram_bw, analytical=True)
+    event_design = Event_Pipeline(design, shared_dram=shared_dram)
+    event_design.run_fft(complex_input=False, complex_output=True) # 1st dimension FFT
+    event_design.run_fft(complex_input=True, complex_output=False) # 2nd dimension FFT
+    event_design.run_bfly(design.num_len, design.hidden_dim, design.ffn_inner_dim)
+    event_design.run_bfly(design.num_len, design.ffn_inner_dim, design.hidden_dim)
+    ms_per_clock = (1.0/frequency/1000) / efficiency
+    return num_layer * event_design.run_cycles * ms_per_clock
+
+
+def search(accuracy, num_len, num_be, dram_bws, total_bu=512, head_dim=32, frequency=200, efficiency=0.85,
+           evaluate=None, min_accuracy=0.0, bound_slack=0.05, board=None):
+    """
+    Branch-and-bound search of the latency/accuracy front over the models in accuracy (see load_accuracy_logs)
+    and the hardware configurations (num_be butterfly engines sharing total_bu butterfly units, dram_bws).
+    The closed-form model of all the points is computed at once with sweep_bfly and used as a lower bound of the latency.
+    The event model overlaps the ping-pong buffers slightly better than the closed form (up to ~2%), so the bound is
+    relaxed by bound_slack to stay below the evaluated latency.
+    Points are visited by increasing bound, a point is evaluated with evaluate(**config) (e.g. event_latency) only when
+    its bound is not dominated by the front so far, the other ones are pruned.
+    With evaluate=None, the closed-form latency is used directly and nothing needs to be re-evaluated.
+    With board, the hardware configurations that do not fit the board are discarded before the search.
+    Returns the front as a list of dicts and the number of evaluated points.
+    """
+    models = [(key, acc) for key, acc in accuracy.items() if acc >= min_accuracy]
+    if not models: return [], 0
+    model_grid, be_grid, bw_grid = np.meshgrid(np.arange(len(models)), np.asarray(num_be), np.asarray(dram_bws), indexing="ij")
+    model_grid, be_grid, bw_grid = model_grid.ravel(), be_grid.ravel(), bw_grid.ravel()
+    ratio = np.array([key[0] for key, _ in models])[model_grid]
+    hidden_dim = np.array([key[1] for key, _ in models])[model_grid]
+    num_layer = np.array([key[2] for key, _ in models])[model_grid]
+    acc = np.array([acc for _, acc in models])[model_grid]
+    ffn_inner_dim = (hidden_dim * ratio).astype(np.int64)
+    bound = sweep_bfly(head_dim, hidden_dim, num_len, ffn_inner_dim, parallesm_bu=total_bu // be_grid, parallesm_be=be_grid,
+                       indata_dram_bw=bw_grid, coef_dram_bw=bw_grid, outdata_dram_bw=bw_grid, num_layer=num_layer,
+                       frequency=frequency, efficiency=efficiency)["latency_ms"]
+    if board is not None:
+        feasible, _ = fits_board(bfly_resources(hidden_dim, num_len, ffn_inner_dim, total_bu // be_grid, be_grid), board)
+        bound = np.where(feasible, bound, np.inf)
+
+    front = Pareto_Front()
+    num_eval = 0
+    for i in np.argsort(bound, kind="stable"):
+        if np.isinf(bound[i]): break # Only infeasible designs left
+        if front.dominates(bound[i] * (1 - bound_slack), acc[i]): continue
+        config = {"hidden_dim": int(hidden_dim[i]), "ffn_inner_dim": int(ffn_inner_dim[i]), "num_len": num_len,
+                  "parallesm_bu": total_bu // int(be_grid[i]), "parallesm_be": int(be_grid[i]), "dram_bw": int(bw_grid[i]),
+                  "num_layer": int(num_layer[i])}
+        if evaluate is None:
+            latency = float(bound[i])
+        else:
+            latency = evaluate(head_dim=head_dim, frequency=frequency, efficiency=efficiency, **config)
+            num_eval += 1
+        front.add(latency, float(acc[i]), dict(config, latency_ms=latency, accuracy=float(acc[i])))
+    logging.info("Front of %d points out of %d candidates, %d evaluated" % (len(front), len(bound), num_eval))
+    return front.points, num_eval
+
+
+def main(args):
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+    accuracy = load_accuracy_logs(args.log_dir, args.task or None)
+    evaluate = None
+    if args.fidelity == "event":
+        evaluate = lambda **config: event_latency(shared_dram=args.shared_dram, **config)
+    front, num_eval = search(accuracy, args.num_len, args.num_be, args.dram_bw, total_bu=args.total_bu, head_dim=args.head_dim,
+                             frequency=args.frequency, efficiency=args.efficiency, evaluate=evaluate, min_accuracy=args.min_accuracy,
+                             bound_slack=args.bound_slack, board=args.board or None)
+    for point in front:
+        print ("latency %.3f ms, accuracy %.2f%%: ratio %.1f, hidden_dim %d, num_layer %d, parallesm_be %d, dram_bw %d"
+               % (point["latency_ms"], point["accuracy"], point["ffn_inner_dim"] / point["hidden_dim"], point["hidden_dim"],
+                  point["num_layer"], point["parallesm_be"], point["dram_bw"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"front": front, "num_eval": num_eval}, f, indent=2)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--log_dir", default="../../../software/accuracy/logs/", type=str, help="Directory of the run_tasks.py logs")
+    parser.add_argument("--task", default="", type=str, help="Only use the logs of this task, e.g. text")
+    parser.add_argument("--head_dim", default=32, type=int, help="Dimension per head")
+    parser.add_argument("--num_len", default=4000, type=int, help="Lengh of input sequence")
+    parser.add_argument("--num_be", default=[128, 64, 32, 16], type=int, nargs="+", help="Candidate numbers of butterfly engines")
+    parser.add_argument("--total_bu", default=512, type=int, help="Butterfly units shared by all the butterfly engines")
+    parser.add_argument("--dram_bw", default=[2048], type=int, nargs="+", help="Candidate dram bandwidths")
+    parser.add_argument("--min_accuracy", default=0.0, type=float, help="Accuracy constraint (%%)")
+    parser.add_argument("--bound_slack", default=0.05, type=float, help="Relative slack of the closed-form latency bound")
+    parser.add_argument("--fidelity", default="analytical", type=str, help="analytical or event")
+    parser.add_argument("--shared_dram", action="store_true", help="Map the dram streams onto one channel in the event model")
+    parser.add_argument("--board", default="", type=str, help="Discard the designs that do not fit this FPGA board, e.g. vcu128 or zynq7045")
+    parser.add_argument("--frequency", default=200, type=int, help="The frequency of the design")
+    parser.add_argument("--efficiency", default=0.85, type=float, help="The hardware implementation efficiency")
+    parser.add_argument("--output", default="", type=str, help="Dump the front to this json file")
+    parser.add_argument("--debug", action="store_true")
+
+    args = parser.parse_args()
+
+    main(args)
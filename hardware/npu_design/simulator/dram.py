@@ -3,8 +3,9 @@ import logging
 logger = logging.getLogger(__name__)
 
 class Dram:
-    def __init__(self, bandwidth):
+    def __init__(self, bandwidth, dram_name="dram"):
         self.bandwidth = bandwidth
+        self.dram_name = dram_name
         self.num_read_access = 0 # Leave for ASIC simulation
         self.num_write_access = 0 # Leave for ASIC simulation
 
@@ -12,17 +13,28 @@ class Dram:
         self.num_read_access = 0
         self.num_write_access = 0
 
+    def add_stat(self, num_read_access=0, num_write_access=0): # Accesses of transfers that are repeated without being re-simulated
+        self.num_read_access += num_read_access
+        self.num_write_access += num_write_access
+
+    def pack_factor(self, bit_width):
+        # Elements per access, an element never straddles two accesses (e.g. 170 x 12-bit values per 2048-bit access)
+        assert self.bandwidth >= bit_width
+        return self.bandwidth // bit_width
+
+    def transfer_cycles(self, height, width, bit_width): # Cycles of a continuos transfer, without counting the access
+        pack_factor = self.pack_factor(bit_width)
+        return int(math.ceil(width * height / pack_factor))
+
     def read(self, read_height, read_width, bit_width): # Continuos read
-        assert self.bandwidth % bit_width == 0
-        pack_read_factor = self.bandwidth // bit_width
+        pack_read_factor = self.pack_factor(bit_width)
         self.num_read_access += int(math.ceil(read_width * read_height / pack_read_factor))
         read_cycle = int(math.ceil(read_width * read_height / pack_read_factor))
         logging.debug("Reading %d x %d from Dram (bandwidth %d) takes %d cycles"%(read_height, read_width, self.bandwidth, read_cycle))
         return read_cycle
 
     def write(self, write_height, write_width, bit_width): # Continuos read
-        assert self.bandwidth % bit_width == 0
-        pack_write_factor = self.bandwidth // bit_width
+        pack_write_factor = self.pack_factor(bit_width)
         self.num_write_access += int(math.ceil(write_width * write_height / pack_write_factor))
         write_cycle = int(math.ceil(write_width * write_height / pack_write_factor))
         logging.debug("Writing %d x %d from Dram (bandwidth %d) to Dram takes %d cycles"%(write_height, write_width, self.bandwidth, write_cycle))
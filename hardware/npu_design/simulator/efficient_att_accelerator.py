@@ -0,0 +1,133 @@
+from att_accelerator import Att_Accelerator
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+
+class Linformer_Accelerator(Att_Accelerator):
+    """
+    Linformer attention (see software/accuracy/code/attention_linformer.py) on the engines of Att_Accelerator.
+    The keys and values of every head are projected to linformer_k rows by E (linformer_k x num_len per head):
+    E is streamed from dram while the linear transformation produces the keys/values, and every row is accumulated
+    into the projected rows by the key/value engines. The queries then attend to linformer_k keys only, so the
+    score brams hold num_len x linformer_k scores.
+    """
+    def __init__(self, head_dim, hidden_dim, num_len, ffn_inner_dim, linformer_k=256, **kwargs):
+        assert linformer_k <= num_len, "The projected length should not exceed the sequence length"
+        self.linformer_k = linformer_k
+        Att_Accelerator.__init__(self, head_dim, hidden_dim, num_len, ffn_inner_dim, **kwargs)
+
+    def num_score(self):
+        return self.num_len * self.linformer_k
+
+    def run_kv_projection(self):
+        dram_proj_read_cycles = self.dram.read(self.p_head * self.linformer_k, self.num_len, self.bit_width)
+        _, key_proj_time = self.k_ce.run(self.num_len, self.head_dim * self.p_head, self.linformer_k)
+        _, value_proj_time = self.v_ce.run(self.num_len, self.head_dim * self.p_head, self.linformer_k)
+        for i in range(self.p_head):
+            bram_key_write_cycles = self.key_brams[i].write(self.linformer_k, self.head_dim, self.bit_width)
+            bram_value_write_cycles = self.value_brams[i].write(self.linformer_k, self.head_dim, self.bit_width)
+        logging.info("Linformer projection of keys/values takes %d cycles, loading E takes %d cycles"
+                     % (max(key_proj_time, value_proj_time), dram_proj_read_cycles))
+        return max(key_proj_time, value_proj_time), max(dram_proj_read_cycles, bram_key_write_cycles, bram_value_write_cycles)
+
+    def run_att_rows(self):
+        return self.run_score_rows(self.num_len, self.linformer_k)
+
+
+class Nystrom_Accelerator(Att_Accelerator):
+    """
+    Nystrom attention (see software/accuracy/code/attention_nystrom.py) on the engines of Att_Accelerator.
+    The num_landmarks landmark queries/keys are segment means, accumulated while the linear transformation writes Q/K.
+    Every head group then runs, on the QK/SV engines:
+    - kernel_3 * V: the landmark queries against all the keys (num_landmarks x num_len scores)
+    - kernel_2: the landmark queries against the landmark keys, and its iterative pseudo-inverse
+      (inv_iters iterations of 4 dependent num_landmarks^3 products, split over the QK and SV engines)
+    - W = pinv(kernel_2) * (kernel_3 * V)
+    - kernel_1 * W: all the queries against the landmark keys, plus the depthwise convolution of V (conv_kernel_size
+      taps, 0 without convolution) on the SV engines
+    The score brams hold num_len x num_landmarks scores.
+    """
+    def __init__(self, head_dim, hidden_dim, num_len, ffn_inner_dim, num_landmarks=64, conv_kernel_size=35, inv_iters=6, **kwargs):
+        assert num_landmarks <= num_len, "There should not be more landmarks than tokens"
+        self.num_landmarks = num_landmarks
+        self.conv_kernel_size = conv_kernel_size
+        self.inv_iters = inv_iters
+        Att_Accelerator.__init__(self, head_dim, hidden_dim, num_len, ffn_inner_dim, **kwargs)
+
+    def num_score(self):
+        return self.num_len * self.num_landmarks
+
+    def run_pinv(self):
+        # Iterative pseudo-inverse of kernel_2, the intermediate matrices stay in the score brams
+        m = self.num_landmarks
+        num_product = 4 * self.inv_iters
+        initial_compute_delay, product_time = self.qk_ce.run(m, m, m)
+        snapshot = self.row_snapshot(self.score_brams)
+        for i in range(self.p_head):
+            bram_score_read_cycles = self.score_brams[i].read(m, m, self.bit_width, 1, 2) # Both operands
+            bram_score_write_cycles = self.score_brams[i].write(m, m, self.bit_width)
+        self.repeat_accesses(snapshot, num_product)
+        product_cycles = initial_compute_delay + max(product_time / 2, bram_score_read_cycles, bram_score_write_cycles)
+        logging.info("Pseudo-inverse of the %d x %d landmark kernel takes %d cycles" % (m, m, num_product * product_cycles))
+        return num_product * product_cycles
+
+    def run_att_rows(self):
+        m = self.num_landmarks
+        k3_cycles, k3_overlap_cycles = self.run_score_rows(m, self.num_len)
+        k2_cycles, k2_overlap_cycles = self.run_score_rows(m, m)
+        pinv_cycles = self.run_pinv()
+        initial_compute_delay_w, w_compute_time = self.sv_ce.run(m, self.head_dim, m)
+        w_cycles = initial_compute_delay_w + w_compute_time
+        k1_cycles, k1_overlap_cycles = self.run_score_rows(self.num_len, m, sv_len=m + self.conv_kernel_size)
+        logging.info("Nystrom attention: kernel_3 %d, kernel_2 %d, pinv %d, W %d, kernel_1 %d cycles"
+                     % (k3_cycles, k2_cycles, pinv_cycles, w_cycles, k1_cycles))
+        # The passes depend on each other, only the pipeline fill of the first one overlaps with the previous group
+        return (k3_cycles + k2_cycles + pinv_cycles + w_cycles + k1_cycles,
+                k3_overlap_cycles + k2_cycles + pinv_cycles + w_cycles + k1_cycles)
+
+
+# Engine class and its own keyword arguments of make_att_accelerator
+ATTENTION_ENGINES = {"dense": (Att_Accelerator, []),
+                     "linformer": (Linformer_Accelerator, ["linformer_k"]),
+                     "nystrom": (Nystrom_Accelerator, ["num_landmarks", "conv_kernel_size"])}
+
+
+def make_att_accelerator(attention, head_dim, hidden_dim, num_len, ffn_inner_dim, linformer_k=256, num_landmarks=64,
+                         conv_kernel_size=35, **kwargs):
+    # Attention accelerator of the given engine type, kwargs (parallelism, dram_bw, batch_size, ...) go to Att_Accelerator
+    if attention not in ATTENTION_ENGINES:
+        raise NotImplementedError("Not supported attention %s" % attention)
+    engine, engine_params = ATTENTION_ENGINES[attention]
+    params = {"linformer_k": linformer_k, "num_landmarks": num_landmarks, "conv_kernel_size": conv_kernel_size}
+    kwargs.update({name: params[name] for name in engine_params})
+    return engine(head_dim, hidden_dim, num_len, ffn_inner_dim, **kwargs)
+
+
+def unit_test():
+    for attention in ["linformer", "nystrom"]:
+        for num_len in [256, 1024]:
+            cycles, traffic = [], []
+            for analytical in [False, True]:
+                design = make_att_accelerator(attention, 64, 768, num_len, 3072, linformer_k=128, num_landmarks=32, analytical=analytical)
+                cycles.append(design.run_att())
+                traffic.append(design.traffic.report({"dram_read": 1, "dram_write": 1, "bram_read": 1, "bram_write": 1})["total"])
+            assert math.isclose(cycles[0], cycles[1]), (attention, num_len, cycles)
+            assert all(math.isclose(traffic[0][key], traffic[1][key]) for key in ["dram_bytes", "bram_bytes"]), traffic
+    # Both engines are linear in the sequence length, dense attention is quadratic
+    for attention in ATTENTION_ENGINES:
+        short, long = [make_att_accelerator(attention, 64, 768, num_len, 3072, analytical=True).run_att() for num_len in [2048, 8192]]
+        print ("%s attention: %d cycles at 2048 tokens, %.2fx at 8192 tokens" % (attention, short, long / short))
+    assert type(make_att_accelerator("nystrom", 64, 768, 256, 3072, num_landmarks=16)) is Nystrom_Accelerator
+    try:
+        make_att_accelerator("performer", 64, 768, 256, 3072)
+        assert False, "Unknown attention engine"
+    except NotImplementedError:
+        pass
+    dense = make_att_accelerator("dense", 64, 768, 8192, 3072, analytical=True).run_att()
+    assert all(make_att_accelerator(attention, 64, 768, 8192, 3072, analytical=True).run_att() < dense for attention in ["linformer", "nystrom"])
+
+
+if __name__ == "__main__":
+    unit_test()
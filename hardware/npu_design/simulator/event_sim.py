@@ -0,0 +1,151 @@
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Resource:
+    # A server with "capacity" identical units and a FIFO queue, e.g. a DRAM channel, the butterfly engines or the ping-pong buffers
+    def __init__(self, sim, name, capacity=1):
+        self.sim = sim
+        self.name = name
+        self.capacity = capacity
+        self.in_use = 0
+        self.queue = []
+        self.busy_cycles = 0 # Sum over units of the occupied cycles
+        self.wait_cycles = 0 # Sum over requests of the queueing cycles
+        self.num_requests = 0
+
+    def request(self, duration, callback):
+        # Occupy one unit for "duration" cycles (None: until release is called), then call callback(start_time)
+        self.num_requests += 1
+        if self.in_use < self.capacity:
+            self._start(self.sim.now, self.sim.now, duration, callback)
+        else:
+            self.queue.append((self.sim.now, duration, callback))
+
+    def _start(self, arrive_time, start_time, duration, callback):
+        self.in_use += 1
+        self.wait_cycles += start_time - arrive_time
+        if duration is not None:
+            self.busy_cycles += duration
+            self.sim.schedule(start_time + duration, self.release)
+        callback(start_time)
+
+    def release(self, hold_cycles=None):
+        if hold_cycles is not None: self.busy_cycles += hold_cycles
+        self.in_use -= 1
+        if self.queue:
+            arrive_time, duration, callback = self.queue.pop(0)
+            self._start(arrive_time, self.sim.now, duration, callback)
+
+
+class EventSimulator:
+    # Heap-based discrete-event scheduler
+    def __init__(self):
+        self.now = 0
+        self.events = []
+        self.num_events = 0
+
+    def schedule(self, time, handler, *args):
+        heapq.heappush(self.events, (time, self.num_events, handler, args))
+        self.num_events += 1
+
+    def run(self):
+        while self.events:
+            self.now, _, handler, args = heapq.heappop(self.events)
+            handler(*args)
+        return self.now
+
+
+class Event_Pipeline:
+    """
+    Discrete-event model of the butterfly accelerator pipeline. Every tile of parallesm_be rows goes through
+    load (indata + coef Dram), butterfly compute and store (outdata Dram), holding one of the ping-pong data
+    buffers (data_bram_a/b) from the start of its load to the end of its store.
+    With shared_dram=True the three Dram streams are mapped onto one physical channel (e.g. DDR3) and contend for it.
+    The per-tile cycles are taken from fft_tile_costs/bfly_tile_costs of the given Butterfly_Accelerator.
+    With a trace (chrome_trace.Chrome_Trace), every stage occurrence is recorded on the timeline of its resource,
+    per_engine also records the compute of every butterfly engine (they run in lockstep on the rows of a tile).
+    """
+    def __init__(self, design, num_buffers=2, shared_dram=False, trace=None, per_engine=False):
+        self.design = design
+        self.num_buffers = num_buffers
+        self.shared_dram = shared_dram
+        self.trace = trace
+        self.per_engine = per_engine
+        self.run_cycles = 0
+        self.stats = []
+
+    def _trace_stage(self, op_name, thread, stage, tile, start, duration):
+        name = "%s %s tile %d" % (op_name, stage, tile)
+        threads = [thread]
+        if thread == "bfly_engines" and self.per_engine:
+            threads = ["bfly_engine %d" % i for i in range(self.design.parallesm_be)]
+        for thread in threads:
+            self.trace.add(name, "event_sim", thread, self.run_cycles + start, duration, op_name, {"tile": tile, "stage": stage})
+
+    def _simulate(self, op_name, num_run, input_cycles, coef_cycles, compute_cycles, output_cycles):
+        sim = EventSimulator()
+        buffers = Resource(sim, "data_bram", self.num_buffers)
+        if self.shared_dram:
+            indata_dram = coef_dram = outdata_dram = Resource(sim, "dram")
+        else:
+            indata_dram = Resource(sim, "indata_dram")
+            coef_dram = Resource(sim, "coef_dram")
+            outdata_dram = Resource(sim, "outdata_dram")
+        engines = Resource(sim, "bfly_engines")
+        buffer_start = {}
+
+        def occupy(resource, duration, stage, tile, handler):
+            # Hold one unit of the resource for duration cycles, then call handler(tile)
+            def started(start):
+                if self.trace is not None: self._trace_stage(op_name, resource.name, stage, tile, start, duration)
+                sim.schedule(start + duration, handler, tile)
+            resource.request(duration, started)
+
+        def load(tile, start):
+            buffer_start[tile] = start
+            load_coef = tile % self.design.batch_size == 0 # The other sequences in the batch reuse the coef
+            pending = [2 if load_coef else 1]
+            def loaded(_):
+                pending[0] -= 1
+                if pending[0] == 0: occupy(engines, compute_cycles, "compute", tile, store)
+            occupy(indata_dram, input_cycles, "load input", tile, loaded)
+            if load_coef: occupy(coef_dram, coef_cycles, "load coef", tile, loaded)
+            # Tiles are issued in order, the next one waits for a free buffer
+            if tile + 1 < num_run: buffers.request(None, lambda s: load(tile + 1, s))
+
+        def store(tile):
+            occupy(outdata_dram, output_cycles, "writeback", tile, done)
+
+        def done(tile):
+            hold_cycles = sim.now - buffer_start.pop(tile)
+            if self.trace is not None:
+                # Tiles take the ping-pong buffers in turn
+                self._trace_stage(op_name, "data_bram %d" % (tile % self.num_buffers), "buffer", tile, sim.now - hold_cycles, hold_cycles)
+            buffers.release(hold_cycles)
+
+        if num_run > 0: buffers.request(None, lambda s: load(0, s))
+        cycles = sim.run()
+        resources = [buffers, engines] + ([indata_dram] if self.shared_dram else [indata_dram, coef_dram, outdata_dram])
+        stat = {"op": op_name, "cycles": cycles, "num_run": num_run, "num_events": sim.num_events,
+                "resources": {r.name: {"busy_cycles": r.busy_cycles, "wait_cycles": r.wait_cycles,
+                                       "utilization": r.busy_cycles / (r.capacity * cycles) if cycles else 0.0}
+                              for r in resources}}
+        bottleneck = max([r for r in resources if r is not buffers], key=lambda r: r.busy_cycles)
+        logging.info("Event-driven %s takes %d cycles over %d tiles, bottleneck %s (utilization %.2f)"
+                     % (op_name, cycles, num_run, bottleneck.name, stat["resources"][bottleneck.name]["utilization"]))
+        self.stats.append(stat)
+        self.run_cycles += cycles
+        return cycles
+
+    def run_fft(self, complex_input=False, complex_output=False):
+        costs = self.design.fft_tile_costs(complex_input, complex_output)
+        return self._simulate("fft", costs["num_run"], costs["input_data_cycles"], costs["weight_data_cycles"],
+                                costs["compute_cycles"], costs["output_data_cycles"])
+
+    def run_bfly(self, height, width1, width2):
+        costs = self.design.bfly_tile_costs(height, width1, width2)
+        return self._simulate("bfly", costs["num_run"], costs["input_data_cycles"], costs["weight_data_cycles"],
+                                costs["compute_cycles"], costs["output_data_cycles"])
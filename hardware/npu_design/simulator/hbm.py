@@ -0,0 +1,126 @@
+from dram import Dram
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# HBM of the VCU128 (xcvu37p): two stacks of 16 pseudo-channels, each with a 256-bit AXI port (see acc_top.v)
+HBM_NUM_PSEUDO_CHANNELS = 32
+HBM_CHANNEL_WIDTH = 256
+
+
+class Hbm(Dram):
+    """
+    Off-chip stream mapped onto num_channels HBM pseudo-channels, a drop-in replacement of Dram.
+    A transfer is a continuous block of addresses interleaved over the channels every interleave_bytes,
+    so the slowest channel gets ceil(num_chunks/num_channels) chunks.
+    Every channel moves channel_width bits per cycle in bursts of burst_length beats, with burst_overhead idle cycles
+    between bursts. Opening a row costs row_miss_cycles, the first access of a transfer also waits row_hit_cycles (CAS).
+    With bank_interleave, consecutive rows are in different banks and the next row is opened while the current one
+    is streamed, otherwise every row change is a bank conflict and exposes the whole row_miss_cycles.
+    """
+    def __init__(self, num_channels, dram_name="hbm", channel_width=HBM_CHANNEL_WIDTH, burst_length=8, burst_overhead=1,
+                    row_bytes=1024, row_hit_cycles=7, row_miss_cycles=12, interleave_bytes=256, bank_interleave=True):
+        Dram.__init__(self, num_channels * channel_width, dram_name)
+        self.num_channels = num_channels
+        self.channel_width = channel_width
+        self.burst_length = burst_length
+        self.burst_overhead = burst_overhead
+        self.row_bytes = row_bytes
+        self.row_hit_cycles = row_hit_cycles
+        self.row_miss_cycles = row_miss_cycles
+        self.interleave_bytes = interleave_bytes
+        self.bank_interleave = bank_interleave
+        self.num_row_hit = 0
+        self.num_row_miss = 0
+
+    def reset_stat(self):
+        Dram.reset_stat(self)
+        self.num_row_hit = 0
+        self.num_row_miss = 0
+
+    def _channel_bytes(self, num_bytes):
+        # Bytes moved by each of the min(num_chunks, num_channels) channels a transfer touches, the chunks are dealt
+        # round-robin and the last one may be partial
+        num_chunks = int(math.ceil(num_bytes / self.interleave_bytes))
+        channel_bytes = [(num_chunks // self.num_channels + (1 if i < num_chunks % self.num_channels else 0)) * self.interleave_bytes
+                         for i in range(min(num_chunks, self.num_channels))]
+        channel_bytes[(num_chunks - 1) % self.num_channels] -= num_chunks * self.interleave_bytes - num_bytes
+        return channel_bytes
+
+    def _transfer(self, height, width, bit_width):
+        # Returns the cycles of the transfer (set by the busiest channel), the number of accesses (aggregate beats),
+        # and the bursts and rows summed over the channels it touches
+        num_bytes = int(math.ceil(height * width * bit_width / 8))
+        if num_bytes == 0: return 0, 0, 0, 0
+        num_chunks = int(math.ceil(num_bytes / self.interleave_bytes))
+        channel_bytes = min(num_bytes, int(math.ceil(num_chunks / self.num_channels)) * self.interleave_bytes)
+        num_beats = int(math.ceil(channel_bytes * 8 / self.channel_width))
+        num_bursts = int(math.ceil(num_beats / self.burst_length))
+        num_rows = int(math.ceil(channel_bytes / self.row_bytes))
+        row_cycles = self.row_bytes * 8 / self.channel_width
+        if self.bank_interleave: row_penalty = max(0, self.row_miss_cycles - row_cycles) # Hidden by the transfer of the previous row
+        else: row_penalty = self.row_miss_cycles
+        cycles = (self.row_hit_cycles + self.row_miss_cycles + num_beats + num_bursts * self.burst_overhead
+                    + (num_rows - 1) * row_penalty)
+        num_access = int(math.ceil(num_bytes * 8 / self.bandwidth))
+        total_bursts, total_rows = 0, 0
+        for nbytes in self._channel_bytes(num_bytes):
+            total_bursts += int(math.ceil(int(math.ceil(nbytes * 8 / self.channel_width)) / self.burst_length))
+            total_rows += int(math.ceil(nbytes / self.row_bytes))
+        return int(math.ceil(cycles)), num_access, total_bursts, total_rows
+
+    def transfer_cycles(self, height, width, bit_width): # Cycles of a continuos transfer, without counting the access
+        return self._transfer(height, width, bit_width)[0]
+
+    def read(self, read_height, read_width, bit_width): # Continuos read
+        read_cycle, num_access, num_bursts, num_rows = self._transfer(read_height, read_width, bit_width)
+        self.num_read_access += num_access
+        self.num_row_miss += num_rows
+        self.num_row_hit += num_bursts - num_rows
+        logging.debug("Reading %d x %d from %s (%d pseudo-channels) takes %d cycles"%(read_height, read_width, self.dram_name, self.num_channels, read_cycle))
+        return read_cycle
+
+    def write(self, write_height, write_width, bit_width): # Continuos write
+        write_cycle, num_access, num_bursts, num_rows = self._transfer(write_height, write_width, bit_width)
+        self.num_write_access += num_access
+        self.num_row_miss += num_rows
+        self.num_row_hit += num_bursts - num_rows
+        logging.debug("Writing %d x %d to %s (%d pseudo-channels) takes %d cycles"%(write_height, write_width, self.dram_name, self.num_channels, write_cycle))
+        return write_cycle
+
+
+def hbm_streams(input_channels=8, coef_channels=1, output_channels=8, **kwargs):
+    """
+    Map the indata/coef/outdata streams of Butterfly_Accelerator onto disjoint pseudo-channels of the VCU128 HBM,
+    by default as INPUT_AXI_CHNL/WEIGHT_AXI_CHNL/OUTPUT_AXI_CHNL in acc_top.v. kwargs are passed to every Hbm.
+    Returns a dict that can be passed to Butterfly_Accelerator as keyword arguments.
+    """
+    assert input_channels + coef_channels + output_channels <= HBM_NUM_PSEUDO_CHANNELS, \
+        "The VCU128 HBM only has %d pseudo-channels" % HBM_NUM_PSEUDO_CHANNELS
+    return {"indata_dram": Hbm(input_channels, "indata_dram", **kwargs),
+            "coef_dram": Hbm(coef_channels, "coef_dram", **kwargs),
+            "outdata_dram": Hbm(output_channels, "outdata_dram", **kwargs)}
+
+
+def unit_test():
+    # Without latencies and overheads, the pseudo-channels behave like one Dram of the aggregate bandwidth
+    for num_channels, height, width, bit_width in [(8, 1024, 128, 16), (1, 12, 1024, 32), (8, 4096, 64, 32), (16, 3, 100, 16)]:
+        hbm = Hbm(num_channels, burst_overhead=0, row_hit_cycles=0, row_miss_cycles=0, interleave_bytes=HBM_CHANNEL_WIDTH//8)
+        dram = Dram(num_channels * HBM_CHANNEL_WIDTH)
+        assert hbm.read(height, width, bit_width) == dram.read(height, width, bit_width), (num_channels, height, width, bit_width)
+        assert hbm.num_read_access == dram.num_read_access
+    # Bank conflicts are slower than bank-interleaved rows
+    assert Hbm(1, bank_interleave=False).read(64, 1024, 16) > Hbm(1, row_miss_cycles=40).read(64, 1024, 16) > Hbm(1).read(64, 1024, 16)
+    # Rows are counted on the channels a transfer touches: one 256-byte chunk opens one row of one pseudo-channel
+    hbm = Hbm(8)
+    hbm.read(1, 128, 16)
+    assert (hbm.num_row_miss, hbm.num_row_hit) == (1, 0)
+    hbm = Hbm(8, row_bytes=1024, interleave_bytes=256)
+    hbm.read(1, 9 * 128 + 10, 16) # 9 full chunks and a partial one: channels 0-1 get 2 chunks, the others 1
+    assert sum(hbm._channel_bytes(9 * 256 + 20)) == 9 * 256 + 20 and hbm.num_row_miss == 8
+    print ("HBM model matches the Dram model without latencies")
+
+
+if __name__ == "__main__":
+    unit_test()
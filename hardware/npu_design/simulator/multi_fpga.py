@@ -0,0 +1,150 @@
+from bfly_accelerator import Butterfly_Accelerator, ceil_power2
+import argparse
+import contextlib
+import io
+import json
+import logging
+import math
+
+logger = logging.getLogger()
+
+
+class Interconnect:
+    # Point-to-point link of every device (e.g. QSFP/Aurora), bandwidth in bits per cycle, latency in cycles
+    def __init__(self, bandwidth, latency):
+        self.bandwidth = bandwidth
+        self.latency = latency
+
+    def transfer_cycles(self, num_bits):
+        if num_bits == 0: return 0
+        return self.latency + int(math.ceil(num_bits / self.bandwidth))
+
+
+class Multi_Accelerator:
+    """
+    Partition a FABNet encoder (Fourier + butterfly FFN layers) over num_devices copies of Butterfly_Accelerator.
+    - "pipeline": contiguous layers per device, the activations are sent to the next device after its last layer.
+      The latency of one sequence is not reduced, the throughput is bounded by the slowest stage or link.
+    - "data": every device holds num_len/num_devices rows of the sequence. The FFT over the hidden dimension and
+      the butterfly FFN are row-wise, the FFT over the sequence needs a transpose (all-to-all) of the complex result
+      before it and of the real result after it.
+    design_kwargs are passed to every Butterfly_Accelerator (parallelism, bandwidths, ...).
+    """
+    def __init__(self, hidden_dim, num_len, ffn_inner_dim, num_layer, link, bit_width=16, **design_kwargs):
+        self.hidden_dim = hidden_dim
+        self.num_len = num_len
+        self.ffn_inner_dim = ffn_inner_dim
+        self.num_layer = num_layer
+        self.link = link
+        self.bit_width = bit_width
+        self.design_kwargs = design_kwargs
+
+    def _design(self, hidden_dim, num_len):
+        # The Bram are sized by the longest of the FFN, the rows and the FFT
+        return Butterfly_Accelerator(32, hidden_dim, num_len, max(self.ffn_inner_dim, hidden_dim), bit_width=self.bit_width,
+                                     analytical=True, **self.design_kwargs)
+
+    def layer_cycles(self, num_rows, num_cols):
+        # Cycles of one layer on a device holding num_rows rows (FFN, hidden FFT) and num_cols columns (sequence FFT)
+        with contextlib.redirect_stdout(io.StringIO()):
+            row_design = self._design(self.hidden_dim, num_rows)
+            col_design = self._design(self.num_len, num_cols) # FFT length is the sequence length
+            ops = {"fft_hidden": row_design.run_fft(complex_input=False, complex_output=True),
+                   "fft_seq": col_design.run_fft(complex_input=True, complex_output=False),
+                   "ffn1": row_design.run_bfly(num_rows, row_design.hidden_dim, ceil_power2(self.ffn_inner_dim)),
+                   "ffn2": row_design.run_bfly(num_rows, ceil_power2(self.ffn_inner_dim), row_design.hidden_dim)}
+        return ops
+
+    def run(self, num_devices, mode="data"):
+        if mode == "data":
+            num_rows = int(math.ceil(self.num_len / num_devices))
+            num_cols = int(math.ceil(self.hidden_dim / num_devices))
+            ops = self.layer_cycles(num_rows, num_cols)
+            comm_cycles = 0
+            if num_devices > 1:
+                # All-to-all: every device keeps 1/num_devices of its shard and sends the rest
+                shard_elements = num_rows * self.hidden_dim * (num_devices - 1) / num_devices
+                comm_cycles = self.link.transfer_cycles(shard_elements * 2*self.bit_width) # complex, before the sequence FFT
+                comm_cycles += self.link.transfer_cycles(shard_elements * self.bit_width) # real, after it
+            layer_cycles = sum(ops.values()) + comm_cycles
+            latency_cycles = self.num_layer * layer_cycles
+            interval_cycles = latency_cycles # Every device is busy with the whole network
+            comm_cycles *= self.num_layer
+        elif mode == "pipeline":
+            assert num_devices <= self.num_layer, "Pipeline parallelism needs at least one layer per device"
+            layer_cycles = sum(self.layer_cycles(self.num_len, self.hidden_dim).values())
+            stage_layers = [self.num_layer // num_devices + (1 if i < self.num_layer % num_devices else 0) for i in range(num_devices)]
+            stage_cycles = [num * layer_cycles for num in stage_layers]
+            activation_cycles = self.link.transfer_cycles(self.num_len * self.hidden_dim * self.bit_width)
+            comm_cycles = (num_devices - 1) * activation_cycles
+            latency_cycles = sum(stage_cycles) + comm_cycles
+            # With double buffering, the links send the previous sequence while the stages compute the next one
+            interval_cycles = max(stage_cycles + ([activation_cycles] if num_devices > 1 else []))
+        else:
+            raise NotImplementedError("Not supported partitioning %s" % mode)
+        logging.info("%d devices (%s parallel): latency %d cycles, interval %d cycles, %d cycles in the interconnect"
+                     % (num_devices, mode, latency_cycles, interval_cycles, comm_cycles))
+        return {"num_devices": num_devices, "mode": mode, "latency_cycles": latency_cycles,
+                "interval_cycles": interval_cycles, "comm_cycles": comm_cycles}
+
+    def scaling(self, device_counts, mode="data", frequency=200, efficiency=0.85):
+        """
+        Run every device count and report the latency, the throughput and the scaling efficiency
+        (throughput speedup over one device divided by the number of devices).
+        """
+        ms_per_clock = (1.0/frequency/1000) / efficiency
+        base = self.run(1, mode)
+        reports = []
+        for num_devices in device_counts:
+            result = self.run(num_devices, mode)
+            speedup = base["interval_cycles"] / result["interval_cycles"]
+            reports.append(dict(result, latency_ms=result["latency_cycles"] * ms_per_clock,
+                                comm_ms=result["comm_cycles"] * ms_per_clock,
+                                throughput=1000 / (result["interval_cycles"] * ms_per_clock),
+                                speedup=speedup, scaling_efficiency=speedup / num_devices))
+        return reports
+
+
+def simulation(args):
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+    if args.version == "base":
+        num_layer, hidden_dim, ffn_inner_dim = 12, 768, 3072
+    elif args.version == "large":
+        num_layer, hidden_dim, ffn_inner_dim = 24, 1024, 4096
+    else:
+        raise NotImplementedError("Not supported version.")
+    # Gb/s and us to bits and cycles at the accelerator frequency
+    link = Interconnect(args.link_bw * 1000 / args.frequency, args.link_latency * args.frequency)
+    network = Multi_Accelerator(hidden_dim, args.num_len, ffn_inner_dim, num_layer, link,
+                                parallesm_bu=4, parallesm_be=args.parallesm_be)
+    reports = network.scaling(args.num_devices, args.mode, args.frequency, args.efficiency)
+    for report in reports:
+        print ("%d devices: latency %.3f ms (%.3f ms interconnect), %.1f sequences/s, scaling efficiency %.2f"
+               % (report["num_devices"], report["latency_ms"], report["comm_ms"], report["throughput"], report["scaling_efficiency"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--num_len", default=4096, type=int, help="Lengh of input sequence")
+    parser.add_argument("--version", default="base", type=str, help="base of large")
+    parser.add_argument("--parallesm_be", default=128, type=int, help="parallesm of butterfly engine per device")
+    parser.add_argument("--mode", default="data", type=str, help="data (sequence rows) or pipeline (layers)")
+    parser.add_argument("--num_devices", default=[1, 2, 4, 8], type=int, nargs="+", help="Device counts to simulate")
+    parser.add_argument("--link_bw", default=100, type=float, help="Interconnect bandwidth per device in Gb/s")
+    parser.add_argument("--link_latency", default=1.0, type=float, help="Interconnect latency in us")
+    parser.add_argument("--frequency", default=200, type=int, help="The frequency of the design")
+    parser.add_argument("--efficiency", default=0.85, type=float, help="The hardware implementation efficiency")
+    parser.add_argument("--output", default="", type=str, help="Dump the scaling report to this json file")
+    parser.add_argument("--debug", action="store_true")
+
+    args = parser.parse_args()
+
+    simulation(args)
@@ -0,0 +1,230 @@
+from bfly_accelerator import Butterfly_Accelerator, ceil_power2
+from att_accelerator import Att_Accelerator
+from chrome_trace import Chrome_Trace
+from traffic_stats import load_energy_table
+import argparse
+import json
+import logging
+import math
+
+logger = logging.getLogger()
+
+# Ops running on the butterfly accelerator, they can overlap with their neighbours
+BFLY_OPS = ["fft", "bfly"]
+# Applied by the Parallel to Serial module of the butterfly accelerator on the output of the previous op
+POSTPROCESS_OPS = ["shortcut", "layernorm"]
+
+
+class Op:
+    def __init__(self, layer, name, kind, **params):
+        self.layer = layer # Index of the encoder layer
+        self.name = name
+        self.kind = kind # One of "fft", "bfly", "attention", "linear_projection", "fc1", "fc2", "layernorm", "shortcut"
+        self.params = params
+
+
+def is_attention_layer(config, layer):
+    # Same placement as FNetEncoder._is_attention_layer in software/speed/src/models
+    num_attention_layers = getattr(config, "num_attention_layers", 0)
+    num_hidden_layers = config.num_hidden_layers
+    attention_layout = getattr(config, "attention_layout", None)
+    if attention_layout == "Top":
+        return layer < num_attention_layers
+    elif attention_layout == "Middle":
+        return (num_hidden_layers - num_attention_layers <= 2 * layer < num_hidden_layers + num_attention_layers)
+    elif attention_layout == "Bottom":
+        return layer >= num_hidden_layers - num_attention_layers
+    else:
+        return False
+
+
+def build_ops(config):
+    """
+    Build the ordered list of ops of the encoder described by a Bfly_FNetConfig / Vanilla_FNetConfig
+    (or any object with the same attributes). FFN layers are butterfly layers unless the model_type is "vanilla_fnet".
+    """
+    bfly_ffn = getattr(config, "model_type", "bfly_fnet") != "vanilla_fnet"
+    hidden_dim, ffn_inner_dim = config.hidden_size, config.intermediate_size
+    ops = []
+    for layer in range(config.num_hidden_layers):
+        if is_attention_layer(config, layer):
+            ops.append(Op(layer, "attention", "attention"))
+            ops.append(Op(layer, "linear_projection", "linear_projection")) # Includes shortcut + layernorm
+        else:
+            ops.append(Op(layer, "fft_hidden", "fft", complex_input=False, complex_output=True)) # 1st dimension FFT
+            ops.append(Op(layer, "fft_seq", "fft", complex_input=True, complex_output=False)) # 2nd dimension FFT
+            ops.append(Op(layer, "fourier_shortcut", "shortcut"))
+            ops.append(Op(layer, "fourier_layernorm", "layernorm"))
+        if bfly_ffn:
+            ops.append(Op(layer, "ffn1", "bfly", width1=hidden_dim, width2=ffn_inner_dim))
+            ops.append(Op(layer, "ffn2", "bfly", width1=ffn_inner_dim, width2=hidden_dim))
+            ops.append(Op(layer, "ffn_shortcut", "shortcut"))
+            ops.append(Op(layer, "ffn_layernorm", "layernorm"))
+        else:
+            ops.append(Op(layer, "ffn1", "fc1"))
+            ops.append(Op(layer, "ffn2", "fc2")) # Includes shortcut + layernorm
+    return ops
+
+
+class Network_Simulator:
+    """
+    Run an ordered list of ops on the butterfly accelerator (FFT, butterfly) and the attention accelerator
+    (attention, dense layers) and report per-layer and end-to-end cycles.
+    Consecutive butterfly ops overlap the output of one op with the input of the next one, a butterfly op drains its
+    output when the next op (past shortcut and layernorm) runs on the attention accelerator or ends the network.
+    With prefetch_coef, the coefficients of the next butterfly op are loaded during the current op when both fit in
+    coef_bram, hiding the part of the first coefficient load not covered by the input load. An op of the attention
+    accelerator in between leaves nothing to prefetch behind.
+    With fuse_postprocess, shortcut and layernorm are applied on the fly by the Parallel to Serial module and cost nothing,
+    otherwise every element is streamed once per parallel butterfly engine (twice for layernorm: mean, then variance).
+    """
+    def __init__(self, bfly_design, att_design=None, prefetch_coef=True, fuse_postprocess=True, trace=None):
+        self.bfly_design = bfly_design
+        self.att_design = att_design
+        self.trace = trace # chrome_trace.Chrome_Trace recording a span per op
+        self.prefetch_coef = prefetch_coef
+        self.fuse_postprocess = fuse_postprocess
+
+    def _tile_costs(self, op):
+        design = self.bfly_design
+        if op.kind == "fft":
+            return design.fft_tile_costs(op.params["complex_input"], op.params["complex_output"])
+        return design.bfly_tile_costs(design.num_len, ceil_power2(op.params["width1"]), ceil_power2(op.params["width2"]))
+
+    def _run_op(self, op, is_last):
+        design = self.bfly_design
+        if op.kind == "fft":
+            return design.run_fft(is_last=is_last, complex_input=op.params["complex_input"], complex_output=op.params["complex_output"])
+        elif op.kind == "bfly":
+            return design.run_bfly(design.num_len, ceil_power2(op.params["width1"]), ceil_power2(op.params["width2"]), is_last=is_last)
+        elif op.kind in POSTPROCESS_OPS:
+            if self.fuse_postprocess: return 0
+            num_pass = 2 if op.kind == "layernorm" else 1
+            return num_pass * math.ceil(design.num_len * design.hidden_dim / design.parallesm_be)
+        assert self.att_design is not None, "Op %s needs an attention accelerator" % op.name
+        if op.kind == "attention": return self.att_design.run_att()
+        elif op.kind == "linear_projection": return self.att_design.run_lp()
+        elif op.kind == "fc1": return self.att_design.run_fc1()
+        elif op.kind == "fc2": return self.att_design.run_fc2()
+        raise NotImplementedError("Not supported op %s" % op.kind)
+
+    def run(self, ops, frequency=200, efficiency=0.85):
+        # The next op of every op that is not a shortcut or layernorm, None at the end of the network
+        next_kinds = [None] * len(ops)
+        for i in range(len(ops) - 2, -1, -1):
+            next_kinds[i] = next_kinds[i + 1] if ops[i + 1].kind in POSTPROCESS_OPS else ops[i + 1].kind
+        coef_bram_depth = self.bfly_design.coef_bram.bram_height
+        layers = []
+        prev_costs = None
+        now = 0
+        for i, op in enumerate(ops):
+            # Attribute the memory traffic of the op to its layer
+            for design in [self.bfly_design, self.att_design]:
+                if design is not None: design.traffic.layer = op.layer
+            cycles = self._run_op(op, is_last=next_kinds[i] not in BFLY_OPS)
+            saved_cycles = 0
+            if op.kind in BFLY_OPS:
+                costs = self._tile_costs(op)
+                if self.prefetch_coef and prev_costs is not None and \
+                        prev_costs["coef_bram_depth"] + costs["coef_bram_depth"] <= coef_bram_depth:
+                    # The coef Dram is idle while the previous op drains, bounded by the previous op's runtime
+                    exposed_cycles = max(0, costs["weight_data_cycles"] - costs["input_data_cycles"])
+                    saved_cycles = min(exposed_cycles, prev_cycles)
+                prev_costs, prev_cycles = costs, cycles - saved_cycles
+            elif op.kind not in POSTPROCESS_OPS:
+                prev_costs = None
+            cycles -= saved_cycles
+            if not layers or layers[-1]["layer"] != op.layer:
+                layers.append({"layer": op.layer, "cycles": 0, "ops": []})
+            layers[-1]["ops"].append({"name": op.name, "kind": op.kind, "cycles": cycles, "prefetch_saved_cycles": saved_cycles})
+            layers[-1]["cycles"] += cycles
+            if self.trace is not None:
+                thread = "bfly_accelerator" if op.kind in BFLY_OPS or op.kind in POSTPROCESS_OPS else "att_accelerator"
+                self.trace.add("layer %d %s" % (op.layer, op.name), "network", thread, now, cycles, op.kind,
+                               {"layer": op.layer, "prefetch_saved_cycles": saved_cycles})
+            now += cycles
+            logging.info("Layer %d op %s takes %d cycles (%d saved by prefetching)" % (op.layer, op.name, cycles, saved_cycles))
+        total_cycles = sum(layer["cycles"] for layer in layers)
+        ms_per_clock = (1.0/frequency/1000) / efficiency
+        return {"total_cycles": total_cycles, "latency_ms": total_cycles * ms_per_clock, "layers": layers}
+
+
+def unit_test():
+    # In a Top layout, a butterfly op before an attention op drains, and the op after it has nothing prefetched
+    config = argparse.Namespace(num_hidden_layers=4, num_attention_layers=2, attention_layout="Top",
+                                hidden_size=768, intermediate_size=3072, model_type="bfly_fnet")
+    bfly_design = Butterfly_Accelerator(64, 768, 512, 3072, parallesm_bu=4, parallesm_be=128, analytical=True)
+    att_design = Att_Accelerator(64, 768, 512, 3072, analytical=True)
+    ops = build_ops(config)
+    report = Network_Simulator(bfly_design, att_design).run(ops)
+    run_ops = [op for layer in report["layers"] for op in layer["ops"]]
+    drained = bfly_design.run_bfly(512, 4096, 1024, is_last=True)
+    assert drained > bfly_design.run_bfly(512, 4096, 1024, is_last=False)
+    num_drained = 0
+    for i, op in enumerate(ops):
+        next_ops = [next_op for next_op in ops[i + 1:] if next_op.kind not in POSTPROCESS_OPS]
+        if op.kind in BFLY_OPS and next_ops and next_ops[0].kind == "attention":
+            assert op.name == "ffn2" and run_ops[i]["cycles"] + run_ops[i]["prefetch_saved_cycles"] == drained, (i, run_ops[i])
+            num_drained += 1
+        if op.kind in BFLY_OPS and ops[i - 1].kind == "linear_projection":
+            assert run_ops[i]["prefetch_saved_cycles"] == 0, (i, run_ops[i])
+    assert num_drained == config.num_attention_layers - 1
+    print ("Drained the butterfly ops before attention in a Top layout of %d layers" % config.num_hidden_layers)
+
+
+def simulation(args):
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+    if args.version == "base":
+        args.num_hidden_layers, args.hidden_size, args.intermediate_size = 12, 768, 3072
+    elif args.version == "large":
+        args.num_hidden_layers, args.hidden_size, args.intermediate_size = 24, 1024, 4096
+    else:
+        raise NotImplementedError("Not supported version.")
+
+    bfly_design = Butterfly_Accelerator(args.head_dim, args.hidden_size, args.num_len, args.intermediate_size,
+                                        parallesm_bu=4, parallesm_be=args.parallesm_be, analytical=True)
+    att_design = Att_Accelerator(args.head_dim, args.hidden_size, args.num_len, args.intermediate_size, analytical=True)
+    trace = Chrome_Trace(args.frequency) if args.trace else None
+    network = Network_Simulator(bfly_design, att_design, prefetch_coef=not args.no_prefetch, trace=trace)
+    report = network.run(build_ops(args), frequency=args.frequency, efficiency=args.efficiency)
+    for layer in report["layers"]:
+        print ("Layer %d:" % layer["layer"], layer["cycles"], "cycles")
+    print ("The overall latecy is:", report["latency_ms"])
+    if trace is not None:
+        trace.save(args.trace)
+    if args.output:
+        energy_table = load_energy_table("hbm", args.energy_table)
+        report["traffic"] = {"bfly": bfly_design.traffic.report(energy_table), "att": att_design.traffic.report(energy_table)}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--head_dim", default=64, type=int, help="Dimension per head")
+    parser.add_argument("--num_len", default=512, type=int, help="Lengh of input sequence")
+    parser.add_argument("--version", default="base", type=str, help="base of large")
+    parser.add_argument("--model_type", default="bfly_fnet", type=str, help="bfly_fnet or vanilla_fnet")
+    parser.add_argument("--num_attention_layers", default=0, type=int, help="Number of attention layers in the hybrid model")
+    parser.add_argument("--attention_layout", default="Bottom", type=str, help="One of Bottom, Top, Middle")
+    parser.add_argument("--parallesm_be", default=128, type=int, help="parallesm of butterfly engine in the whole design")
+    parser.add_argument("--frequency", default=200, type=int, help="The frequency of the design")
+    parser.add_argument("--efficiency", default=0.85, type=float, help="The hardware implementation efficiency")
+    parser.add_argument("--no_prefetch", action="store_true", help="Disable cross-layer prefetching of coefficients")
+    parser.add_argument("--output", default="", type=str, help="Dump the per-layer report to this json file")
+    parser.add_argument("--trace", default="", type=str, help="Dump a Chrome/Perfetto trace of the ops to this json file")
+    parser.add_argument("--energy_table", default="", type=str, help="Json file overriding the pJ per bit of dram/bram read/write")
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--unit_test", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.unit_test:
+        unit_test()
+    else:
+        simulation(args)
@@ -0,0 +1,112 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Board profiles of the Verilog projects under hardware/npu_design/verilog
+# base_lut covers the off-chip memory controllers and the top-level control, max_utilization leaves room for routing
+BOARDS = {
+    "vcu128": {"part": "xcvu37p-fsvh2892-1-e", "bram18": 4032, "dsp": 9024, "lut": 1303680, "base_lut": 60000, "max_utilization": 0.8},
+    "zynq7045": {"part": "xc7z045ffg900-2", "bram18": 1090, "dsp": 900, "lut": 218600, "base_lut": 20000, "max_utilization": 0.8},
+}
+BOARDS["zcu128"] = BOARDS["vcu128"] # Name used by simulator_bfly.py
+
+# Aspect ratios (depth, width) of a BRAM18 in simple dual-port mode
+BRAM18_CONFIGS = [(16384, 1), (8192, 2), (4096, 4), (2048, 9), (1024, 18), (512, 36)]
+LUTRAM_DEPTH = 64 # Shallower memories are mapped to distributed RAM, one LUT per bit per 64 entries
+DSP_PER_BU = 4 # num_mult in butterfly_unit_opt.v
+LUT_PER_BU = 450 # Complex adders/subtractors and muxes of a butterfly unit at 16 bits
+LUT_PER_BE = 1500 # Address generators, control, S2P/P2S of a butterfly engine
+
+
+def bram_resources(height_per_bank, bitwidth_per_bank, num_bank):
+    """
+    BRAM18 and LUT usage of a Bram, every bank is a separate memory of height_per_bank x bitwidth_per_bank.
+    Works element-wise on numpy arrays. Returns (bram18, lut).
+    """
+    depth = np.ceil(np.asarray(height_per_bank, dtype=np.float64))
+    width = np.asarray(bitwidth_per_bank, dtype=np.float64)
+    bram18 = np.min([np.ceil(width / config_width) * np.ceil(depth / config_depth) for config_depth, config_width in BRAM18_CONFIGS], axis=0)
+    is_lutram = depth <= LUTRAM_DEPTH
+    bram18 = np.where(is_lutram, 0, bram18) * num_bank
+    lut = np.where(is_lutram, width, 0) * num_bank
+    return bram18, lut
+
+
+def compute_resources(parallesm_bu, parallesm_be, bit_width=16, coef_bit_width=None):
+    """
+    DSP and LUT usage of the butterfly engines, a multiplier takes bit_width (data) x coef_bit_width operands.
+    A DSP48 multiplies 27 x 18 bits, wider products take two. The adders scale with bit_width.
+    """
+    coef_bit_width = bit_width if coef_bit_width is None else coef_bit_width
+    num_bu = np.ceil(np.asarray(parallesm_bu, dtype=np.float64)) * parallesm_be
+    narrow, wide = np.minimum(bit_width, coef_bit_width), np.maximum(bit_width, coef_bit_width)
+    dsp_per_mult = np.where((narrow > 18) | (wide > 27), 2, 1)
+    return num_bu * DSP_PER_BU * dsp_per_mult, num_bu * LUT_PER_BU * np.asarray(bit_width) / 16 + parallesm_be * LUT_PER_BE
+
+
+def bfly_resources(hidden_dim, num_len, ffn_inner_dim, parallesm_bu=4, parallesm_be=128, bit_width=16, coef_bit_width=None):
+    """
+    Vectorized resource usage of Butterfly_Accelerator, same Bram geometry as its constructor.
+    bit_width is the width of the data brams and butterfly units (acc_bit_width), coef_bit_width defaults to it.
+    hidden_dim and ffn_inner_dim should already be powers of two (see sweep.ceil_power2).
+    Returns a dict of arrays: bram18, bram36, dsp, lut (without the board's base_lut).
+    """
+    from sweep import ceil_power2, log2
+    coef_bit_width = bit_width if coef_bit_width is None else coef_bit_width
+    max_length = np.maximum(ceil_power2(ffn_inner_dim), ceil_power2(num_len))
+    parallesm_bu = np.asarray(parallesm_bu, dtype=np.float64)
+    # data_bram_a/b of every butterfly engine
+    data_bram18, data_lut = bram_resources(max_length / (2*parallesm_bu), bit_width, 2*parallesm_bu)
+    # coef_bram, complex + real
+    coef_bram18, coef_lut = bram_resources((2*max_length) / (4*parallesm_bu) * log2(max_length), 2*coef_bit_width, 4*parallesm_bu)
+    bram18 = 2 * parallesm_be * data_bram18 + coef_bram18
+    dsp, compute_lut = compute_resources(parallesm_bu, parallesm_be, bit_width, coef_bit_width)
+    return {"bram18": bram18, "bram36": np.ceil(bram18 / 2), "dsp": dsp,
+            "lut": compute_lut + 2 * parallesm_be * data_lut + coef_lut}
+
+
+def design_resources(design):
+    # Resource usage of a Butterfly_Accelerator instance, from its Bram objects and butterfly engines
+    bram18, lut = 0, 0
+    for bram in design.data_bram_a + design.data_bram_b + [design.coef_bram]:
+        bram_bram18, bram_lut = bram_resources(bram.bram_height, bram.bitwidth_per_bank, bram.num_bank)
+        bram18, lut = bram18 + bram_bram18, lut + bram_lut
+    dsp, compute_lut = compute_resources(design.bfly_engines[0].num_bu, len(design.bfly_engines),
+                                          design.acc_bit_width, design.coef_bit_width)
+    return {"bram18": float(bram18), "bram36": float(np.ceil(bram18 / 2)), "dsp": float(dsp), "lut": float(compute_lut + lut)}
+
+
+def fits_board(resources, board):
+    """
+    Check resources (from bfly_resources or design_resources) against a board profile name or dict.
+    Returns (feasible, utilization), both element-wise for arrays.
+    """
+    if isinstance(board, str): board = BOARDS[board]
+    utilization = {"bram18": resources["bram18"] / board["bram18"], "dsp": resources["dsp"] / board["dsp"],
+                   "lut": (resources["lut"] + board["base_lut"]) / board["lut"]}
+    feasible = np.all([value <= board["max_utilization"] for value in utilization.values()], axis=0)
+    return feasible, utilization
+
+
+def unit_test():
+    # Check the vectorized estimate against the Bram objects of the design
+    from bfly_accelerator import Butterfly_Accelerator
+    configs = [(768, 512, 3072, 4, 128, 16, 16), (1024, 4096, 4096, 4, 32, 16, 16), (64, 4000, 192, 32, 16, 16, 16),
+               (512, 128, 512, 4, 120, 16, 16), (768, 512, 3072, 4, 128, 24, 12)]
+    for hidden_dim, num_len, ffn_inner_dim, parallesm_bu, parallesm_be, acc_bit_width, coef_bit_width in configs:
+        design = Butterfly_Accelerator(32, hidden_dim, num_len, ffn_inner_dim, parallesm_bu=parallesm_bu, parallesm_be=parallesm_be,
+                                       acc_bit_width=acc_bit_width, coef_bit_width=coef_bit_width)
+        expected = design_resources(design)
+        resources = bfly_resources(design.hidden_dim, num_len, design.ffn_inner_dim, parallesm_bu, parallesm_be, acc_bit_width, coef_bit_width)
+        assert all(np.isclose(resources[key], expected[key]) for key in expected), (expected, resources)
+    feasible, _ = fits_board(bfly_resources(1024, 512, 4096, np.array([4, 4]), np.array([32, 128])), "zynq7045")
+    assert list(feasible) == [True, False]
+    # 24-bit accumulators with 12-bit twiddles still fit one DSP48 per multiplier, 32 x 32 bits takes two
+    dsp = [compute_resources(4, 128, bit_width, coef_bit_width)[0] for bit_width, coef_bit_width in [(16, 16), (24, 12), (32, 32)]]
+    assert dsp[0] == dsp[1] and dsp[2] == 2 * dsp[0]
+    print ("Resource model matches the Bram geometry on %d configurations" % len(configs))
+
+
+if __name__ == "__main__":
+    unit_test()
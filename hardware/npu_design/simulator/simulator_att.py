@@ -1,5 +1,8 @@
-from att_accelerator import Att_Accelerator
+from efficient_att_accelerator import make_att_accelerator, ATTENTION_ENGINES
+from accel_config import model_dims
+from traffic_stats import load_energy_table
 import argparse
+import json
 import logging
 
 logger = logging.getLogger()
@@ -10,18 +13,12 @@ def simulation(args):
         logger.setLevel(logging.DEBUG) 
     else:
         logger.setLevel(logging.INFO)
-    if args.version == "base":
-        num_layer = 12
-        hidden_dim = 768
-        ffn_inner_dim = 3072
-    elif args.version == "large":
-        num_layer = 24
-        hidden_dim = 1024
-        ffn_inner_dim = 4096
-    else:
-        raise NotImplementedError("Not supported version.")
+    dims = model_dims(args.version)
+    num_layer, hidden_dim, ffn_inner_dim = dims["num_layer"], dims["hidden_dim"], dims["ffn_inner_dim"]
 
-    design = Att_Accelerator(args.head_dim, hidden_dim, args.num_len, ffn_inner_dim)
+    design = make_att_accelerator(args.attention, args.head_dim, hidden_dim, args.num_len, ffn_inner_dim, linformer_k=args.linformer_k,
+                                  num_landmarks=args.num_landmarks, conv_kernel_size=args.conv_kernel_size,
+                                  batch_size=args.batch_size, analytical=args.analytical)
     design.run_att()
     design.run_lp()
     design.run_fc1()
@@ -30,6 +27,13 @@ def simulation(args):
     network_run_cost = num_layer * design.run_cycles
     ms_per_clock = (1/args.frequency/1000) / args.efficiency
     print ("The overall latecy is:", network_run_cost*ms_per_clock) 
+    if args.batch_size > 1:
+        print ("The throughput is: %f sequences/s (batch of %d)" % (args.batch_size * 1000 / (network_run_cost*ms_per_clock), args.batch_size))
+    if args.report:
+        report = design.traffic.report(load_energy_table("hbm", args.energy_table), num_layer=num_layer, batch_size=args.batch_size)
+        print ("The energy per inference is: %f uJ, off-chip traffic %f MB" % (report["per_inference"]["energy_uj"], report["per_inference"]["dram_bytes"] / 2**20))
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
     logging.info("####################Finish######################")
 
 if __name__ == '__main__':
@@ -40,6 +44,14 @@ if __name__ == '__main__':
     # parser.add_argument("--hidden_dim", default=128, type=int, help="Hidden dimension")
     parser.add_argument("--num_len", default=64, type=int, help="Lengh of input sequence")
     # parser.add_argument("--ffn_inner_dim", default=512, type=int, help="Inner dimension of FFN")
+    parser.add_argument("--batch_size", default=1, type=int, help="Number of sequences sharing each weight load")
+    parser.add_argument("--attention", default="dense", type=str, choices=list(ATTENTION_ENGINES), help="Attention engine")
+    parser.add_argument("--linformer_k", default=None, type=int, help="Projected length of the keys/values with linformer, at most num_len (default min(256, num_len))")
+    parser.add_argument("--num_landmarks", default=None, type=int, help="Number of landmarks with nystrom, at most num_len (default min(64, num_len))")
+    parser.add_argument("--conv_kernel_size", default=35, type=int, help="Taps of the convolution of the values with nystrom, 0 to disable")
+    parser.add_argument("--analytical", action="store_true", help="Repeat one simulated row in closed form instead of replaying every row")
+    parser.add_argument("--report", default="", type=str, help="Dump the memory traffic and energy report to this json file")
+    parser.add_argument("--energy_table", default="", type=str, help="Json file overriding the pJ per bit of dram/bram read/write")
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--version", default="base", type=str, help="base of large")
     parser.add_argument("--frequency", default=200, type=int, help="The frequency of the design")
@@ -47,5 +59,13 @@ if __name__ == '__main__':
     
 
     args = parser.parse_args()
+    if args.linformer_k is None:
+        args.linformer_k = min(256, args.num_len)
+    if args.num_landmarks is None:
+        args.num_landmarks = min(64, args.num_len)
+    if args.attention == "linformer" and args.linformer_k > args.num_len:
+        parser.error("--linformer_k %d exceeds --num_len %d" % (args.linformer_k, args.num_len))
+    if args.attention == "nystrom" and args.num_landmarks > args.num_len:
+        parser.error("--num_landmarks %d exceeds --num_len %d" % (args.num_landmarks, args.num_len))
 
     simulation(args)
\ No newline at end of file
@@ -1,6 +1,13 @@
 from multi_head_engine import Multi_Head_Engine
 from bfly_accelerator import Butterfly_Accelerator
+from event_sim import Event_Pipeline
+from hbm import hbm_streams
+from accel_config import model_dims, offchip_bandwidths, board_parallelism
+from resource_model import design_resources, fits_board
+from chrome_trace import Chrome_Trace
+from traffic_stats import load_energy_table
 import argparse
+import json
 import logging
 
 logger = logging.getLogger()
@@ -14,41 +21,32 @@ def simulation(args):
      
     logging.info("####################Start######################")
     # Setting the configurations of the design
-    if args.version == "base":
-        num_layer = 12
-        hidden_dim = 768
-        ffn_inner_dim = 3072
-    elif args.version == "large":
-        num_layer = 24
-        hidden_dim = 1024
-        ffn_inner_dim = 4096
-    else:
-        raise NotImplementedError("Not supported version.")
+    dims = model_dims(args.version)
+    num_layer, hidden_dim, ffn_inner_dim = dims["num_layer"], dims["hidden_dim"], dims["ffn_inner_dim"]
 
-    if args.offchip_mem == "hbm":
-        indata_dram_bw=2048
-        coef_dram_bw=256
-        outdata_dram_bw=2048
-    elif args.offchip_mem == "ddr3":
-        indata_dram_bw=64
-        coef_dram_bw=64
-        outdata_dram_bw=128
-    else:
-        raise NotImplementedError("Not supported off-chip memory.")
+    design_kwargs = offchip_bandwidths(args.offchip_mem)
+    if args.offchip_mem == "hbm_pc":
+        # Same number of 256-bit AXI ports as "hbm", with pseudo-channel timing
+        design_kwargs.update(hbm_streams(*args.hbm_channels))
 
-    if args.fpga_board == "zcu128":
-        parallesm_bu=4
-        parallesm_be=128 if args.parallesm_be == 0 else args.parallesm_be
-    elif args.fpga_board == "zynq7045":
-        parallesm_bu=4
-        parallesm_be=32 if args.parallesm_be == 0 else args.parallesm_be
-    else:
-        raise NotImplementedError("Not supported FPGA board")
+    design_kwargs.update(board_parallelism(args.fpga_board))
+    if args.parallesm_be != 0: design_kwargs["parallesm_be"] = args.parallesm_be
+    design_kwargs.update(data_bit_width=args.data_bits, coef_bit_width=args.coef_bits, acc_bit_width=args.acc_bits)
 
     # Instantiate Design
     design = Butterfly_Accelerator(args.head_dim, hidden_dim, args.num_len, ffn_inner_dim, 
-                                    parallesm_bu=parallesm_bu, parallesm_be=parallesm_be,
-                                    indata_dram_bw=indata_dram_bw, coef_dram_bw=coef_dram_bw, outdata_dram_bw=outdata_dram_bw)
+                                    batch_size=args.batch_size, **design_kwargs)
+
+    resources = design_resources(design)
+    feasible, utilization = fits_board(resources, args.fpga_board)
+    print ("Resource usage: %d BRAM18, %d DSP, %d LUT (%.1f%%, %.1f%%, %.1f%% of %s)" % (resources["bram18"], resources["dsp"], resources["lut"],
+            100*utilization["bram18"], 100*utilization["dsp"], 100*utilization["lut"], args.fpga_board))
+    if not feasible:
+        logging.error("The design does not fit %s, use a smaller --parallesm_be" % args.fpga_board)
+        return
+
+    trace = Chrome_Trace(args.frequency) if args.trace else None
+    design.trace = trace
 
     # Run Fourier Layer
     design.run_fft(complex_input=False, complex_output=True) # 1st dimension FFT
@@ -60,6 +58,24 @@ def simulation(args):
     network_run_cost = num_layer * design.run_cycles
     ms_per_clock = (1.0/args.frequency/1000) / args.efficiency
     print ("The overall latecy is:", network_run_cost*ms_per_clock) 
+    if args.batch_size > 1:
+        print ("The throughput is: %f sequences/s (batch of %d)" % (args.batch_size * 1000 / (network_run_cost*ms_per_clock), args.batch_size))
+    if args.report:
+        report = design.traffic.report(load_energy_table("hbm" if args.offchip_mem == "hbm_pc" else args.offchip_mem, args.energy_table), num_layer=num_layer, batch_size=args.batch_size)
+        print ("The energy per inference is: %f uJ, off-chip traffic %f MB" % (report["per_inference"]["energy_uj"], report["per_inference"]["dram_bytes"] / 2**20))
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.event_sim:
+        # Validate the analytical latency with the discrete-event pipeline model
+        event_design = Event_Pipeline(design, shared_dram=args.shared_dram, trace=trace, per_engine=args.trace_per_engine)
+        event_design.run_fft(complex_input=False, complex_output=True) # 1st dimension FFT
+        event_design.run_fft(complex_input=True, complex_output=False) # 2nd dimension FFT
+        event_design.run_bfly(design.num_len, design.hidden_dim, design.ffn_inner_dim)
+        event_design.run_bfly(design.num_len, design.ffn_inner_dim, design.hidden_dim)
+        print ("The overall latecy (event-driven) is:", num_layer * event_design.run_cycles*ms_per_clock)
+    if trace is not None:
+        trace.save(args.trace)
     logging.info("####################Finish######################")
 
 if __name__ == '__main__':
@@ -77,7 +93,18 @@ if __name__ == '__main__':
     parser.add_argument("--fpga_board", default="zcu128", type=str, help="The FPGA board used for implementation")
     # parser.add_argument("--parallesm_bu", default=4, type=int, help="parallesm of butterfly unit per butterfly engine")
     parser.add_argument("--parallesm_be", default=0, type=int, help="parallesm of butterfly engine in the whole design")
-    parser.add_argument("--offchip_mem", default="hbm", type=str, help="The off-chip memory installed in the design")
+    parser.add_argument("--offchip_mem", default="hbm", type=str, help="The off-chip memory installed in the design: hbm, hbm_pc (pseudo-channel model) or ddr3")
+    parser.add_argument("--data_bits", default=16, type=int, help="Bit width of the activations read from/written to dram, e.g. 1+exp_bit+man_bit of run_tasks.py")
+    parser.add_argument("--coef_bits", default=16, type=int, help="Bit width of the twiddle factors and butterfly weights")
+    parser.add_argument("--acc_bits", default=16, type=int, help="Bit width of the butterfly units and of the intermediate values in the data brams")
+    parser.add_argument("--batch_size", default=1, type=int, help="Number of sequences sharing each coefficient load")
+    parser.add_argument("--report", default="", type=str, help="Dump the memory traffic and energy report to this json file")
+    parser.add_argument("--energy_table", default="", type=str, help="Json file overriding the pJ per bit of dram/bram read/write")
+    parser.add_argument("--hbm_channels", default=[8, 1, 8], type=int, nargs=3, help="HBM pseudo-channels of the indata, coef and outdata streams with hbm_pc")
+    parser.add_argument("--event_sim", action="store_true", help="Also run the discrete-event pipeline model")
+    parser.add_argument("--trace", default="", type=str, help="Dump a Chrome/Perfetto trace of the ops (and of every stage with --event_sim)")
+    parser.add_argument("--trace_per_engine", action="store_true", help="Record the compute of every butterfly engine in the trace")
+    parser.add_argument("--shared_dram", action="store_true", help="Map indata/coef/outdata streams onto one Dram channel in the event model")
 
     args = parser.parse_args()
 
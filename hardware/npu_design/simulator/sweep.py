@@ -0,0 +1,219 @@
+import logging
+import numpy as np
+from bfly_accelerator import pipeline_drain
+from resource_model import bfly_resources, fits_board
+
+logger = logging.getLogger(__name__)
+
+# Fields of the structured array returned by sweep_bfly
+SWEEP_FIELDS = [("head_dim", np.int64), ("hidden_dim", np.int64), ("num_len", np.int64), ("ffn_inner_dim", np.int64),
+                ("parallesm_bu", np.int64), ("parallesm_be", np.int64), ("data_bit_width", np.int64),
+                ("coef_bit_width", np.int64), ("acc_bit_width", np.int64),
+                ("indata_dram_bw", np.int64), ("coef_dram_bw", np.int64), ("outdata_dram_bw", np.int64),
+                ("num_layer", np.int64), ("batch_size", np.int64), ("fft_cycles", np.float64), ("bfly_cycles", np.float64),
+                ("run_cycles", np.float64), ("network_cycles", np.float64), ("latency_ms", np.float64),
+                ("bram18", np.float64), ("dsp", np.float64), ("lut", np.float64), ("fits_bram", np.bool_)]
+
+
+def ceil_power2(x):
+    # Vectorized version of bfly_accelerator.ceil_power2: 2 << ((x-1).bit_length() - 1)
+    x = np.asarray(x, dtype=np.int64)
+    bit_length = np.frexp((x - 1).astype(np.float64))[1]
+    return np.left_shift(2, bit_length - 1)
+
+
+def log2(x):
+    # Same as x.bit_length()-1 for the power-of-two lengths used in the accelerator
+    return np.frexp(np.asarray(x, dtype=np.float64))[1] - 1
+
+
+def dram_cycles(height, width, bit_width, bandwidth):
+    # Vectorized version of Dram.read/Dram.write
+    assert np.all(bandwidth >= bit_width), "Dram bandwidth should hold at least one element"
+    pack_factor = bandwidth // bit_width
+    return np.ceil(height * width / pack_factor)
+
+
+def bram_fits(hidden_dim, num_len, ffn_inner_dim, parallesm_bu, coef_bit_width, acc_bit_width):
+    # Vectorized version of the capacity asserts of Bram.read/Bram.write in Butterfly_Accelerator: the rows of the FFTs
+    # and butterfly layers must fit the data brams and their coefficients the coef bram, both sized by max_length
+    max_length = np.maximum(ffn_inner_dim, ceil_power2(num_len))
+    data_bram_height = max_length / (2*parallesm_bu)
+    coef_bram_height = (2*max_length) / (4*parallesm_bu) * log2(max_length)
+    fits = (2*coef_bit_width * hidden_dim) / (2*coef_bit_width * 4*parallesm_bu) * log2(hidden_dim) <= coef_bram_height
+    for width in [hidden_dim, ffn_inner_dim]:
+        fits &= (width * acc_bit_width) / (acc_bit_width * 2*parallesm_bu) <= data_bram_height
+        fits &= (2*width * coef_bit_width) / (2*coef_bit_width * 4*parallesm_bu) * log2(width) <= coef_bram_height
+    return fits
+
+
+def fft_cycles(hidden_dim, num_len, parallesm_bu, parallesm_be, data_bit_width, coef_bit_width,
+                indata_dram_bw, coef_dram_bw, outdata_dram_bw, batch_size=1, is_last=False, complex_input=False, complex_output=False):
+    # Vectorized version of Butterfly_Accelerator.run_fft, hidden_dim should already be a power of two
+    num_run = np.ceil(num_len / parallesm_be).astype(np.int64) * batch_size
+    num_stage = log2(hidden_dim)
+    ############################# First Level Pipelining #############################
+    in_bit_width = 2*data_bit_width if complex_input else data_bit_width
+    dram_data_read_cycles = dram_cycles(hidden_dim, parallesm_be, in_bit_width, indata_dram_bw)
+    input_data_cycles = np.maximum(dram_data_read_cycles, hidden_dim) # Serial to Parallel module, one by one
+    dram_coef_read_cycles = dram_cycles(num_stage, hidden_dim, 2*coef_bit_width, coef_dram_bw) # symmetric, complex + real
+    bram_coef_write_cycles = num_stage * hidden_dim / (4*parallesm_bu)
+    weight_data_cycles = np.maximum(dram_coef_read_cycles, bram_coef_write_cycles)
+    bram_data_read_cycles = num_stage * hidden_dim / (2*parallesm_bu)
+    fft_compute_time = hidden_dim / (2*parallesm_bu) * num_stage
+    fft_time = np.maximum(fft_compute_time, bram_data_read_cycles)
+    fst_pipeline_cost = fft_time + np.maximum(input_data_cycles, weight_data_cycles)
+    ############################# Second Level Pipelining #############################
+    out_bit_width = 2*data_bit_width if complex_output else data_bit_width
+    dram_data_write_cycles = dram_cycles(hidden_dim, parallesm_be, out_bit_width, outdata_dram_bw)
+    output_data_cycles = np.maximum(dram_data_write_cycles, hidden_dim) # Parallel to Serial module, one by one
+    return fst_pipeline_cost + pipeline_drain(num_run, is_last, [fst_pipeline_cost, output_data_cycles],
+                                              fft_time + input_data_cycles, batch_size)
+
+
+def bfly_cycles(height, width1, width2, parallesm_bu, parallesm_be, data_bit_width, coef_bit_width,
+                indata_dram_bw, coef_dram_bw, outdata_dram_bw, batch_size=1, is_last=False):
+    # Vectorized version of Butterfly_Accelerator.run_bfly, widths should already be powers of two
+    multi_width = np.where(width1 < width2, width2 // width1, 1)
+    num_run = np.ceil(height / parallesm_be).astype(np.int64) * multi_width * batch_size
+    width = width1
+    num_stage = log2(width)
+    ############################# First Level Pipelining #############################
+    dram_data_read_cycles = dram_cycles(width, parallesm_be, data_bit_width, indata_dram_bw)
+    input_data_cycles = np.maximum(dram_data_read_cycles, width) # Serial to Parallel module, one by one
+    dram_coef_read_cycles = dram_cycles(num_stage, 2*width, coef_bit_width, coef_dram_bw) # non-symmetric, Log(N) * 2 * N parameters
+    bram_coef_write_cycles = num_stage * width / (4*parallesm_bu)
+    fst_pipeline_cost = np.maximum(input_data_cycles, np.maximum(dram_coef_read_cycles, bram_coef_write_cycles))
+    ############################# Second Level Pipelining #############################
+    bram_data_read_cycles = num_stage * width / (2*parallesm_bu)
+    bfly_compute_time = width / (2*parallesm_bu) * num_stage
+    snd_pipeline_cost = np.maximum(bfly_compute_time, bram_data_read_cycles)
+    ############################# Third Level Pipelining #############################
+    dram_data_write_cycles = dram_cycles(width, parallesm_be, data_bit_width, outdata_dram_bw)
+    output_data_cycles = np.maximum(dram_data_write_cycles, width) # Parallel to Serial module, one by one
+    return fst_pipeline_cost + snd_pipeline_cost + pipeline_drain(num_run, is_last,
+                                                                  [fst_pipeline_cost, snd_pipeline_cost, output_data_cycles],
+                                                                  input_data_cycles, batch_size)
+
+
+def sweep_bfly(head_dim, hidden_dim, num_len, ffn_inner_dim, parallesm_bu=4, parallesm_be=128, bit_width=16,
+                indata_dram_bw=2048, coef_dram_bw=256, outdata_dram_bw=2048, num_layer=1, batch_size=1, frequency=200, efficiency=0.85,
+                data_bit_width=None, coef_bit_width=None, acc_bit_width=None, board=None, as_dataframe=False):
+    """
+    Compute the cycles of one FABNet layer (two FFTs + two butterfly linear layers) on Butterfly_Accelerator for
+    every configuration at once. All the arguments can be scalars or arrays and are broadcast against each other,
+    e.g. use design_grid to get the cartesian product of several lists.
+    It returns a structured array (or a pandas DataFrame) with one entry per configuration, including its resource usage.
+    As in Butterfly_Accelerator, data_bit_width (activations in dram), coef_bit_width (twiddles and weights) and
+    acc_bit_width (data brams and butterfly units) default to bit_width.
+    With board (e.g. "vcu128", see resource_model.BOARDS), the configurations that do not fit the board are discarded.
+    Configurations whose layers overflow the brams, which Butterfly_Accelerator rejects, keep their entry with
+    fits_bram False and infinite cycles and latency.
+    """
+    data_bit_width = bit_width if data_bit_width is None else data_bit_width
+    coef_bit_width = bit_width if coef_bit_width is None else coef_bit_width
+    acc_bit_width = bit_width if acc_bit_width is None else acc_bit_width
+    params = np.broadcast_arrays(*[np.asarray(x) for x in (head_dim, hidden_dim, num_len, ffn_inner_dim, parallesm_bu,
+                                    parallesm_be, data_bit_width, coef_bit_width, acc_bit_width, indata_dram_bw, coef_dram_bw,
+                                    outdata_dram_bw, num_layer, batch_size)])
+    params = [x.ravel() for x in params]
+    (head_dim, hidden_dim, num_len, ffn_inner_dim, parallesm_bu, parallesm_be, data_bit_width, coef_bit_width, acc_bit_width,
+        indata_dram_bw, coef_dram_bw, outdata_dram_bw, num_layer, batch_size) = params
+    hidden_dim = ceil_power2(hidden_dim)
+    ffn_inner_dim = ceil_power2(ffn_inner_dim)
+    assert np.all(parallesm_bu == np.floor(parallesm_bu)), "A butterfly engine has a whole number of butterfly units"
+    parallesm_bu = parallesm_bu.astype(np.int64)
+    parallesm_be = parallesm_be.astype(np.int64)
+    mem = (parallesm_bu, parallesm_be, data_bit_width, coef_bit_width, indata_dram_bw, coef_dram_bw, outdata_dram_bw)
+    logging.info("Sweeping %d configurations of butterfly accelerator" % len(num_len))
+
+    # Same sequence of layers as simulator_bfly.py
+    fft_time = fft_cycles(hidden_dim, num_len, *mem, batch_size, complex_input=False, complex_output=True) # 1st dimension FFT
+    fft_time = fft_time + fft_cycles(hidden_dim, num_len, *mem, batch_size, complex_input=True, complex_output=False) # 2nd dimension FFT
+    bfly_time = bfly_cycles(num_len, hidden_dim, ffn_inner_dim, *mem, batch_size)
+    bfly_time = bfly_time + bfly_cycles(num_len, ffn_inner_dim, hidden_dim, *mem, batch_size)
+    fits_bram = bram_fits(hidden_dim, num_len, ffn_inner_dim, parallesm_bu, coef_bit_width, acc_bit_width)
+    if not np.all(fits_bram):
+        logging.info("%d configurations overflow the brams" % np.sum(~fits_bram))
+        fft_time = np.where(fits_bram, fft_time, np.inf)
+        bfly_time = np.where(fits_bram, bfly_time, np.inf)
+    run_cycles = fft_time + bfly_time
+    network_cycles = num_layer * run_cycles
+    ms_per_clock = (1.0/frequency/1000) / efficiency
+    resources = bfly_resources(hidden_dim, num_len, ffn_inner_dim, parallesm_bu, parallesm_be, acc_bit_width, coef_bit_width)
+
+    results = np.empty(len(num_len), dtype=SWEEP_FIELDS)
+    for name, value in zip(["head_dim", "hidden_dim", "num_len", "ffn_inner_dim", "parallesm_bu", "parallesm_be",
+                            "data_bit_width", "coef_bit_width", "acc_bit_width",
+                            "indata_dram_bw", "coef_dram_bw", "outdata_dram_bw", "num_layer", "batch_size",
+                            "fft_cycles", "bfly_cycles", "run_cycles", "network_cycles", "latency_ms", "bram18", "dsp", "lut", "fits_bram"],
+                            [head_dim, hidden_dim, num_len, ffn_inner_dim, parallesm_bu, parallesm_be, data_bit_width, coef_bit_width, acc_bit_width,
+                            indata_dram_bw, coef_dram_bw, outdata_dram_bw, num_layer, batch_size,
+                            fft_time, bfly_time, run_cycles, network_cycles, network_cycles*ms_per_clock,
+                            resources["bram18"], resources["dsp"], resources["lut"], fits_bram]):
+        results[name] = value
+    if board is not None:
+        feasible, _ = fits_board(resources, board)
+        logging.info("Discarding %d configurations that do not fit %s" % (np.sum(~feasible), board))
+        results = results[feasible]
+    if as_dataframe:
+        import pandas as pd
+        return pd.DataFrame(results)
+    return results
+
+
+def design_grid(**kwargs):
+    """
+    Build the cartesian product of the given lists, e.g. design_grid(parallesm_be=[16, 32], num_len=[128, 1024]).
+    The returned dict of flat arrays can be passed directly to sweep_bfly as keyword arguments.
+    """
+    names = list(kwargs.keys())
+    grids = np.meshgrid(*[np.asarray(kwargs[name]) for name in names], indexing="ij")
+    return {name: grid.ravel() for name, grid in zip(names, grids)}
+
+
+def unit_test():
+    # Check the vectorized sweep against the analytical model of Butterfly_Accelerator, one design at a time
+    import contextlib
+    import io
+    from bfly_accelerator import Butterfly_Accelerator
+    from resource_model import design_resources
+    grid = design_grid(hidden_dim=[256, 768], num_len=[100, 512], ffn_inner_dim=[1024, 3072], parallesm_be=[20, 128],
+                       indata_dram_bw=[64, 2048], coef_dram_bw=[64, 256], batch_size=[1, 3])
+    # Mixed widths, 12-bit values do not divide the dram bandwidth
+    grid = {name: np.concatenate([values, values]) for name, values in grid.items()}
+    num_point = len(grid["num_len"]) // 2
+    for name, widths in [("data_bit_width", (16, 12)), ("coef_bit_width", (16, 8)), ("acc_bit_width", (16, 24))]:
+        grid[name] = np.repeat(widths, num_point)
+    results = sweep_bfly(32, outdata_dram_bw=2048, **grid)
+    for i, result in enumerate(results):
+        design = Butterfly_Accelerator(32, int(grid["hidden_dim"][i]), int(grid["num_len"][i]), int(grid["ffn_inner_dim"][i]),
+                                       parallesm_be=int(grid["parallesm_be"][i]), indata_dram_bw=int(grid["indata_dram_bw"][i]),
+                                       coef_dram_bw=int(grid["coef_dram_bw"][i]), outdata_dram_bw=2048,
+                                       batch_size=int(grid["batch_size"][i]), analytical=True,
+                                       data_bit_width=int(grid["data_bit_width"][i]), coef_bit_width=int(grid["coef_bit_width"][i]),
+                                       acc_bit_width=int(grid["acc_bit_width"][i]))
+        with contextlib.redirect_stdout(io.StringIO()):
+            fft_time = design.run_fft(complex_input=False, complex_output=True) + design.run_fft(complex_input=True, complex_output=False)
+            bfly_time = design.run_bfly(design.num_len, design.hidden_dim, design.ffn_inner_dim)
+            bfly_time += design.run_bfly(design.num_len, design.ffn_inner_dim, design.hidden_dim)
+        assert np.isclose(result["fft_cycles"], fft_time) and np.isclose(result["bfly_cycles"], bfly_time), (
+            {name: grid[name][i] for name in grid}, result["fft_cycles"], fft_time, result["bfly_cycles"], bfly_time)
+        assert np.isclose(result["run_cycles"], design.run_cycles)
+        assert all(np.isclose(result[key], value) for key, value in design_resources(design).items() if key != "bram36")
+    assert results["parallesm_bu"].dtype == np.int64 and np.all(results["fits_bram"])
+    # A hidden size above the ffn and sequence lengths overflows the brams, the sweep masks what the design rejects
+    for hidden_dim, parallesm_bu in [(1024, 4), (512, 2)]:
+        result = sweep_bfly(32, hidden_dim, 128, 256, parallesm_bu=parallesm_bu)[0]
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                Butterfly_Accelerator(32, hidden_dim, 128, 256, parallesm_bu=parallesm_bu, analytical=True).run_fft()
+            rejected = False
+        except AssertionError:
+            rejected = True
+        assert rejected and not result["fits_bram"] and np.isinf(result["latency_ms"]), (hidden_dim, result)
+    print ("Sweep matches the analytical model on %d configurations" % len(results))
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -0,0 +1,117 @@
+from bfly_accelerator import Butterfly_Accelerator
+from att_accelerator import Att_Accelerator
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+SIMULATOR_DIR = os.path.dirname(os.path.abspath(__file__))
+# Next to the simulator, not in the working directory of the figure script (ignored by git)
+DEFAULT_CACHE_PATH = os.path.join(SIMULATOR_DIR, "sim_cache.db")
+
+
+def simulate_bfly(head_dim, hidden_dim, num_len, ffn_inner_dim, parallesm_bu=4, parallesm_be=128,
+                    indata_dram_bw=2048, coef_dram_bw=256, outdata_dram_bw=2048):
+    # One FABNet layer on the butterfly accelerator, cycles per op
+    design = Butterfly_Accelerator(head_dim, hidden_dim, num_len, ffn_inner_dim,
+                                    parallesm_bu=parallesm_bu, parallesm_be=parallesm_be,
+                                    indata_dram_bw=indata_dram_bw, coef_dram_bw=coef_dram_bw, outdata_dram_bw=outdata_dram_bw,
+                                    analytical=True)
+    fft_cycles = design.run_fft(complex_input=False, complex_output=True) # 1st dimension FFT
+    fft_cycles += design.run_fft(complex_input=True, complex_output=False) # 2nd dimension FFT
+    bfly_cycles = design.run_bfly(design.num_len, design.hidden_dim, design.ffn_inner_dim)
+    bfly_cycles += design.run_bfly(design.num_len, design.ffn_inner_dim, design.hidden_dim)
+    return {"fft_cycles": fft_cycles, "bfly_cycles": bfly_cycles, "run_cycles": design.run_cycles}
+
+
+def simulate_att(head_dim, hidden_dim, num_len, ffn_inner_dim, dram_bw=2048, pv_lt=64, p_head=8):
+    # Every op of the attention accelerator, each run returns its own cycles
+    design = Att_Accelerator(head_dim, hidden_dim, num_len, ffn_inner_dim, dram_bw=dram_bw, pv_lt=pv_lt, p_head=p_head, analytical=True)
+    fft_cycles = design.run_fft(complex_input=False, complex_output=True)
+    fft_cycles += design.run_fft(complex_input=True, complex_output=False)
+    return {"fft_cycles": fft_cycles, "att_cycles": design.run_att(), "lp_cycles": design.run_lp(),
+            "fc1_cycles": design.run_fc1(), "fc2_cycles": design.run_fc2()}
+
+
+def simulator_sources():
+    # Results are invalidated whenever any python file of the simulator changes
+    return sorted(glob.glob(os.path.join(SIMULATOR_DIR, "*.py")))
+
+
+def source_hash():
+    digest = hashlib.sha1()
+    for path in simulator_sources():
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def config_key(sim_fn, config, sim_hash):
+    # Hash of the simulated function, its parameters and the simulator version
+    desc = {"fn": "%s.%s" % (sim_fn.__module__, sim_fn.__qualname__), "config": config, "source": sim_hash}
+    return hashlib.sha1(json.dumps(desc, sort_keys=True).encode()).hexdigest()
+
+
+def _run_one(job):
+    sim_fn, config = job
+    return sim_fn(**config)
+
+
+class SimCache:
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH):
+        self.cache_path = cache_path
+        self.conn = sqlite3.connect(cache_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, fn TEXT, config TEXT, result TEXT)")
+
+    def get(self, keys):
+        found = {}
+        for i in range(0, len(keys), 500): # Stay below the sqlite variable limit
+            chunk = keys[i:i+500]
+            rows = self.conn.execute("SELECT key, result FROM results WHERE key IN (%s)" % ",".join("?"*len(chunk)), chunk)
+            found.update({key: json.loads(result) for key, result in rows})
+        return found
+
+    def put(self, entries):
+        # entries: list of (key, fn name, config, result)
+        self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                [(key, fn, json.dumps(config, sort_keys=True), json.dumps(result)) for key, fn, config, result in entries])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def run_sweep(sim_fn, configs, cache_path=DEFAULT_CACHE_PATH, num_workers=None):
+    """
+    Run sim_fn(**config) for every config in configs and return the results in the same order.
+    sim_fn must be a module-level function returning a JSON-serializable dict (e.g. simulate_bfly, simulate_att).
+    Results are memoized in a sqlite file keyed by the parameters, only the missing configs are simulated,
+    fanned out over num_workers processes (None for all cores, 1 to run in this process).
+    """
+    sim_hash = source_hash()
+    keys = [config_key(sim_fn, config, sim_hash) for config in configs]
+    cache = SimCache(cache_path)
+    results = cache.get(keys)
+    missing = {}
+    for key, config in zip(keys, configs):
+        if key not in results: missing[key] = config
+    logging.info("Sweep of %d configurations: %d cached, %d to simulate" % (len(configs), len(configs) - len(missing), len(missing)))
+
+    if missing:
+        jobs = [(sim_fn, config) for config in missing.values()]
+        if num_workers == 1 or len(jobs) == 1:
+            outputs = [_run_one(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                outputs = list(executor.map(_run_one, jobs, chunksize=max(1, len(jobs) // (4 * (num_workers or os.cpu_count() or 1)))))
+        fn_name = "%s.%s" % (sim_fn.__module__, sim_fn.__qualname__)
+        cache.put([(key, fn_name, config, output) for (key, config), output in zip(missing.items(), outputs)])
+        results.update(zip(missing.keys(), outputs))
+    cache.close()
+    return [results[key] for key in keys]
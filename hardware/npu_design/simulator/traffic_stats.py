@@ -0,0 +1,125 @@
+from dram import Dram
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Energy per bit accessed in pJ, the energy of one access is this value times the access width of the memory
+# (Dram bandwidth or Bram width). Rough numbers from the literature, override them with --energy_table
+ENERGY_TABLES = {
+    "hbm": {"dram_read": 3.9, "dram_write": 3.9, "bram_read": 0.15, "bram_write": 0.2},
+    "ddr3": {"dram_read": 20.0, "dram_write": 20.0, "bram_read": 0.15, "bram_write": 0.2},
+}
+
+
+def load_energy_table(offchip_mem="hbm", path=""):
+    # Default table of the off-chip memory, updated with the entries of the json file if given
+    energy_table = dict(ENERGY_TABLES[offchip_mem])
+    if path:
+        with open(path) as f:
+            energy_table.update(json.load(f))
+    return energy_table
+
+
+def memory_type(memory):
+    return "dram" if isinstance(memory, Dram) else "bram"
+
+
+def memory_group(memory):
+    # Memories replicated per engine or per head are reported together, e.g. "data_bram_a 3" -> "data_bram_a"
+    name = memory.dram_name if isinstance(memory, Dram) else memory.bram_name
+    return re.sub(r"\s*\d+$", "", name)
+
+
+def access_bits(memory):
+    return memory.bandwidth if isinstance(memory, Dram) else memory.bram_width
+
+
+class Traffic_Stats:
+    """
+    Aggregate the access counters of the Bram/Dram of a design per op and per layer.
+    The accelerators call begin_op/end_op around every op, the accesses counted in between are attributed to the op.
+    Ops only simulate one tile (or one row) of their data, repeat_op scales the accesses counted so far to the whole op.
+    """
+    def __init__(self, memories):
+        self.memories = memories
+        self.layer = 0 # Set by the caller when simulating a whole network
+        self.ops = []
+        self.op_name = None
+        self.before = None
+
+    def reset(self):
+        self.ops = []
+        self.op_name = None
+
+    def _snapshot(self):
+        return {id(memory): (memory.num_read_access, memory.num_write_access) for memory in self.memories}
+
+    def begin_op(self, op_name):
+        self.op_name = op_name
+        self.before = self._snapshot()
+
+    def repeat_op(self, memories, num_read_repeat, num_write_repeat=None):
+        # The accesses of these memories since begin_op happen num_*_repeat times in total
+        if num_write_repeat is None: num_write_repeat = num_read_repeat
+        for memory in memories:
+            num_read, num_write = self.before[id(memory)]
+            memory.add_stat((num_read_repeat - 1) * (memory.num_read_access - num_read),
+                            (num_write_repeat - 1) * (memory.num_write_access - num_write))
+
+    def end_op(self, cycles):
+        groups = {}
+        for memory in self.memories:
+            num_read, num_write = self.before[id(memory)]
+            num_read, num_write = memory.num_read_access - num_read, memory.num_write_access - num_write
+            if num_read == 0 and num_write == 0: continue
+            group = groups.setdefault(memory_group(memory), {"type": memory_type(memory), "read_access": 0, "write_access": 0,
+                                                             "read_bytes": 0, "write_bytes": 0})
+            group["read_access"] += num_read
+            group["write_access"] += num_write
+            group["read_bytes"] += num_read * access_bits(memory) / 8
+            group["write_bytes"] += num_write * access_bits(memory) / 8
+        self.ops.append({"op": self.op_name, "layer": self.layer, "cycles": cycles, "memories": groups})
+        self.op_name = None
+
+    def report(self, energy_table, num_layer=1, batch_size=1):
+        """
+        Convert the bytes moved by every op to energy with energy_table (pJ per bit, see ENERGY_TABLES).
+        When only one layer is simulated, num_layer scales the totals to the whole network.
+        Returns a dict with the ops, the layers, the totals and the energy/off-chip traffic per inference.
+        """
+        def summary(entries):
+            result = {"cycles": 0, "dram_bytes": 0, "bram_bytes": 0, "energy_pj": 0, "memories": {}}
+            for entry in entries:
+                result["cycles"] += entry["cycles"]
+                for name, group in entry["memories"].items():
+                    total = result["memories"].setdefault(name, {"type": group["type"], "read_access": 0, "write_access": 0,
+                                                                 "read_bytes": 0, "write_bytes": 0, "energy_pj": 0})
+                    energy_pj = 8 * (group["read_bytes"] * energy_table[group["type"] + "_read"] +
+                                     group["write_bytes"] * energy_table[group["type"] + "_write"])
+                    for key in ["read_access", "write_access", "read_bytes", "write_bytes"]:
+                        total[key] += group[key]
+                    total["energy_pj"] += energy_pj
+                    result[group["type"] + "_bytes"] += group["read_bytes"] + group["write_bytes"]
+                    result["energy_pj"] += energy_pj
+            return result
+
+        ops = [dict(op, **{key: value for key, value in summary([op]).items() if key != "cycles"}) for op in self.ops]
+        layers = []
+        for op in self.ops:
+            if not layers or layers[-1]["layer"] != op["layer"]:
+                layers.append({"layer": op["layer"], "ops": []})
+            layers[-1]["ops"].append(op)
+        layers = [dict(summary(layer["ops"]), layer=layer["layer"]) for layer in layers]
+        total = summary(self.ops)
+        for key in ["cycles", "dram_bytes", "bram_bytes", "energy_pj"]:
+            total[key] *= num_layer
+        for group in total["memories"].values():
+            for key in ["read_access", "write_access", "read_bytes", "write_bytes", "energy_pj"]:
+                group[key] *= num_layer
+        per_inference = {"dram_bytes": total["dram_bytes"] / batch_size, "energy_uj": total["energy_pj"] / batch_size / 1e6}
+        logging.info("Energy per inference %.2f uJ, off-chip traffic per inference %.2f MB"
+                     % (per_inference["energy_uj"], per_inference["dram_bytes"] / 2**20))
+        return {"energy_table": energy_table, "num_layer": num_layer, "batch_size": batch_size,
+                "ops": ops, "layers": layers, "total": total, "per_inference": per_inference}
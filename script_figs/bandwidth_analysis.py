@@ -1,9 +1,10 @@
 import enum
 import sys
 from turtle import title 
-sys.path.insert(0,'..')
+sys.path.insert(0,'../hardware/npu_design/simulator/')
 from multi_head_engine import Multi_Head_Engine
 from bfly_accelerator import Butterfly_Accelerator
+from sweep import sweep_bfly, design_grid
 import argparse
 import logging
 
@@ -37,28 +38,14 @@ def collect_data(args, num_len):
 
     parallesms_be = [16, 32, 64, 96, 128]
     bw_list = [64, 128, 256, 512, 1024, 2048]
-    latency_list = []
-    # Get the bandwidhth
-    for i, parallesm_be in enumerate(parallesms_be):
-        latency = []
-        for j, bw in enumerate(bw_list):
-            # Instantiate Design
-            design = Butterfly_Accelerator(args.head_dim, hidden_dim, num_len, ffn_inner_dim, 
-                                            parallesm_bu=4, parallesm_be=parallesm_be,
-                                            indata_dram_bw=bw, coef_dram_bw=bw, outdata_dram_bw=bw)
-
-            # Run Fourier Layer
-            design.run_fft(complex_input=False, complex_output=True) # 1st dimension FFT
-            design.run_fft(complex_input=True, complex_output=False) # 2nd dimension FFT
-            
-            # Run Butterfly Layer for FFN
-            design.run_bfly(design.num_len, design.hidden_dim, design.ffn_inner_dim) 
-            design.run_bfly(design.num_len, design.ffn_inner_dim, design.hidden_dim)
-            network_run_cost = num_layer * design.run_cycles
-            ms_per_clock = (1/args.frequency/1000) / args.efficiency
-            latency.append(network_run_cost*ms_per_clock)
+    # Evaluate all the (parallesm_be, bandwidth) points at once
+    grid = design_grid(parallesm_be=parallesms_be, bw=bw_list)
+    results = sweep_bfly(args.head_dim, hidden_dim, num_len, ffn_inner_dim, parallesm_bu=4, parallesm_be=grid["parallesm_be"],
+                         indata_dram_bw=grid["bw"], coef_dram_bw=grid["bw"], outdata_dram_bw=grid["bw"],
+                         num_layer=num_layer, frequency=args.frequency, efficiency=args.efficiency)
+    latency_list = results["latency_ms"].reshape(len(parallesms_be), len(bw_list)).tolist()
+    for parallesm_be, latency in zip(parallesms_be, latency_list):
         print ("Parallesm of Butterfly Engines:", parallesm_be," with latency:", latency)
-        latency_list.append(latency)
     return latency_list
 
 def draw_figs(latency_list):
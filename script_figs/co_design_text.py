@@ -4,7 +4,8 @@ import sys
 sys.path.insert(0,'../hardware/npu_design/simulator/')
 import enum
 from multi_head_engine import Multi_Head_Engine
-from bfly_accelerator import Butterfly_Accelerator
+from sweep_runner import run_sweep, simulate_bfly
+from codesign_search import pareto_mask
 import argparse
 import logging
 import numpy as np
@@ -39,43 +40,6 @@ num_len = 4000
 bw = 2048
 num_be = [128, 64, 32, 16]
 
-# Faster than is_pareto_efficient_simple, but less readable.
-def is_pareto_efficient(costs, return_mask = True):
-    """
-    Find the pareto-efficient points
-    :param costs: An (n_points, n_costs) array
-    :param return_mask: True to return a mask
-    :return: An array of indices of pareto-efficient points.
-        If return_mask is True, this will be an (n_points, ) boolean array
-        Otherwise it will be a (n_efficient_points, ) integer array of indices.
-    """
-    is_efficient = np.arange(costs.shape[0])
-    n_points = costs.shape[0]
-    next_point_index = 0  # Next index in the is_efficient array to search for
-    print (len(costs))
-    while next_point_index<len(costs):
-        nondominated_point_mask = np.any(costs<costs[next_point_index], axis=1)
-        nondominated_point_mask[next_point_index] = True
-        is_efficient = is_efficient[nondominated_point_mask]  # Remove dominated points
-        costs = costs[nondominated_point_mask]
-        prev_point_index = next_point_index
-        next_point_index = np.sum(nondominated_point_mask[:next_point_index])+1
-        #print (next_point_index)
-        #print (prev_point_index)
-        #print (next_point_index//100)
-        #print (prev_point_index//100)
-        #print ((prev_point_index//100) != (next_point_index//100))
-        if ((next_point_index//1000) != (prev_point_index//1000)):
-            print ("%d / %d"%(next_point_index, len(costs)))
-    print (next_point_index, len(costs))
-    if return_mask:
-        is_efficient_mask = np.zeros(n_points, dtype = bool)
-        is_efficient_mask[is_efficient] = True
-        return is_efficient_mask
-    else:
-        return is_efficient
-
-
 def collect_data(args, file_name):
     with open(file_name) as f:
         f = f.readlines()
@@ -86,27 +50,19 @@ def collect_data(args, file_name):
             test_acc = float(words[9][:-1])
             for i in range(len(num_be)):
                 acc.append(test_acc*100)
-    lat = []
     ms_per_clock = (1/args.frequency/1000) / args.efficiency
+    configs, layers = [], []
     for ratio in FFN_intern_ratio:
         for dim in Hidden_dim:
             for layer in Num_layer:
                 if (layer == 1) and (file_name == "co_design2_text.log"): continue
                 for be in num_be:
-                    bu = 4*128/be
-                    print ("##############simulator using %d be and %d bu######################"%(be, bu))
-                    ############ Get Latency breakdown from butterfly accelerator ####################
-                    bfly_design = Butterfly_Accelerator(args.head_dim, dim, num_len, int(dim*ratio), 
-                                                    parallesm_bu=4*128/be, parallesm_be=be,
-                                                    indata_dram_bw=bw, coef_dram_bw=bw, outdata_dram_bw=bw)
-                    # Run Fourier Layer
-                    bfly_design.run_fft(complex_input=False, complex_output=True) # 1st dimension FFT
-                    bfly_design.run_fft(complex_input=True, complex_output=False) # 2nd dimension FFT
-
-                    # Run Butterfly Layer for FFN
-                    bfly_design.run_bfly(bfly_design.num_len, bfly_design.hidden_dim, bfly_design.ffn_inner_dim) 
-                    bfly_design.run_bfly(bfly_design.num_len, bfly_design.ffn_inner_dim, bfly_design.hidden_dim)
-                    lat.append(bfly_design.run_cycles * layer * ms_per_clock)
+                    configs.append(dict(head_dim=args.head_dim, hidden_dim=dim, num_len=num_len, ffn_inner_dim=int(dim*ratio),
+                                        parallesm_bu=4*128//be, parallesm_be=be, indata_dram_bw=bw, coef_dram_bw=bw, outdata_dram_bw=bw))
+                    layers.append(layer)
+    # Simulate every design point at once, results are cached in sweep_runner.DEFAULT_CACHE_PATH
+    results = run_sweep(simulate_bfly, configs)
+    lat = [result["run_cycles"] * layer * ms_per_clock for result, layer in zip(results, layers)]
     return acc, lat
 
 def draw_figs(acc, lat):
@@ -117,7 +73,7 @@ def draw_figs(acc, lat):
     baxes = brokenaxes(ylims=[[53.0,55.6],[62.0,64.2]], hspace=.15, despine=False)
     np_cost = np.array(list(zip([-x for x in acc],lat)))
     print (np.shape(np_cost))
-    ptf_mask = is_pareto_efficient(np_cost)
+    ptf_mask = pareto_mask(np_cost)
     paratos = np.array(list(zip(acc,lat)))[ptf_mask]
     paratos = paratos[paratos[:,1].argsort()]
     non_paratos = np_cost[np.invert(ptf_mask)]
@@ -1,10 +1,10 @@
 from ast import Num
 from cProfile import label
 import sys
-sys.path.insert(0,'..')
+sys.path.insert(0,'../hardware/npu_design/simulator/')
 import enum
 from multi_head_engine import Multi_Head_Engine
-from bfly_accelerator import Butterfly_Accelerator
+from sweep_runner import run_sweep, simulate_bfly
 import argparse
 import logging
 import numpy as np
@@ -82,27 +82,19 @@ def collect_data(args, file_name):
             test_acc = float(words[9][:-1])
             for i in range(len(num_be)):
                 acc.append(test_acc*100)
-    lat = []
     ms_per_clock = (1/args.frequency/1000) / args.efficiency
+    configs, layers = [], []
     for ratio in FFN_intern_ratio:
         for dim in Hidden_dim:
             for layer in Num_layer:
                 if (layer == 1) and (file_name == "co_design2_text.log"): continue
                 for be in num_be:
-                    bu = 4*128/be
-                    print ("##############simulator using %d be and %d bu######################"%(be, bu))
-                    ############ Get Latency breakdown from butterfly accelerator ####################
-                    bfly_design = Butterfly_Accelerator(args.head_dim, dim, num_len, int(dim*ratio), 
-                                                    parallesm_bu=4*128/be, parallesm_be=be,
-                                                    indata_dram_bw=bw, coef_dram_bw=bw, outdata_dram_bw=bw)
-                    # Run Fourier Layer
-                    bfly_design.run_fft(complex_input=False, complex_output=True) # 1st dimension FFT
-                    bfly_design.run_fft(complex_input=True, complex_output=False) # 2nd dimension FFT
-
-                    # Run Butterfly Layer for FFN
-                    bfly_design.run_bfly(bfly_design.num_len, bfly_design.hidden_dim, bfly_design.ffn_inner_dim) 
-                    bfly_design.run_bfly(bfly_design.num_len, bfly_design.ffn_inner_dim, bfly_design.hidden_dim)
-                    lat.append(bfly_design.run_cycles * layer * ms_per_clock)
+                    configs.append(dict(head_dim=args.head_dim, hidden_dim=dim, num_len=num_len, ffn_inner_dim=int(dim*ratio),
+                                        parallesm_bu=4*128//be, parallesm_be=be, indata_dram_bw=bw, coef_dram_bw=bw, outdata_dram_bw=bw))
+                    layers.append(layer)
+    # Simulate every design point at once, results are cached in sweep_runner.DEFAULT_CACHE_PATH
+    results = run_sweep(simulate_bfly, configs)
+    lat = [result["run_cycles"] * layer * ms_per_clock for result, layer in zip(results, layers)]
     return acc, lat
 
 def draw_figs(acc, lat):
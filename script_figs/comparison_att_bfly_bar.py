@@ -69,7 +69,7 @@ def collect_data(args):
 
         ############# Get Latency breakdown from attention accelerator ###################
         # Each head engine is 64*4, totally 8 head engines, so the parallelsm is 64 * 4 * 8 = 2048
-        att_design = Att_Accelerator(args.head_dim, hidden_dim, num_len, ffn_inner_dim, dram_bw=bw, pv_lt=64, p_head = 8) 
+        att_design = Att_Accelerator(args.head_dim, hidden_dim, num_len, ffn_inner_dim, dram_bw=bw, pv_lt=64, p_head = 8, analytical=True)
         # Run Attention
         att_time = 0
         att_time += att_design.run_att()
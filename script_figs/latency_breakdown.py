@@ -1,6 +1,6 @@
 import enum
 from multi_head_engine import Multi_Head_Engine
-from bfly_accelerator import Butterfly_Accelerator
+from sweep_runner import run_sweep, simulate_bfly
 import argparse
 import logging
 import numpy as np
@@ -35,31 +35,16 @@ def collect_data(args):
     parallesm_be = 128
     bw = 2048
     # Get the bandwidhth
-    for i, num_len in enumerate(num_lens):
+    # Simulate every sequence length at once, results are cached in sweep_runner.DEFAULT_CACHE_PATH
+    results = run_sweep(simulate_bfly, [dict(head_dim=args.head_dim, hidden_dim=hidden_dim, num_len=num_len, ffn_inner_dim=ffn_inner_dim,
+                                             parallesm_bu=4, parallesm_be=parallesm_be, indata_dram_bw=bw, coef_dram_bw=bw, outdata_dram_bw=bw)
+                                        for num_len in num_lens])
+    for result in results:
         percentage = []
-        # Instantiate Design
-        design = Butterfly_Accelerator(args.head_dim, hidden_dim, num_len, ffn_inner_dim, 
-                                        parallesm_bu=4, parallesm_be=parallesm_be,
-                                        indata_dram_bw=bw, coef_dram_bw=bw, outdata_dram_bw=bw)
-
-        # Run Fourier Layer
-        fft_time = 0
-        fft_time += design.run_fft(complex_input=False, complex_output=True) # 1st dimension FFT
-        fft_time += design.run_fft(complex_input=True, complex_output=False) # 2nd dimension FFT
-        fft_time *= num_layer
-
-        # Run Butterfly Layer for FFN
-        bfly_time = 0
-        bfly_time += design.run_bfly(design.num_len, design.hidden_dim, design.ffn_inner_dim) 
-        bfly_time +=  design.run_bfly(design.num_len, design.ffn_inner_dim, design.hidden_dim)
-        bfly_time *= num_layer
-
-        network_run_cost = num_layer * design.run_cycles
         ms_per_clock = (1/args.frequency/1000)
-
-        fft_time *= ms_per_clock
-        bfly_time *= ms_per_clock
-        whole_time = network_run_cost*ms_per_clock / args.efficiency
+        fft_time = result["fft_cycles"] * num_layer * ms_per_clock
+        bfly_time = result["bfly_cycles"] * num_layer * ms_per_clock
+        whole_time = num_layer * result["run_cycles"] * ms_per_clock / args.efficiency
 
         percentage.append(fft_time/whole_time)
         percentage.append(bfly_time/whole_time)
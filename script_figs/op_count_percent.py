@@ -1,9 +1,6 @@
 from cProfile import label
 import sys
-sys.path.insert(0,'../hardware/npu_design/simulator/')
 import enum
-from multi_head_engine import Multi_Head_Engine
-from bfly_accelerator import Butterfly_Accelerator
 import argparse
 import logging
 import numpy as np
@@ -2,8 +2,7 @@ import enum
 import sys 
 sys.path.insert(0,'../hardware/npu_design/simulator/')
 from multi_head_engine import Multi_Head_Engine
-from bfly_accelerator import Butterfly_Accelerator
-from att_accelerator import Att_Accelerator
+from sweep_runner import run_sweep, simulate_bfly, simulate_att
 import argparse
 import logging
 
@@ -47,64 +46,28 @@ def collect_data(args):
     att_times = []
     ffn_times = []
 
-    for i, num_len in enumerate(num_lens):
+    # Simulate every sequence length at once, results are cached in sweep_runner.DEFAULT_CACHE_PATH
+    bfly_results = run_sweep(simulate_bfly, [dict(head_dim=args.head_dim, hidden_dim=hidden_dim, num_len=num_len, ffn_inner_dim=ffn_inner_dim,
+                                                  parallesm_bu=4, parallesm_be=128, indata_dram_bw=bw, coef_dram_bw=bw, outdata_dram_bw=bw)
+                                             for num_len in num_lens])
+    # Each head engine is 64*4, totally 8 head engines, so the parallelsm is 64 * 4 * 8 = 2048
+    att_results = run_sweep(simulate_att, [dict(head_dim=args.head_dim, hidden_dim=hidden_dim, num_len=num_len, ffn_inner_dim=ffn_inner_dim,
+                                                dram_bw=bw, pv_lt=64, p_head=8)
+                                           for num_len in num_lens])
+
+    for bfly_result, att_result in zip(bfly_results, att_results):
         ############ Running FABNet on butterfly accelerator, Both SW Opt + HW Opt ####################
-        bfly_design = Butterfly_Accelerator(args.head_dim, hidden_dim, num_len, ffn_inner_dim, 
-                                        parallesm_bu=4, parallesm_be=128,
-                                        indata_dram_bw=bw, coef_dram_bw=bw, outdata_dram_bw=bw)
-        # Run Fourier Layer
-        fft_time_opt = 0
-        fft_time_opt += bfly_design.run_fft(complex_input=False, complex_output=True) # 1st dimension FFT
-        fft_time_opt += bfly_design.run_fft(complex_input=True, complex_output=False) # 2nd dimension FFT
-        fft_time_opt *= num_layer
-        fft_time_opt *= ms_per_clock
-        fft_times_opt.append(fft_time_opt)
-
-        # Run Butterfly Layer for FFN
-        bfly_time_opt = 0
-        bfly_time_opt += bfly_design.run_bfly(bfly_design.num_len, bfly_design.hidden_dim, bfly_design.ffn_inner_dim) 
-        bfly_time_opt +=  bfly_design.run_bfly(bfly_design.num_len, bfly_design.ffn_inner_dim, bfly_design.hidden_dim)
-        bfly_time_opt *= num_layer
-        bfly_time_opt *= ms_per_clock
-        bfly_times_opt.append(bfly_time_opt)
+        fft_times_opt.append(bfly_result["fft_cycles"] * num_layer * ms_per_clock)
+        bfly_times_opt.append(bfly_result["bfly_cycles"] * num_layer * ms_per_clock)
 
         ############ Running FABNet on attention accelerator, Only SW Opt ####################
-        # Each head engine is 64*4, totally 8 head engines, so the parallelsm is 64 * 4 * 8 = 2048
-        att_design = Att_Accelerator(args.head_dim, hidden_dim, num_len, ffn_inner_dim, dram_bw=bw, pv_lt=64, p_head = 8) 
-        # Run Fourier Layer. Since the hardware does not support, the time equivalent to run standard FC.
-        fft_time_unopt = 0
-        fft_time_unopt += att_design.run_fft(complex_input=False, complex_output=True)
-        fft_time_unopt += att_design.run_fft(complex_input=True, complex_output=False)
-        fft_time_unopt *= num_layer
-        fft_time_unopt *= ms_per_clock
-        fft_times_unopt.append(fft_time_unopt)
-
-        # Run Butterfly Layer for FFN. Since the hardware does not support, the time equivalent to run standard FC.
-        bfly_time_unopt = 0
-        bfly_time_unopt += att_design.run_fc1()
-        bfly_time_unopt += att_design.run_fc2()
-        bfly_time_unopt *= num_layer
-        bfly_time_unopt *= ms_per_clock
-        bfly_times_unopt.append(bfly_time_unopt)
+        # Since the hardware does not support Fourier and butterfly layers, the time equivalent to run standard FC.
+        fft_times_unopt.append(att_result["fft_cycles"] * num_layer * ms_per_clock)
+        bfly_times_unopt.append((att_result["fc1_cycles"] + att_result["fc2_cycles"]) * num_layer * ms_per_clock)
 
         ############# Runnig Bert on attention accelerator, Baseline ###################
-        # Each head engine is 64*4, totally 8 head engines, so the parallelsm is 64 * 4 * 8 = 2048
-        att_design = Att_Accelerator(args.head_dim, hidden_dim, num_len, ffn_inner_dim, dram_bw=bw, pv_lt=64, p_head = 8) 
-        # Run Attention
-        att_time = 0
-        att_time += att_design.run_att()
-        att_time += att_design.run_lp()
-        att_time *= num_layer
-        att_time *= ms_per_clock
-        att_times.append(att_time)
-
-        # Run FFN
-        ffn_time = 0
-        ffn_time += att_design.run_fc1()
-        ffn_time += att_design.run_fc2()
-        ffn_time *= num_layer
-        ffn_time *= ms_per_clock
-        ffn_times.append(ffn_time)
+        att_times.append((att_result["att_cycles"] + att_result["lp_cycles"]) * num_layer * ms_per_clock)
+        ffn_times.append((att_result["fc1_cycles"] + att_result["fc2_cycles"]) * num_layer * ms_per_clock)
     print ([sum(s) for s in zip(fft_times_opt, bfly_times_opt)])
     print ([sum(s) for s in zip(bfly_times_unopt, fft_times_unopt)])
     print ([sum(s) for s in zip(ffn_times, att_times)])
@@ -1,23 +1,19 @@
 # Third Party
 import argparse
-from genericpath import exists 
-from transformers import AutoTokenizer, AutoModelForPreTraining
-from datasets import load_dataset, load_metric
-from transformers import TrainingArguments, EvalPrediction
-from transformers import Trainer
+import csv
+import itertools
 import os
-from datetime import datetime
-import time
 import numpy as np
-from transformers import AutoConfig, AutoModel
-from transformers import PyTorchBenchmark, PyTorchBenchmarkArguments
+from transformers import EvalPrediction
 import torch
 from torch.profiler import profile, record_function, ProfilerActivity
 # Internal Library
-# from src.configs.bflylr_fnet_config import BflyLR_FNetConfig
-# from src.models.bflylr_fnet_model import BflyLR_FNetForSequenceClassification
+from src.timing import time_runs, latency_stats, machine_info
+from src.bucketing import serve, skewed_lengths
 
-from transformers import BertForPreTraining
+DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+RESULT_FIELDS = ["model_name", "model_version", "batch_size", "sequence_length", "threads", "dtype", "fourier_mixing", "bfly_backend",
+                 "median_ms", "p99_ms", "mean_ms", "std_ms", "ci95_low_ms", "ci95_high_ms", "runs", "tokens_per_s"]
 
 
 def compute_metrics(is_regression, metric, p: EvalPrediction):
@@ -30,11 +26,8 @@ def compute_metrics(is_regression, metric, p: EvalPrediction):
 
     return result
 
-def train(args):
-
-    print (args.sequence_length)
-    print (type(args.sequence_length))
-    ################# Initialize Model and Tokenizer ###############
+def build_model(args):
+    ################# Initialize Model ###############
     if args.model_version == "large":
         num_hidden_layers = 24
         intermediate_size = 4096
@@ -45,102 +38,145 @@ def train(args):
         intermediate_size = 3072
         hidden_size = 768
         num_attention_heads = 12
+    max_length = max(args.sequence_length)
     # Benchmarking FNet
     if (args.model_name == "fnet"):
         from src.configs.fnet_config import Vanilla_FNetConfig
         from src.models.fnet_model import FNetForSequenceClassification
-        tokenizer = AutoTokenizer.from_pretrained("google/fnet-base")
-        config = Vanilla_FNetConfig(num_attention_layers=args.num_attention_layers, attention_layout=args.attention_layout, 
-                                    num_labels=args.num_labels,max_position_embeddings=args.sequence_length[-1], 
-                                    tpu_short_seq_length=args.sequence_length[-1], num_hidden_layers=num_hidden_layers, 
-                                    intermediate_size=intermediate_size, hidden_size=hidden_size, num_attention_heads=num_attention_heads)
+        config = Vanilla_FNetConfig(num_attention_layers=args.num_attention_layers, attention_layout=args.attention_layout,
+                                    num_labels=args.num_labels,max_position_embeddings=max_length,
+                                    tpu_short_seq_length=max_length, num_hidden_layers=num_hidden_layers,
+                                    intermediate_size=intermediate_size, hidden_size=hidden_size, num_attention_heads=num_attention_heads,
+                                    fourier_mixing=args.fourier_mixing)
         model = FNetForSequenceClassification(config)
         print ("Vanilla Fnet")
-        print (model)
-        AutoConfig.register("vanilla_fnet", Vanilla_FNetConfig)
-        AutoModel.register(Vanilla_FNetConfig, FNetForSequenceClassification)
-        arg = PyTorchBenchmarkArguments(models=["vanilla_fnet"], batch_sizes=[args.batch_size], sequence_lengths=args.sequence_length, 
-                                        memory=False, multi_process=False, fp16=args.is_fp16) 
-        benchmark = PyTorchBenchmark(arg, configs=[config])
-        with profile(activities=[ProfilerActivity.CPU, ProfilerActivity.CUDA], record_shapes=True) as prof:
-            with record_function("model_inference"):
-                results = benchmark.run()
     # Benchmarking Bfly_FNet
     elif (args.model_name == "bfly_fnet"):
         from src.configs.bfly_fnet_config import Bfly_FNetConfig
         from src.models.bfly_fnet_model import Bfly_FNetForSequenceClassification
-        bfly_config = Bfly_FNetConfig(num_attention_layers=args.num_attention_layers, attention_layout=args.attention_layout, 
-                                    num_labels=args.num_labels, max_position_embeddings=args.sequence_length[-1], 
-                                    tpu_short_seq_length=args.sequence_length[-1], num_hidden_layers=num_hidden_layers, 
-                                    intermediate_size=intermediate_size, hidden_size=hidden_size, num_attention_heads=num_attention_heads)
-        bfly_model = Bfly_FNetForSequenceClassification(bfly_config)
+        config = Bfly_FNetConfig(num_attention_layers=args.num_attention_layers, attention_layout=args.attention_layout,
+                                    num_labels=args.num_labels, max_position_embeddings=max_length,
+                                    tpu_short_seq_length=max_length, num_hidden_layers=num_hidden_layers,
+                                    intermediate_size=intermediate_size, hidden_size=hidden_size, num_attention_heads=num_attention_heads,
+                                    bfly_backend=args.bfly_backend, fourier_mixing=args.fourier_mixing)
+        model = Bfly_FNetForSequenceClassification(config)
         print ("Butterfly Fnet")
-        print (bfly_model)
-        AutoConfig.register("bfly_fnet", Bfly_FNetConfig)
-        AutoModel.register(Bfly_FNetConfig, Bfly_FNetForSequenceClassification)
-        arg = PyTorchBenchmarkArguments(models=["bfly_fnet"], batch_sizes=[args.batch_size], sequence_lengths=args.sequence_length, 
-                                        memory=False, multi_process=False, fp16=args.is_fp16)
-        benchmark = PyTorchBenchmark(arg, configs=[bfly_config])
-        if torch.cuda.is_available(): 
-            print ("Profilling CUDA performance")
-            with profile(activities=[ProfilerActivity.CPU, ProfilerActivity.CUDA], record_shapes=True) as prof:
-                with record_function("model_inference"):
-                    results = benchmark.run()
-        else:
-            print ("Profilling CPU performance")
-            with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
-                with record_function("model_inference"):
-                    results = benchmark.run()
+    # Benchmarking BflyLR_FNet
+    elif (args.model_name == "bflylr_fnet"):
+        from src.configs.bflylr_fnet_config import BflyLR_FNetConfig
+        from src.models.bflylr_fnet_model import BflyLR_FNetForSequenceClassification
+        config = BflyLR_FNetConfig(num_attention_layers=args.num_attention_layers, attention_layout=args.attention_layout,
+                                    num_labels=args.num_labels, max_position_embeddings=max_length,
+                                    tpu_short_seq_length=max_length, num_hidden_layers=num_hidden_layers,
+                                    intermediate_size=intermediate_size, hidden_size=hidden_size, num_attention_heads=num_attention_heads,
+                                    fourier_mixing=args.fourier_mixing, lr_ratio=args.lr_ratio)
+        model = BflyLR_FNetForSequenceClassification(config)
+        print ("Butterfly Low Rank Fnet")
     # Benchmarking Bert
     elif (args.model_name == "bert"):
         from src.configs.bert_config import Profile_BertConfig
         from src.models.bert_model import BertForSequenceClassification
-        bert_config = Profile_BertConfig(num_labels=args.num_labels, max_position_embeddings=args.sequence_length[-1], 
-                                    num_hidden_layers=num_hidden_layers, intermediate_size=intermediate_size, hidden_size=hidden_size, 
+        config = Profile_BertConfig(num_labels=args.num_labels, max_position_embeddings=max_length,
+                                    num_hidden_layers=num_hidden_layers, intermediate_size=intermediate_size, hidden_size=hidden_size,
                                     num_attention_heads=num_attention_heads)
-        bert_model = BertForSequenceClassification(bert_config)
+        model = BertForSequenceClassification(config)
         print ("Vanilla Bert")
-        print (bert_model)
-        AutoConfig.register("bert_vanilla", Profile_BertConfig)
-        AutoModel.register(Profile_BertConfig, BertForSequenceClassification)
-        arg = PyTorchBenchmarkArguments(models=["bert_vanilla"], batch_sizes=[args.batch_size], sequence_lengths=args.sequence_length, 
-                                        memory=False, multi_process= False, fp16=args.is_fp16)
-        benchmark = PyTorchBenchmark(arg, configs=[bert_config])
-        if torch.cuda.is_available(): 
-            print ("Profilling CUDA performance")
-            
-            with profile(activities=[ProfilerActivity.CPU, ProfilerActivity.CUDA], record_shapes=True) as prof:
-                with record_function("model_inference"):
-                    results = benchmark.run()
-            # Keep this for later use, old version
-            # from transformers import BertTokenizer
-            # tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', pad_to_max_length=True)
-            # inputs = tokenizer("Hello, my dog is cute", return_tensors="pt", max_length = args.sequence_length, padding='max_length')
-            # bert_model.cuda()
-            # inputs.to(device='cuda')
-            # results = None
-            # with profile(activities=[ProfilerActivity.CPU, ProfilerActivity.CUDA], record_shapes=True) as prof:
-            #     with record_function("model_inference"):
-            #         bert_model(**inputs)
-        else: 
-            print ("Profilling CPU performance")
-            from transformers import BertTokenizer
-            tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', pad_to_max_length=True)
-            inputs = tokenizer("Hello, my dog is cute", return_tensors="pt", max_length = args.sequence_length[-1], padding='max_length')
-            results = None
-            with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+    else:
+        raise NotImplementedError("Not supported model %s" % args.model_name)
+    return model.eval()
+
+
+def make_inputs(model, batch_size, sequence_length, seed=0):
+    # Random full-length token ids, the models see no padding
+    generator = torch.Generator().manual_seed(seed)
+    input_ids = torch.randint(0, model.config.vocab_size, (batch_size, sequence_length), generator=generator)
+    return {"input_ids": input_ids, "token_type_ids": torch.zeros_like(input_ids)}
+
+
+def benchmark(model, args):
+    """
+    Time the model over the cartesian product of args.batch_size, args.sequence_length, args.threads and args.dtype in
+    this process, args.warmup untimed and args.runs timed forwards per point. No profiler is active while timing.
+    Returns one row of RESULT_FIELDS per point, tokens_per_s is batch_size * sequence_length / median latency.
+    """
+    device = "cuda" if torch.cuda.is_available() and not args.cpu else "cpu"
+    model.to(device)
+    num_threads = torch.get_num_threads()
+    results = []
+    try:
+        for dtype_name in args.dtype:
+            model.to(DTYPES[dtype_name])
+            for batch_size, sequence_length, threads in itertools.product(args.batch_size, args.sequence_length, args.threads):
+                torch.set_num_threads(threads)
+                inputs = {key: value.to(device) for key, value in make_inputs(model, batch_size, sequence_length).items()}
+                try:
+                    stats = latency_stats(time_runs(lambda: model(**inputs), args.warmup, args.runs, device == "cuda"))
+                except RuntimeError as error: # e.g. torch.fft has no bfloat16 kernels
+                    print ("Skipped %s batch %d seq %d %s: %s" % (args.model_name, batch_size, sequence_length, dtype_name, error))
+                    continue
+                result = dict(model_name=args.model_name, model_version=args.model_version, batch_size=batch_size,
+                              sequence_length=sequence_length, threads=threads, dtype=dtype_name,
+                              fourier_mixing=args.fourier_mixing if args.model_name != "bert" else "",
+                              bfly_backend=args.bfly_backend if args.model_name == "bfly_fnet" else "",
+                              tokens_per_s=batch_size * sequence_length * 1000 / stats["median_ms"], **stats)
+                results.append({key: result[key] for key in RESULT_FIELDS})
+                print ("%s %s batch %d seq %d threads %d %s: median %.3f ms, p99 %.3f ms, %.1f tokens/s" % (
+                       args.model_name, args.model_version, batch_size, sequence_length, threads, dtype_name,
+                       stats["median_ms"], stats["p99_ms"], result["tokens_per_s"]))
+    finally:
+        torch.set_num_threads(num_threads)
+        model.to(torch.float32)
+    return results
+
+
+def profile_model(model, args):
+    # One profiled forward per sequence length at the largest batch size, separate from the timed runs
+    # Every length writes its own chrome trace, --trace with the length appended (profile_cuda.json -> profile_cuda_512.json)
+    device = next(model.parameters()).device
+    activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if device.type == "cuda" else [])
+    trace_root, trace_ext = os.path.splitext(args.trace)
+    for sequence_length in args.sequence_length:
+        inputs = {key: value.to(device) for key, value in make_inputs(model, max(args.batch_size), sequence_length).items()}
+        print ("Profilling %s performance, sequence length %d" % (device.type.upper(), sequence_length))
+        with torch.no_grad():
+            model(**inputs) # Warm up outside the profiler
+            with profile(activities=activities, record_shapes=True) as prof:
                 with record_function("model_inference"):
-                    bert_model(**inputs)
+                    model(**inputs)
+        print("===================Performance Profiling=====================")
+        prof.export_chrome_trace("%s_%d%s" % (trace_root, sequence_length, trace_ext or ".json"))
+        print(prof.key_averages().table(sort_by="cpu_time_total", row_limit=25)) # cuda time is included in cpu total time
 
-    else:
-        raise NotImplementedError()
 
-    print("===================Running ", args.model_name, "=====================")
-    if results is not None: print (results)
-    print("===================Performance Profiling=====================")
-    prof.export_chrome_trace("profile_cuda.json")
-    print(prof.key_averages().table(sort_by="cpu_time_total", row_limit=25)) # cuda time is included in cpu total time
+def save_results(results, path):
+    # Fixed columns and formatting, so that the files of two commits diff line by line
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow({key: "%.4f" % value if isinstance(value, float) else value for key, value in result.items()})
+
 
+def train(args):
+    if args.is_fp16:
+        args.dtype = ["float16"]
+    args.sequence_length = sorted(set(args.sequence_length))
+    print ("Machine:", machine_info())
+    model = build_model(args)
+    print (model)
+    print("===================Running ", args.model_name, "=====================")
+    results = benchmark(model, args)
+    if args.output:
+        save_results(results, args.output)
+    if args.serve:
+        # Mixed-length traffic up to the longest sequence length, batched up to the largest batch size
+        print("===================Serving", args.serve, "requests=====================")
+        model.to("cuda" if torch.cuda.is_available() and not args.cpu else "cpu")
+        lengths = skewed_lengths(args.serve, max(args.sequence_length))
+        for power_of_two in [True, False]:
+            serve(model, lengths, model.config.vocab_size, max(args.batch_size), power_of_two=power_of_two)
+    if args.profile:
+        profile_model(model, args)
 
 
 if __name__ == "__main__":
@@ -149,18 +185,21 @@ if __name__ == "__main__":
     parser.add_argument("--num_attention_layers", default=2, type=int, help="The number of attention layers")
     parser.add_argument("--attention_layout", default="Bottom", type=str, help="The position of attention layer, One of Bottom, Top, Middle")
     parser.add_argument("--model_version", default="large", type=str, help="The version of models, base or large")
-    parser.add_argument("--dataset_name", default="glue-sst2", type=str, help="The names follow the format: benchmark-subdataset")
-    # Training setting according to here: https://github.com/google-research/google-research/blob/master/f_net/configs/classification.py
-    parser.add_argument("--seed", default=666, type=int, help="Training random seed")
-    parser.add_argument("--learning_rate", default=5e-5, type=float, help="Training parameter, learning rate")
-    parser.add_argument("--per_device_eval_batch_size", default=200, type=int, help="Training parameter, evaluation batch")
-    parser.add_argument("--sequence_length", default=512, type=int, help="The sequence lengths", nargs="+")
-    # parser.add_argument("--batch_size", default=1, type=int, help="The batch sizes", nargs="+")
-    # parser.add_argument("--sequence_length", default=512, type=int, help="The sequence lengths")
-    parser.add_argument("--batch_size", default=1, type=int, help="The batch sizes")
-    parser.add_argument("--model_name", default="bfly_fnet", type=str, help="Support model name: bfly_fnet, fnet, bert")
-    parser.add_argument("--per_device_train_batch_size", default=16, type=int, help="Training parameter, train batch")
-    parser.add_argument("--num_train_epochs", default=4, type=int, help="Training parameter, number of training epoch")
-    parser.add_argument('--is_fp16', action='store_true')
+    parser.add_argument("--sequence_length", default=[512], type=int, help="The sequence lengths, repeated lengths are run once", nargs="+")
+    parser.add_argument("--batch_size", default=[1], type=int, help="The batch sizes", nargs="+")
+    parser.add_argument("--threads", default=[torch.get_num_threads()], type=int, help="The intra-op thread counts", nargs="+")
+    parser.add_argument("--dtype", default=["float32"], type=str, help="The data types: float32, bfloat16, float16", nargs="+")
+    parser.add_argument("--model_name", default="bfly_fnet", type=str, help="Support model name: bfly_fnet, bflylr_fnet, fnet, bert")
+    parser.add_argument("--warmup", default=3, type=int, help="Untimed forwards per point")
+    parser.add_argument("--runs", default=10, type=int, help="Timed forwards per point")
+    parser.add_argument("--output", default="", type=str, help="Write the latency distributions and tokens/s to this csv file")
+    parser.add_argument("--serve", default=0, type=int, help="Serve this many requests of skewed lengths through the length-bucketing batcher")
+    parser.add_argument("--profile", action="store_true", help="Profile one forward per sequence length after the timed runs")
+    parser.add_argument("--trace", default="profile_cuda.json", type=str, help="Chrome trace files of --profile, the sequence length is appended to the name")
+    parser.add_argument("--cpu", action="store_true", help="Run on CPU even if CUDA is available")
+    parser.add_argument('--is_fp16', action='store_true', help="Same as --dtype float16")
+    parser.add_argument("--fourier_mixing", default="fft", type=str, help="Fourier layers of fnet/bfly_fnet/bflylr_fnet: fft, rfft (real-input transform), dft (cached DFT matrices) or auto (fastest per length)")
+    parser.add_argument("--bfly_backend", default="torch", type=str, help="Butterfly kernel of bfly_fnet: torch or fused (CPU inference)")
+    parser.add_argument("--lr_ratio", default=0.1, type=float, help="Rank ratio of the low-rank part of bflylr_fnet")
     args = parser.parse_args()
     train(args)
@@ -1,13 +1,6 @@
 export CUDA_VISIBLE_DEVICES=-1
-python inference_speed.py --model_name bert --sequence_length 128 128 --batch_size 1 --model_version base 2>&1 | tee -a cpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 256 256 --batch_size 1 --model_version base 2>&1 | tee -a cpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 512 512 --batch_size 1 --model_version base 2>&1 | tee -a cpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 1024 1024 --batch_size 1 --model_version base 2>&1 | tee -a cpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 2048 2048 --batch_size 1 --model_version base 2>&1 | tee -a cpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 4096 4096 --batch_size 1 --model_version base 2>&1 | tee -a cpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 128 128 --batch_size 1 --model_version large 2>&1 | tee -a cpu_latency_breakdown_large.log
-python inference_speed.py --model_name bert --sequence_length 256 256 --batch_size 1 --model_version large 2>&1 | tee -a cpu_latency_breakdown_large.log
-python inference_speed.py --model_name bert --sequence_length 512 512 --batch_size 1 --model_version large 2>&1 | tee -a cpu_latency_breakdown_large.log
-python inference_speed.py --model_name bert --sequence_length 1024 1024 --batch_size 1 --model_version large 2>&1 | tee -a cpu_latency_breakdown_large.log
-python inference_speed.py --model_name bert --sequence_length 2048 2048 --batch_size 1 --model_version large 2>&1 | tee -a cpu_latency_breakdown_large.log
-python inference_speed.py --model_name bert --sequence_length 4096 4096 --batch_size 1 --model_version large 2>&1 | tee -a cpu_latency_breakdown_large.log
+python inference_speed.py --model_name bert --sequence_length 128 256 512 1024 2048 4096 --batch_size 1 --model_version base --output cpu_latency_base.csv
+python inference_speed.py --model_name bert --sequence_length 128 256 512 1024 2048 4096 --batch_size 1 --model_version large --output cpu_latency_large.csv
+# One chrome trace per length and version, e.g. cpu_trace_base_128.json
+python inference_speed.py --model_name bert --sequence_length 128 256 512 1024 2048 4096 --batch_size 1 --model_version base --runs 1 --profile --trace cpu_trace_base.json 2>&1 | tee -a cpu_latency_breakdown_base.log
+python inference_speed.py --model_name bert --sequence_length 128 256 512 1024 2048 4096 --batch_size 1 --model_version large --runs 1 --profile --trace cpu_trace_large.json 2>&1 | tee -a cpu_latency_breakdown_large.log
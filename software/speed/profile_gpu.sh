@@ -1,13 +1,4 @@
 export CUDA_VISIBLE_DEVICES=0
-python inference_speed.py --model_name bert --sequence_length 128 128 --batch_size 8 --model_version base 2>&1 | tee -a gpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 256 256 --batch_size 8 --model_version base 2>&1 | tee -a gpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 512 512 --batch_size 8 --model_version base 2>&1 | tee -a gpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 1024 1024 --batch_size 8 --model_version base 2>&1 | tee -a gpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 2048 2048 --batch_size 8 --model_version base 2>&1 | tee -a gpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 4096 4096 --batch_size 8 --model_version base 2>&1 | tee -a gpu_latency_breakdown_base.log
-python inference_speed.py --model_name bert --sequence_length 128 128 --batch_size 8 --model_version large 2>&1 | tee -a gpu_latency_breakdown_large.log
-python inference_speed.py --model_name bert --sequence_length 256 256 --batch_size 8 --model_version large 2>&1 | tee -a gpu_latency_breakdown_large.log
-python inference_speed.py --model_name bert --sequence_length 512 512 --batch_size 8 --model_version large 2>&1 | tee -a gpu_latency_breakdown_large.log
-python inference_speed.py --model_name bert --sequence_length 1024 1024 --batch_size 8 --model_version large 2>&1 | tee -a gpu_latency_breakdown_large.log
-python inference_speed.py --model_name bert --sequence_length 2048 2048 --batch_size 8 --model_version large 2>&1 | tee -a gpu_latency_breakdown_large.log
-python inference_speed.py --model_name bert --sequence_length 4096 4096 --batch_size 8 --model_version large 2>&1 | tee -a gpu_latency_breakdown_large.log
+# Every run sweeps the sequence lengths in one process and writes one chrome trace per length, e.g. gpu_trace_base_128.json
+python inference_speed.py --model_name bert --sequence_length 128 256 512 1024 2048 4096 --batch_size 8 --model_version base --profile --trace gpu_trace_base.json 2>&1 | tee -a gpu_latency_breakdown_base.log
+python inference_speed.py --model_name bert --sequence_length 128 256 512 1024 2048 4096 --batch_size 8 --model_version large --profile --trace gpu_trace_large.json 2>&1 | tee -a gpu_latency_breakdown_large.log
@@ -0,0 +1,133 @@
+import math
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import time
+
+from torch_butterfly import Butterfly
+
+
+def fused_stage_groups(log_n, max_fused_stages):
+    # Split the log_n stages of a block into the fewest passes of at most max_fused_stages stages, as even as possible
+    num_pass = int(math.ceil(log_n / max_fused_stages))
+    return [log_n // num_pass + (1 if i < log_n % num_pass else 0) for i in range(num_pass)]
+
+
+def butterfly_stage(twiddle, input, log_stride):
+    # One stage of torch_butterfly's butterfly_multiply_torch, twiddle is (nstacks, n // 2, 2, 2)
+    batch_size, nstacks, n = input.shape
+    stride = 1 << log_stride
+    t = twiddle.view(nstacks, n // (2 * stride), stride, 2, 2).permute(0, 1, 3, 4, 2)
+    output = (t * input.view(batch_size, nstacks, n // (2 * stride), 1, 2, stride)).sum(dim=4)
+    return output.view(batch_size, nstacks, n)
+
+
+def fuse_twiddle(twiddle, increasing_stride=True, max_fused_stages=6):
+    """
+    Fold consecutive butterfly stages into dense blocks.
+    Stages with log strides lo .. lo+k-1 only mix the elements that share the bits above and below them, so the k
+    stages together are one 2^k x 2^k matrix per (higher bits, lower bits) position. The matrices are read out by
+    running the stages on the 2^k basis vectors.
+    Returns a list of factors of shape (nstacks, n >> (lo+k), 1 << lo, 2^k out, 2^k in), in application order.
+    """
+    nstacks, nblocks, log_n = twiddle.shape[:3]
+    n = 1 << log_n
+    factors = []
+    cur_increasing_stride = increasing_stride
+    for block in range(nblocks):
+        idx = 0
+        for num_stage in fused_stage_groups(log_n, max_fused_stages):
+            log_strides = [i if cur_increasing_stride else log_n - 1 - i for i in range(idx, idx + num_stage)]
+            lo, size = min(log_strides), 1 << num_stage
+            num_high, num_low = n >> (lo + num_stage), 1 << lo
+            basis = torch.eye(size, dtype=twiddle.dtype, device=twiddle.device).view(size, 1, 1, size, 1)
+            output = basis.expand(size, nstacks, num_high, size, num_low).reshape(size, nstacks, n)
+            for i, log_stride in zip(range(idx, idx + num_stage), log_strides):
+                output = butterfly_stage(twiddle[:, block, i], output, log_stride)
+            # output[in, stack, high, out, low] -> factor[stack, high, low, out, in]
+            factors.append(output.view(size, nstacks, num_high, size, num_low).permute(1, 2, 4, 3, 0).contiguous())
+            idx += num_stage
+        cur_increasing_stride = not cur_increasing_stride
+    return factors
+
+
+def fused_butterfly_multiply(factors, input, n, out_size, bias=None):
+    # input is (rows, in_size), every factor is one pass over the rows, returns (rows, out_size)
+    rows, in_size = input.shape
+    nstacks = factors[0].shape[0]
+    output = F.pad(input, (0, n - in_size)) if in_size < n else input[:, :n]
+    output = output.unsqueeze(1).expand(rows, nstacks, n)
+    for factor in factors:
+        _, num_high, num_low, size, _ = factor.shape
+        output = torch.einsum("shloi,rshil->rshol", factor, output.reshape(rows, nstacks, num_high, size, num_low))
+    output = output.reshape(rows, nstacks * n)[:, :out_size]
+    return output + bias if bias is not None else output
+
+
+class Fused_Butterfly(Butterfly):
+    """
+    torch_butterfly.Butterfly with a CPU inference path: max_fused_stages stages are applied per pass over the data
+    (see fuse_twiddle) and the batch x seq rows go through all the passes in blocks of block_rows, so that a block stays
+    in cache between passes. Every pass is a batched matmul, multi-threaded by torch's intra-op thread pool.
+    Training, autograd, CUDA inputs and complex butterflies use the stage-by-stage path of Butterfly.
+    The parameters and state_dict keys are the ones of Butterfly, the fused factors are rebuilt when the twiddle changes.
+    """
+    def __init__(self, in_size, out_size, bias=True, max_fused_stages=6, block_rows=128, **kwargs):
+        super().__init__(in_size, out_size, bias=bias, **kwargs)
+        self.max_fused_stages = max_fused_stages
+        self.block_rows = block_rows
+        self._fused_factors = None
+        self._fused_key = None
+
+    def fused_factors(self):
+        key = (self.twiddle._version, self.twiddle.data_ptr(), self.twiddle.dtype, self.max_fused_stages)
+        if key != self._fused_key:
+            with torch.no_grad():
+                self._fused_factors = fuse_twiddle(self.twiddle, self.increasing_stride, self.max_fused_stages)
+            self._fused_key = key
+        return self._fused_factors
+
+    def use_fused(self, input):
+        return (not self.training and not input.is_cuda and not input.is_complex() and not getattr(self, "complex", False)
+                and not (torch.is_grad_enabled() and (input.requires_grad or self.twiddle.requires_grad)))
+
+    def forward(self, input, transpose=False, conjugate=False, subtwiddle=False):
+        if transpose or conjugate or subtwiddle or not self.use_fused(input):
+            return super().forward(input, transpose=transpose, conjugate=conjugate, subtwiddle=subtwiddle)
+        factors = self.fused_factors()
+        n = 1 << self.twiddle.shape[2]
+        rows = input.reshape(-1, input.size(-1))
+        output = torch.empty(rows.shape[0], self.out_size, dtype=rows.dtype, device=rows.device)
+        for i in range(0, rows.shape[0], self.block_rows):
+            output[i:i + self.block_rows] = fused_butterfly_multiply(factors, rows[i:i + self.block_rows], n, self.out_size, self.bias)
+        return output.view(*input.size()[:-1], self.out_size)
+
+
+def unit_test(num_seq=512, hid_dim=768, ffn_dim=3072, runs=10):
+    # Check the fused kernel against the stage-by-stage Butterfly and compare the speed with dense linear on CPU
+    print ("Number of CPU threads:", torch.get_num_threads())
+    for in_size, out_size, nblocks in [(768, 3072, 1), (3072, 768, 1), (1024, 4096, 2), (100, 30, 1)]:
+        bfly = Fused_Butterfly(in_size, out_size, nblocks=nblocks).eval()
+        input = torch.randn(3, 37, in_size)
+        with torch.no_grad():
+            expected = Butterfly.forward(bfly, input)
+            output = bfly(input)
+        assert torch.allclose(output, expected, rtol=1e-4, atol=1e-4), (in_size, out_size, (output - expected).abs().max())
+
+    input = torch.randn(num_seq, hid_dim)
+    layers = {"dense linear": [nn.Linear(hid_dim, ffn_dim), nn.Linear(ffn_dim, hid_dim)],
+              "butterfly": [Butterfly(hid_dim, ffn_dim), Butterfly(ffn_dim, hid_dim)],
+              "fused butterfly": [Fused_Butterfly(hid_dim, ffn_dim), Fused_Butterfly(ffn_dim, hid_dim)]}
+    with torch.no_grad():
+        for name, (linear1, linear2) in layers.items():
+            linear1.eval(), linear2.eval()
+            linear2(linear1(input)) # Warm up, also builds the fused factors
+            begin_time = time.time()
+            for i in range(runs):
+                output = linear2(linear1(input))
+            print ("Speed of %s FFN: %f ms" % (name, (time.time() - begin_time) / runs * 1000))
+
+
+if __name__ == "__main__":
+    unit_test()
+    unit_test(hid_dim=1024, ffn_dim=4096)
@@ -116,7 +116,35 @@ class ButterflyLRLinear(nn.Module):
         # output = (1.0 - g) * sparse_output + g * low_rank_output
         return torch.lerp(butterfly_output, low_rank_output, g)
 
+    def _fused_multiply(self, x):
+        """
+        Inference path of forward with a single (rows, out_features) buffer:
+        - the first low-rank projection and the gate share one GEMM over the input
+        - the butterfly output is scaled in place by (1 - g)
+        - the low-rank output is accumulated into it as (g * h) @ lr_weight2^T with addmm_, then the bias is added
+        The unfused path materializes the butterfly, low-rank, lerp and bias outputs separately.
+        """
+        rows = x.reshape(-1, self.in_features)
+        rank = self.low_rank.rank
+        if self.gate is not None:
+            weight = torch.cat([self.low_rank.lr_weight1, self.gate.weight])
+            bias = torch.cat([self.gate.bias.new_zeros(rank), self.gate.bias])
+            projection = F.linear(rows, weight, bias)
+            hidden, g = projection[:, :rank], torch.sigmoid(projection[:, rank:])
+        else:
+            hidden, g = F.linear(rows, self.low_rank.lr_weight1), torch.full((rows.shape[0], 1), 0.5, dtype=rows.dtype, device=rows.device)
+        output = self.butterfly(rows)
+        output.mul_(1.0 - g)
+        output.addmm_(hidden * g, self.low_rank.lr_weight2.t())
+        if self.low_rank.bias is not None:
+            output.addcmul_(g, self.low_rank.bias)
+        if self.bias is not None:
+            output.add_(self.bias)
+        return output.view(*x.shape[:-1], self.out_features)
+
     def forward(self, x):
+        if not self.training and not torch.is_grad_enabled():
+            return self._fused_multiply(x)
         if self.checkpointing:
             output = torch.utils.checkpoint.checkpoint(self._multiply, x)
         else:
@@ -124,6 +152,26 @@ class ButterflyLRLinear(nn.Module):
         return (output + self.bias) if self.bias is not None else output
 
 
+def fused_test(num_seq=512, hid_dim=768, ffn_dim=3072, lr_ratio=0.1, runs=10):
+    # Check the fused inference path of ButterflyLRLinear against the unfused one, on CPU
+    for in_features, out_features, gating in [(hid_dim, ffn_dim, True), (ffn_dim, hid_dim, True), (100, 30, False)]:
+        layer = ButterflyLRLinear(in_features, out_features, rank=lr_ratio, gating=gating).eval()
+        input = torch.randn(2, num_seq // 2, in_features)
+        expected = layer(input) # Autograd enabled, unfused path
+        with torch.no_grad():
+            output = layer(input)
+        assert torch.allclose(output, expected, rtol=1e-4, atol=1e-4), (in_features, out_features, (output - expected).abs().max())
+    layer = ButterflyLRLinear(hid_dim, ffn_dim, rank=lr_ratio).eval()
+    input = torch.randn(num_seq, hid_dim)
+    with torch.no_grad():
+        for name, multiply in [("unfused", lambda x: layer._multiply(x) + layer.bias), ("fused", layer._fused_multiply)]:
+            multiply(input)
+            begin_time = time.time()
+            for i in range(runs):
+                multiply(input)
+            print ("Speed of %s ButterflyLRLinear: %f ms" % (name, (time.time() - begin_time) / runs * 1000))
+
+
 def unit_test(num_seq=512, hid_dim=768, ffn_dim = 3072, lr_ratio=0.1):
     # The speed of standard FFN
     device = "cuda"
@@ -156,6 +204,7 @@ def unit_test(num_seq=512, hid_dim=768, ffn_dim = 3072, lr_ratio=0.1):
 
 
 if __name__ == "__main__":
+    fused_test()
     unit_test(lr_ratio=0.1)
     unit_test(lr_ratio=0.25)
     unit_test(lr_ratio=0.5)
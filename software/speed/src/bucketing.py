@@ -0,0 +1,213 @@
+import math
+import time
+import torch
+import torch.nn as nn
+
+
+def bucket_length(length, min_bucket=16, max_length=None):
+    # Smallest power of two not shorter than length (and not below min_bucket), capped at max_length
+    bucket = max(min_bucket, 1 << int(math.ceil(math.log2(max(length, 1)))))
+    return min(bucket, max_length) if max_length is not None else bucket
+
+
+def hf_forward(model, input_ids, lengths):
+    # Sequence classifiers of src.models (transformers convention), the Fourier mixing has no attention mask
+    return model(input_ids=input_ids, token_type_ids=torch.zeros_like(input_ids))[0]
+
+
+def lra_forward(model, input_ids, lengths):
+    # FNetClassifier / Bfly_FNetClassifier of the naive LRA models, the LengthMask of lengths keeps the padding out of the pooling
+    return model(input_ids, lengths=lengths)
+
+
+def model_forward(model):
+    return hf_forward if hasattr(model, "config") else lra_forward
+
+
+def model_limits(model):
+    # Pad token and longest request of a model, from its config or, for the naive LRA classifiers, its embeddings
+    if hasattr(model, "config"):
+        return model.config.pad_token_id, model.config.max_position_embeddings
+    if hasattr(model, "word_emb") and hasattr(model, "pos_encoder"):
+        # The CLS token takes one of the positions
+        max_len = model.pos_encoder.pe.shape[1 if model.batch_first else 0]
+        return model.word_emb.padding_idx, max_len - 1 if model.pooling_mode == "CLS" else max_len
+    raise NotImplementedError("Not supported model %s, pass pad_token_id and max_length" % type(model).__name__)
+
+
+class Length_Bucket_Batcher:
+    """
+    Serving-side batcher of FNet-style sequence models, the fnet, bfly_fnet and bflylr_fnet classifiers of src.models
+    (called as in hf_forward) and the FNetClassifier / Bfly_FNetClassifier of the naive LRA models (lra_forward).
+    A list of requests (1-D token id tensors of any length) is grouped by bucket_length, every bucket is padded with
+    pad_token_id to its power-of-two length and run in batches of at most max_batch_size, and the outputs are scattered
+    back in request order. Power-of-two lengths are the fast sizes of the FFT, bound the number of shapes seen by the
+    dft cache and the autotuner of src.fourier, and keep the padding of a request below half of its bucket.
+    With power_of_two=False the requests are grouped by their exact length, there is no padding at all.
+    The Fourier mixing has no attention mask, so as with the pad_sequence collate of the datamodules the output of a
+    padded request depends on its bucket length, not on the other requests of the batch. The naive LRA classifiers get
+    the request lengths, their pooling ignores the padding.
+    Padding and throughput are accumulated in stats, see padding_ratio and tokens_per_s.
+    """
+    def __init__(self, model, pad_token_id=None, max_batch_size=32, min_bucket=16, max_length=None, power_of_two=True, forward=None):
+        self.model = model
+        if pad_token_id is None or max_length is None:
+            model_pad_token_id, model_max_length = model_limits(model)
+            pad_token_id = model_pad_token_id if pad_token_id is None else pad_token_id
+            max_length = model_max_length if max_length is None else max_length
+        self.pad_token_id = pad_token_id
+        self.max_batch_size = max_batch_size
+        self.min_bucket = min_bucket
+        self.max_length = max_length
+        self.forward = model_forward(model) if forward is None else forward
+        self.power_of_two = power_of_two
+        self.reset_stats()
+
+    def reset_stats(self):
+        # padded_tokens counts the pad tokens run, baseline_padded_tokens the ones of padding every max_batch_size
+        # requests in arrival order to their longest, as the datamodules do
+        self.stats = {"requests": 0, "batches": 0, "tokens": 0, "padded_tokens": 0, "baseline_padded_tokens": 0, "seconds": 0.0}
+
+    def bucket(self, length):
+        if length > self.max_length:
+            raise ValueError("Request of %d tokens is longer than max_length %d" % (length, self.max_length))
+        if not self.power_of_two:
+            return length
+        return bucket_length(length, self.min_bucket, self.max_length)
+
+    def group(self, lengths):
+        # bucket length -> list of request indices, shortest bucket first
+        buckets = {}
+        for index, length in enumerate(lengths):
+            buckets.setdefault(self.bucket(length), []).append(index)
+        return dict(sorted(buckets.items()))
+
+    def run_batch(self, requests, seq_len):
+        input_ids = torch.full((len(requests), seq_len), self.pad_token_id, dtype=torch.long)
+        for i, request in enumerate(requests):
+            input_ids[i, :len(request)] = request
+        device = next(self.model.parameters()).device
+        lengths = torch.tensor([len(request) for request in requests], device=device)
+        return self.forward(self.model, input_ids.to(device), lengths)
+
+    def __call__(self, requests):
+        """
+        Outputs of the model for every request, in request order: the first output of the model (logits of the
+        sequence classifiers), cut to the request length when it is per token (e.g. the last hidden state).
+        """
+        lengths = [len(request) for request in requests]
+        outputs = [None] * len(requests)
+        begin_time = time.perf_counter()
+        with torch.no_grad():
+            for seq_len, indices in self.group(lengths).items():
+                for i in range(0, len(indices), self.max_batch_size):
+                    batch = indices[i:i + self.max_batch_size]
+                    batch_outputs = self.run_batch([requests[index] for index in batch], seq_len)
+                    for index, output in zip(batch, batch_outputs):
+                        outputs[index] = output[:lengths[index]] if output.dim() >= 2 and output.shape[0] == seq_len else output
+                    self.stats["batches"] += 1
+                    self.stats["padded_tokens"] += sum(seq_len - lengths[index] for index in batch)
+        self.stats["seconds"] += time.perf_counter() - begin_time
+        for i in range(0, len(lengths), self.max_batch_size):
+            batch = lengths[i:i + self.max_batch_size]
+            self.stats["baseline_padded_tokens"] += sum(max(batch) - length for length in batch)
+        self.stats["requests"] += len(requests)
+        self.stats["tokens"] += sum(lengths)
+        return outputs
+
+    @property
+    def padding_ratio(self):
+        # Fraction of the tokens run through the model that are padding
+        total = self.stats["tokens"] + self.stats["padded_tokens"]
+        return self.stats["padded_tokens"] / total if total else 0.0
+
+    @property
+    def baseline_padding_ratio(self):
+        total = self.stats["tokens"] + self.stats["baseline_padded_tokens"]
+        return self.stats["baseline_padded_tokens"] / total if total else 0.0
+
+    @property
+    def tokens_per_s(self):
+        # Effective throughput, request tokens only
+        return self.stats["tokens"] / self.stats["seconds"] if self.stats["seconds"] else 0.0
+
+
+def pad_to_longest(model, requests, pad_token_id, max_batch_size=32, forward=None):
+    # Reference serving of the datamodules' collate: arrival order, every batch padded to its longest request
+    forward = model_forward(model) if forward is None else forward
+    device = next(model.parameters()).device
+    outputs = []
+    with torch.no_grad():
+        for i in range(0, len(requests), max_batch_size):
+            xs = requests[i:i + max_batch_size]
+            input_ids = nn.utils.rnn.pad_sequence(xs, padding_value=pad_token_id, batch_first=True)
+            lengths = torch.tensor([len(x) for x in xs], device=device)
+            outputs.extend(forward(model, input_ids.to(device), lengths))
+    return outputs
+
+
+def skewed_lengths(num_requests, max_length, seed=0):
+    # Log-normal request lengths: most requests are short, a few are long
+    generator = torch.Generator().manual_seed(seed)
+    lengths = torch.exp(4.0 + 0.8 * torch.randn(num_requests, generator=generator)).long() + 1
+    return lengths.clamp(max=max_length).tolist()
+
+
+def serve(model, lengths, vocab_size, max_batch_size=32, seed=0, **kwargs):
+    """
+    Serve random requests of the given lengths through a Length_Bucket_Batcher (kwargs) and through pad_to_longest,
+    print and return the padding ratios and tokens/s of both.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    batcher = Length_Bucket_Batcher(model, max_batch_size=max_batch_size, **kwargs)
+    requests = [torch.randint(4, vocab_size, (length,), generator=generator) for length in lengths]
+    batcher(requests)
+    begin_time = time.perf_counter()
+    pad_to_longest(model, requests, batcher.pad_token_id, max_batch_size, batcher.forward)
+    baseline_tokens_per_s = sum(lengths) / (time.perf_counter() - begin_time)
+    print ("Pad to longest: padding ratio %.3f, %.1f tokens/s" % (batcher.baseline_padding_ratio, baseline_tokens_per_s))
+    print ("%s buckets: padding ratio %.3f, %.1f tokens/s, %d batches" % ("Power-of-two" if batcher.power_of_two else "Exact length",
+           batcher.padding_ratio, batcher.tokens_per_s, batcher.stats["batches"]))
+    return dict(padding_ratio=batcher.padding_ratio, tokens_per_s=batcher.tokens_per_s,
+                baseline_padding_ratio=batcher.baseline_padding_ratio, baseline_tokens_per_s=baseline_tokens_per_s)
+
+
+def unit_test(num_requests=256, max_batch_size=16):
+    # Bucketed outputs match running every request alone at its bucket length, and on a skewed length distribution
+    # the buckets pad less and serve faster than padding to the longest request
+    from src.configs.fnet_config import Vanilla_FNetConfig
+    from src.models.fnet_model import FNetForSequenceClassification
+    from src.models.fnet_model_naive import FNetClassifier
+    assert [bucket_length(length) for length in [1, 16, 17, 100, 128, 129]] == [16, 16, 32, 128, 128, 256]
+    assert bucket_length(600, max_length=512) == 512
+    torch.manual_seed(0)
+    config = Vanilla_FNetConfig(num_hidden_layers=2, hidden_size=256, intermediate_size=1024, num_attention_layers=0,
+                                num_labels=2, max_position_embeddings=1024, tpu_short_seq_length=1024)
+    model = FNetForSequenceClassification(config).eval()
+    lra_model = FNetClassifier(256, 4, 2, 1024, 2, config.vocab_size, config.pad_token_id, 1024, pooling_mode="MEAN").eval()
+    lengths = skewed_lengths(num_requests, 1024)
+    requests = [torch.randint(4, config.vocab_size, (length,)) for length in lengths]
+    for test_model in [model, lra_model]:
+        batcher = Length_Bucket_Batcher(test_model, max_batch_size=max_batch_size)
+        assert (batcher.pad_token_id, batcher.max_length) == (config.pad_token_id, 1024)
+        outputs = batcher(requests)
+        for index in [0, 1, lengths.index(max(lengths))]:
+            alone = batcher.run_batch([requests[index]], batcher.bucket(lengths[index]))[0]
+            assert torch.allclose(outputs[index], alone, rtol=1e-4, atol=1e-4), index
+        exact = Length_Bucket_Batcher(test_model, max_batch_size=max_batch_size, power_of_two=False)
+        exact(requests)
+        assert exact.padding_ratio == 0.0
+        assert batcher.padding_ratio < 0.5
+    # The naive classifiers get the request lengths, their mean pooling skips the padding
+    index = [bucket_length(length) != length for length in lengths].index(True)
+    input_ids = torch.full((1, bucket_length(lengths[index])), config.pad_token_id, dtype=torch.long)
+    input_ids[0, :lengths[index]] = requests[index]
+    with torch.no_grad():
+        assert torch.allclose(outputs[index], lra_model(input_ids, lengths=torch.tensor([lengths[index]]))[0], rtol=1e-4, atol=1e-4)
+        assert not torch.allclose(outputs[index], lra_model(input_ids)[0], rtol=1e-4, atol=1e-4)
+    serve(model, lengths, config.vocab_size, max_batch_size)
+    serve(model, lengths, config.vocab_size, max_batch_size, power_of_two=False)
+
+
+if __name__ == "__main__":
+    unit_test()
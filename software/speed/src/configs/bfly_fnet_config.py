@@ -56,6 +56,17 @@ class Bfly_FNetConfig(PretrainedConfig):
             The sequence length that is expected by the model when using TPUs. This will be used to initialize the DFT
             matrix only when *use_tpu_fourier_optimizations* is set to `True` and the input sequence is shorter
             than or equal to 4096 tokens.
+        fourier_mixing (`str`, *optional*, defaults to `"fft"`):
+            The Fourier transform used when *use_tpu_fourier_optimizations* is `False`. `"fft"` computes the full
+            complex 2D FFT, `"rfft"` only transforms the non-redundant half of the hidden dimension of the real input,
+            `"dft"` multiplies by DFT matrices cached per sequence length (GEMM-based mixing for short sequences),
+            `"auto"` times the three at model load and runs the fastest one for each sequence length.
+        fourier_autotune_lengths (`List[int]`, *optional*):
+            The sequence lengths timed by the `"auto"` mixing, defaults to `[128, 256, 512, 1024]`. Longer inputs use the
+            decision of the longest one.
+        fourier_autotune_path (`str`, *optional*):
+            The json file persisting the `"auto"` decision table, defaults to `~/.cache/bfly_fnet/fourier_autotune.json`.
+            An empty string tunes at every load without saving.
     Example:
     ```python
     >>> from transformers import FNetModel, FNetConfig
@@ -82,6 +93,9 @@ class Bfly_FNetConfig(PretrainedConfig):
         layer_norm_eps=1e-12,
         use_tpu_fourier_optimizations=False,
         tpu_short_seq_length=512,
+        fourier_mixing="fft",
+        fourier_autotune_lengths=None,
+        fourier_autotune_path=None,
         pad_token_id=0,
         bos_token_id=None,
         eos_token_id=None,
@@ -95,6 +109,11 @@ class Bfly_FNetConfig(PretrainedConfig):
         ###############################
         # Butterfly Low Rank config
         lr_ratio=0.1,
+        ###############################
+        # CPU inference kernel of the butterfly layers
+        bfly_backend="torch", # One of "torch" (torch_butterfly, stage by stage), "fused" (src/bfly_kernel.py)
+        bfly_fused_stages=6, # Butterfly stages fused per pass over the data
+        bfly_block_rows=128, # Rows (batch x seq) kept in cache across the fused passes
         **kwargs
     ):
         super().__init__(pad_token_id=pad_token_id, bos_token_id=bos_token_id, eos_token_id=eos_token_id, **kwargs)
@@ -111,9 +130,15 @@ class Bfly_FNetConfig(PretrainedConfig):
         self.layer_norm_eps = layer_norm_eps
         self.use_tpu_fourier_optimizations = use_tpu_fourier_optimizations
         self.tpu_short_seq_length = tpu_short_seq_length
+        self.fourier_mixing = fourier_mixing
+        self.fourier_autotune_lengths = fourier_autotune_lengths
+        self.fourier_autotune_path = fourier_autotune_path
         self.num_attention_layers = num_attention_layers
         self.attention_layout = attention_layout
         self.num_attention_heads = num_attention_heads
         self.attention_probs_dropout_prob =attention_probs_dropout_prob
         self.position_embedding_type = position_embedding_type
-        self.lr_ratio = lr_ratio
\ No newline at end of file
+        self.lr_ratio = lr_ratio
+        self.bfly_backend = bfly_backend
+        self.bfly_fused_stages = bfly_fused_stages
+        self.bfly_block_rows = bfly_block_rows
\ No newline at end of file
@@ -56,6 +56,17 @@ class Vanilla_FNetConfig(PretrainedConfig):
             The sequence length that is expected by the model when using TPUs. This will be used to initialize the DFT
             matrix only when *use_tpu_fourier_optimizations* is set to `True` and the input sequence is shorter
             than or equal to 4096 tokens.
+        fourier_mixing (`str`, *optional*, defaults to `"fft"`):
+            The Fourier transform used when *use_tpu_fourier_optimizations* is `False`. `"fft"` computes the full
+            complex 2D FFT, `"rfft"` only transforms the non-redundant half of the hidden dimension of the real input,
+            `"dft"` multiplies by DFT matrices cached per sequence length (GEMM-based mixing for short sequences),
+            `"auto"` times the three at model load and runs the fastest one for each sequence length.
+        fourier_autotune_lengths (`List[int]`, *optional*):
+            The sequence lengths timed by the `"auto"` mixing, defaults to `[128, 256, 512, 1024]`. Longer inputs use the
+            decision of the longest one.
+        fourier_autotune_path (`str`, *optional*):
+            The json file persisting the `"auto"` decision table, defaults to `~/.cache/bfly_fnet/fourier_autotune.json`.
+            An empty string tunes at every load without saving.
     Example:
     ```python
     >>> from transformers import FNetModel, FNetConfig
@@ -82,6 +93,9 @@ class Vanilla_FNetConfig(PretrainedConfig):
         layer_norm_eps=1e-12,
         use_tpu_fourier_optimizations=False,
         tpu_short_seq_length=512,
+        fourier_mixing="fft",
+        fourier_autotune_lengths=None,
+        fourier_autotune_path=None,
         pad_token_id=0,
         bos_token_id=None,
         eos_token_id=None,
@@ -110,6 +124,9 @@ class Vanilla_FNetConfig(PretrainedConfig):
         self.layer_norm_eps = layer_norm_eps
         self.use_tpu_fourier_optimizations = use_tpu_fourier_optimizations
         self.tpu_short_seq_length = tpu_short_seq_length
+        self.fourier_mixing = fourier_mixing
+        self.fourier_autotune_lengths = fourier_autotune_lengths
+        self.fourier_autotune_path = fourier_autotune_path
         self.num_attention_layers = num_attention_layers
         self.attention_layout = attention_layout
         self.num_attention_heads = num_attention_heads
@@ -0,0 +1,283 @@
+import json
+import logging
+import math
+import os
+import platform
+import threading
+import torch
+import time
+from collections import OrderedDict
+from functools import partial
+
+
+logger = logging.getLogger(__name__)
+
+FOURIER_MIXINGS = ["fft", "rfft", "dft"] # Fixed implementations, "auto" picks one of them per sequence length
+AUTOTUNE_LENGTHS = [128, 256, 512, 1024]
+AUTOTUNE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "bfly_fnet", "fourier_autotune.json")
+
+
+def mirror_hermitian(outputs, hidden):
+    # Fill bins hidden // 2 + 1 .. hidden - 1 of outputs from bins (hidden - 1) // 2 .. 1, with the sequence index negated
+    outputs[:, :, hidden // 2 + 1:] = torch.flip(outputs[:, :, 1:(hidden + 1) // 2], dims=(1, 2)).roll(1, dims=1)
+    return outputs
+
+
+def real_fftn(x):
+    """
+    Real part of torch.fft.fftn(x, dim=(1, 2)) for a real x of shape (batch, seq, hidden).
+    Only the hidden // 2 + 1 non-redundant bins are transformed (rfft along hidden, then fft along seq), which halves
+    the FLOPs and the complex intermediate. The other bins follow from the Hermitian symmetry of a real input,
+    Y[n, k] = conj(Y[-n, -k]), so Re Y[n, k] = Re Y[-n, hidden - k].
+    """
+    hidden = x.shape[2]
+    num_bin = hidden // 2 + 1
+    outputs = torch.empty_like(x)
+    outputs[:, :, :num_bin] = torch.fft.fft(torch.fft.rfft(x, dim=2), dim=1).real
+    return mirror_hermitian(outputs, hidden)
+
+
+def dft_cos_sin(length, num_bin=None):
+    # cos and sin of the DFT matrix exp(-2*pi*i*j*k/length), first num_bin columns, exact j*k mod length in float64
+    num_bin = length if num_bin is None else num_bin
+    index = torch.arange(length, dtype=torch.float64)
+    angle = (2 * math.pi / length) * torch.remainder(index[:, None] * index[None, :num_bin], length)
+    return torch.cos(angle), torch.sin(angle)
+
+
+class DFT_Cache:
+    """
+    LRU cache of the DFT matrices of the dft mixing, keyed by (seq_len, hidden, dtype, device).
+    The real and imaginary parts are stored side by side as real matrices, so the mixing is two real GEMMs instead of
+    a complex einsum on an upcast input:
+        Re(F_seq X F_hidden) = C_seq (X C_hidden) - S_seq (X S_hidden)
+    Only the hidden // 2 + 1 non-redundant hidden bins are computed, the others are mirrored as in real_fftn.
+    A 512-token entry at hidden 768 takes 4 MB in float32, max_entries bounds the memory of serving many lengths.
+    """
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, seq_len, hidden, dtype, device):
+        # Returns (hidden_mat [C_hidden | S_hidden] of hidden x 2*num_bin, seq_mat [C_seq | -S_seq] of seq_len x 2*seq_len)
+        key = (seq_len, hidden, dtype, torch.device(device))
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+        cos_hidden, sin_hidden = dft_cos_sin(hidden, hidden // 2 + 1)
+        cos_seq, sin_seq = dft_cos_sin(seq_len)
+        entry = (torch.cat([cos_hidden, sin_hidden], dim=1).to(dtype=dtype, device=device),
+                 torch.cat([cos_seq, -sin_seq], dim=1).to(dtype=dtype, device=device))
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+DFT_CACHE = DFT_Cache()
+
+
+def dft_mixing(x, cache=DFT_CACHE):
+    """
+    Real part of torch.fft.fftn(x, dim=(1, 2)) for a real x of shape (batch, seq, hidden), as GEMMs with the cached
+    DFT matrices, see DFT_Cache. Whether the GEMMs beat the FFT depends on the device and the sizes, time them or use
+    the "auto" mixing.
+    """
+    batch, seq_len, hidden = x.shape
+    num_bin = hidden // 2 + 1
+    hidden_mat, seq_mat = cache.get(seq_len, hidden, x.dtype, x.device)
+    mixed = torch.matmul(x, hidden_mat) # [X C_hidden | X S_hidden]
+    # Stack the two halves along the sequence, then [C_seq | -S_seq] contracts both at once
+    mixed = mixed.view(batch, seq_len, 2, num_bin).transpose(1, 2).reshape(batch, 2 * seq_len, num_bin)
+    outputs = torch.empty_like(x)
+    outputs[:, :, :num_bin] = torch.matmul(seq_mat, mixed)
+    return mirror_hermitian(outputs, hidden)
+
+
+class Mixing_Autotuner:
+    """
+    Times every mixing of FOURIER_MIXINGS on (batch_size, seq_len, hidden) inputs for each of the lengths, and
+    dispatches every call to the fastest one for its length (the smallest tuned length not shorter than the input, the
+    longest tuned length beyond them).
+    A decision table is made per setting (device, dtype, thread count): device and dtype are tuned at construction,
+    a call on another device or dtype, or under another torch.set_num_threads, tunes (or loads) the table of its own
+    setting first, so moving or casting the model keeps dispatching to the fastest mixing.
+    The tables are persisted to path as json, under a key of the hidden size, dtype, device, thread count, torch
+    version and processor, so that another machine or setting tunes again.
+    """
+    def __init__(self, hidden, lengths=AUTOTUNE_LENGTHS, path=AUTOTUNE_PATH, device="cpu", dtype=torch.float32,
+                 batch_size=1, runs=5):
+        self.hidden = hidden
+        self.lengths = sorted(lengths)
+        self.path = path
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.batch_size = batch_size
+        self.runs = runs
+        self.dispatch = {} # (device, dtype, threads) -> {tuned length: mixing}
+        self.lock = threading.Lock()
+        self.table = self.load_or_tune(self.device, self.dtype, torch.get_num_threads())
+
+    def key(self, device, dtype, threads):
+        return "hidden=%d dtype=%s device=%s threads=%d torch=%s cpu=%s" % (
+            self.hidden, str(dtype).replace("torch.", ""), device.type, threads,
+            torch.__version__, platform.processor() or platform.machine())
+
+    def time_mixing(self, mixing, seq_len, device, dtype):
+        transform = fourier_mixing(mixing)
+        # Own generator, tuning at model load should not shift the seed of the weight initialization
+        generator = torch.Generator(device=device).manual_seed(0)
+        x = torch.randn(self.batch_size, seq_len, self.hidden, device=device, generator=generator).to(dtype)
+        times = []
+        with torch.no_grad():
+            try:
+                transform(x).real # Warm up, also fills the dft cache
+            except RuntimeError: # e.g. torch.fft has no bfloat16 kernels
+                return float("inf")
+            for i in range(self.runs):
+                if device.type == "cuda": torch.cuda.synchronize()
+                begin_time = time.perf_counter()
+                transform(x).real
+                if device.type == "cuda": torch.cuda.synchronize()
+                times.append(time.perf_counter() - begin_time)
+        return sorted(times)[len(times) // 2] * 1000 # Median in ms
+
+    def tune(self, device, dtype, threads):
+        table = {}
+        for seq_len in self.lengths:
+            timings = {mixing: self.time_mixing(mixing, seq_len, device, dtype) for mixing in FOURIER_MIXINGS}
+            table[str(seq_len)] = {"mixing": min(timings, key=timings.get), "ms": timings}
+        logger.info("Fourier mixing autotune for %s: %s" % (self.key(device, dtype, threads), {seq_len: entry["mixing"] for seq_len, entry in table.items()}))
+        return table
+
+    def load_or_tune(self, device, dtype, threads):
+        # Decision table of a setting, from path or timed now, installed in dispatch
+        key = self.key(device, dtype, threads)
+        table = self.load(key)
+        if table is None:
+            table = self.tune(device, dtype, threads)
+            self.save(key, table)
+        self.dispatch[(device, dtype, threads)] = {int(seq_len): fourier_mixing(entry["mixing"]) for seq_len, entry in table.items()}
+        return table
+
+    def load(self, key):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            table = json.load(f).get(key)
+        if table is None or sorted(int(seq_len) for seq_len in table) != self.lengths:
+            return None
+        return table
+
+    def save(self, key, table):
+        if not self.path:
+            return
+        tables = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                tables = json.load(f)
+        tables[key] = table
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Write then rename, so that concurrent model loads never read a partial file
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(tables, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def select(self, seq_len, device=None, dtype=None):
+        setting = (self.device if device is None else torch.device(device), self.dtype if dtype is None else dtype, torch.get_num_threads())
+        mixings = self.dispatch.get(setting)
+        if mixings is None:
+            with self.lock:
+                if setting not in self.dispatch:
+                    self.load_or_tune(*setting)
+            mixings = self.dispatch[setting]
+        for tuned_len in sorted(mixings):
+            if seq_len <= tuned_len:
+                return mixings[tuned_len]
+        return mixings[max(mixings)]
+
+    def __call__(self, x):
+        return self.select(x.shape[1], x.device, x.dtype)(x)
+
+
+AUTOTUNERS = {}
+
+
+def fourier_mixing(mixing, hidden=None, autotune_lengths=None, autotune_path=None):
+    # Token mixing of the FNet layers, the models take the .real of its output
+    # "auto" needs the hidden size, its autotuner is shared by all the layers and models of the process
+    # autotune_lengths/autotune_path default to AUTOTUNE_LENGTHS/AUTOTUNE_PATH, an empty path does not persist the table
+    if mixing == "fft":
+        return partial(torch.fft.fftn, dim=(1, 2))
+    elif mixing == "rfft":
+        return real_fftn
+    elif mixing == "dft":
+        return dft_mixing
+    elif mixing == "auto":
+        autotune_lengths = AUTOTUNE_LENGTHS if autotune_lengths is None else autotune_lengths
+        autotune_path = AUTOTUNE_PATH if autotune_path is None else autotune_path
+        key = (hidden, tuple(autotune_lengths), autotune_path)
+        if key not in AUTOTUNERS:
+            AUTOTUNERS[key] = Mixing_Autotuner(hidden, autotune_lengths, autotune_path)
+        return AUTOTUNERS[key]
+    raise NotImplementedError("Not supported fourier mixing %s" % mixing)
+
+
+def unit_test(runs=20):
+    # Check the rfft and dft paths against the full complex transform, including odd sizes, and compare the speed
+    for batch, seq, hidden in [(2, 512, 768), (1, 128, 1024), (3, 7, 5), (1, 1, 2), (2, 33, 64)]:
+        x = torch.randn(batch, seq, hidden)
+        expected = torch.fft.fftn(x, dim=(1, 2)).real
+        assert torch.allclose(real_fftn(x), expected, rtol=1e-4, atol=1e-3), (batch, seq, hidden)
+        assert torch.allclose(dft_mixing(x), expected, rtol=1e-4, atol=1e-2), (batch, seq, hidden)
+    # Least recently used entries are evicted first
+    cache = DFT_Cache(max_entries=2)
+    for seq_len in [128, 256, 128, 512]:
+        cache.get(seq_len, 64, torch.float32, "cpu")
+    assert [key[0] for key in cache.entries] == [128, 512] and (cache.hits, cache.misses) == (1, 3)
+    for batch, seq in [(1, 128), (1, 512), (8, 512)]:
+        x = torch.randn(batch, seq, 768)
+        for mixing in FOURIER_MIXINGS:
+            transform = fourier_mixing(mixing)
+            transform(x).real # Warm up, also fills the dft cache
+            begin_time = time.time()
+            for i in range(runs):
+                transform(x).real
+            print ("Speed of %s mixing (%d x %d x 768): %f ms" % (mixing, batch, seq, (time.time() - begin_time) / runs * 1000))
+    # The autotuner persists its table and a second one reloads it instead of timing again
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "autotune.json")
+        autotuner = Mixing_Autotuner(64, [16, 100], path, runs=2)
+        reloaded = Mixing_Autotuner(64, [16, 100], path, runs=2)
+        assert reloaded.table == autotuner.table
+        x = torch.randn(2, 50, 64)
+        assert torch.allclose(reloaded(x).real, torch.fft.fftn(x, dim=(1, 2)).real, rtol=1e-4, atol=1e-3)
+        # Another thread count or dtype dispatches from a table of its own, tuned once
+        num_threads = torch.get_num_threads()
+        try:
+            torch.set_num_threads(num_threads + 1)
+            reloaded(x)
+            reloaded(x.double())
+            reloaded(x.double())
+        finally:
+            torch.set_num_threads(num_threads)
+        assert sorted(threads for device, dtype, threads in reloaded.dispatch) == [num_threads, num_threads + 1, num_threads + 1]
+        with open(path) as f:
+            assert len(json.load(f)) == 3
+        print ("Autotuned mixing:", {seq_len: entry["mixing"] for seq_len, entry in autotuner.table.items()})
+
+if __name__ == "__main__":
+    unit_test()
@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import time
+import torch
+import torch.nn as nn
+
+from torch_butterfly import Butterfly
+
+MATERIALIZE_FILE = "materialize.json" # Decisions saved next to the checkpoint files
+
+
+def butterfly_layers(model):
+    # (name, module) of every butterfly layer, including the butterfly of ButterflyLRLinear and Fused_Butterfly
+    return [(name, module) for name, module in model.named_modules() if isinstance(module, Butterfly)]
+
+
+def materialize(bfly):
+    """
+    Dense nn.Linear computing the same map as a butterfly layer: the product of its twiddles, read out by running the
+    layer on the identity. Works for any torch_butterfly configuration (nstacks, nblocks, increasing_stride).
+    """
+    weight = bfly.twiddle
+    with torch.no_grad():
+        identity = torch.eye(bfly.in_size, dtype=weight.dtype, device=weight.device)
+        outputs = Butterfly.forward(bfly, identity) # in_size x out_size, row i is the image of basis vector i
+        bias = bfly.bias
+        if bias is not None:
+            outputs = outputs - bias
+        linear = nn.Linear(bfly.in_size, bfly.out_size, bias=bias is not None, dtype=weight.dtype, device=weight.device)
+        linear.weight.copy_(outputs.t())
+        if bias is not None:
+            linear.bias.copy_(bias)
+    return linear.train(bfly.training)
+
+
+def time_layer(layer, input, runs=10):
+    # Median latency in ms of layer(input) in inference
+    times = []
+    with torch.no_grad():
+        layer(input) # Warm up, also builds the factors of Fused_Butterfly
+        for i in range(runs):
+            begin_time = time.perf_counter()
+            layer(input)
+            times.append(time.perf_counter() - begin_time)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def replace_layer(model, name, layer):
+    parent_name, _, child_name = name.rpartition(".")
+    setattr(model.get_submodule(parent_name) if parent_name else model, child_name, layer)
+
+
+def materialize_model(model, num_rows=512, runs=10, checkpoint_dir=None):
+    """
+    Benchmark every butterfly layer of the model (e.g. Bfly_FNetModel or a BflyLR_FNet model) against its materialized
+    dense matrix on num_rows (batch x seq) rows, and swap in the dense layer where it is faster.
+    Layers of the same type and shape share one measurement. The decisions are returned and, with checkpoint_dir,
+    saved to MATERIALIZE_FILE next to the checkpoint so that load_materialized can apply them without benchmarking.
+    """
+    model.eval()
+    decisions, timings = {}, {}
+    for name, bfly in butterfly_layers(model):
+        dense = materialize(bfly)
+        shape = (type(bfly).__name__, bfly.in_size, bfly.out_size, tuple(bfly.twiddle.shape))
+        if shape not in timings:
+            input = torch.randn(num_rows, bfly.in_size, dtype=bfly.twiddle.dtype, device=bfly.twiddle.device)
+            timings[shape] = {"butterfly_ms": time_layer(bfly, input, runs), "dense_ms": time_layer(dense, input, runs)}
+        choice = "dense" if timings[shape]["dense_ms"] < timings[shape]["butterfly_ms"] else "butterfly"
+        decisions[name] = dict(timings[shape], choice=choice, in_size=bfly.in_size, out_size=bfly.out_size)
+        if choice == "dense":
+            replace_layer(model, name, dense)
+    if checkpoint_dir is not None:
+        save_decisions(decisions, checkpoint_dir)
+    return decisions
+
+
+def save_decisions(decisions, checkpoint_dir):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(os.path.join(checkpoint_dir, MATERIALIZE_FILE), "w") as f:
+        json.dump({"num_threads": torch.get_num_threads(), "layers": decisions}, f, indent=2)
+
+
+def load_materialized(model, checkpoint_dir):
+    """
+    Apply the decisions saved by materialize_model to a model loaded from the (butterfly) checkpoint.
+    Returns the number of layers swapped to dense, a checkpoint without MATERIALIZE_FILE is left as is.
+    """
+    path = os.path.join(checkpoint_dir, MATERIALIZE_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        decisions = json.load(f)["layers"]
+    layers = dict(butterfly_layers(model))
+    num_dense = 0
+    for name, decision in decisions.items():
+        if decision["choice"] != "dense":
+            continue
+        if name not in layers:
+            raise ValueError("Layer %s of %s is not a butterfly layer of the model" % (name, path))
+        replace_layer(model, name, materialize(layers[name]))
+        num_dense += 1
+    return num_dense
+
+
+def main(args):
+    # Convert a saved Bfly_FNet/BflyLR_FNet sequence classifier and save the decisions next to its checkpoint
+    if args.model_name == "bfly_fnet":
+        from src.models.bfly_fnet_model import Bfly_FNetForSequenceClassification as model_class
+    elif args.model_name == "bflylr_fnet":
+        from src.models.bflylr_fnet_model import BflyLR_FNetForSequenceClassification as model_class
+    else:
+        raise NotImplementedError("Not supported model %s" % args.model_name)
+    model = model_class.from_pretrained(args.checkpoint)
+    decisions = materialize_model(model, num_rows=args.num_rows, runs=args.runs, checkpoint_dir=args.checkpoint)
+    for name, decision in decisions.items():
+        print ("%s (%d -> %d): butterfly %.3f ms, dense %.3f ms -> %s" % (name, decision["in_size"], decision["out_size"],
+               decision["butterfly_ms"], decision["dense_ms"], decision["choice"]))
+
+
+def unit_test():
+    # The materialized layer matches the butterfly, and the decisions reload onto a fresh copy of the model
+    import copy
+    import tempfile
+    for in_size, out_size, kwargs in [(64, 256, {}), (256, 64, {}), (100, 30, {}), (128, 128, {"nblocks": 2}), (64, 64, {"bias": False})]:
+        bfly = Butterfly(in_size, out_size, **kwargs).eval()
+        input = torch.randn(7, 5, in_size)
+        with torch.no_grad():
+            assert torch.allclose(materialize(bfly)(input), bfly(input), rtol=1e-4, atol=1e-4), (in_size, out_size, kwargs)
+    model = nn.Sequential(Butterfly(64, 256), nn.GELU(), Butterfly(256, 64), nn.Sequential(Butterfly(64, 64)))
+    fresh = copy.deepcopy(model)
+    input = torch.randn(512, 64)
+    with torch.no_grad():
+        expected = model(input)
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        decisions = materialize_model(model, checkpoint_dir=checkpoint_dir)
+        num_dense = load_materialized(fresh, checkpoint_dir)
+    assert num_dense == sum(decision["choice"] == "dense" for decision in decisions.values())
+    with torch.no_grad():
+        assert torch.allclose(model(input), expected, rtol=1e-4, atol=1e-4)
+        assert torch.allclose(fresh(input), expected, rtol=1e-4, atol=1e-4)
+    for name, decision in decisions.items():
+        print ("%s (%d -> %d): butterfly %.3f ms, dense %.3f ms -> %s" % (name, decision["in_size"], decision["out_size"],
+               decision["butterfly_ms"], decision["dense_ms"], decision["choice"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoint", default="", type=str, help="Directory of a saved model, the decisions are written there")
+    parser.add_argument("--model_name", default="bfly_fnet", type=str, help="Support model name: bfly_fnet, bflylr_fnet")
+    parser.add_argument("--num_rows", default=512, type=int, help="Rows (batch x seq) of the benchmark input")
+    parser.add_argument("--runs", default=10, type=int, help="Timed runs per layer")
+    args = parser.parse_args()
+    if args.checkpoint:
+        main(args)
+    else:
+        unit_test()
@@ -0,0 +1,147 @@
+import argparse
+import itertools
+import json
+import torch
+import torch.nn as nn
+
+from torch_butterfly import Butterfly
+from src.bflylr import LowRank, ButterflyLRLinear
+from src.bfly_kernel import Fused_Butterfly
+from src.timing import time_runs, latency_stats, machine_info
+
+LAYERS = ["linear", "butterfly", "fused_butterfly", "low_rank", "bflylr"]
+DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+
+
+def make_layer(name, in_features, out_features, lr_ratio=0.1):
+    if name == "linear":
+        return nn.Linear(in_features, out_features)
+    elif name == "butterfly":
+        return Butterfly(in_features, out_features)
+    elif name == "fused_butterfly":
+        return Fused_Butterfly(in_features, out_features)
+    elif name == "low_rank":
+        return LowRank(in_features, out_features, rank=lr_ratio)
+    elif name == "bflylr":
+        return ButterflyLRLinear(in_features, out_features, rank=lr_ratio)
+    raise NotImplementedError("Not supported layer %s" % name)
+
+
+def butterfly_flops(bfly):
+    # Every stage is n / 2 2x2 blocks, 4 multiply-adds each
+    nstacks, nblocks, log_n = bfly.twiddle.shape[:3]
+    return nstacks * nblocks * log_n * (1 << log_n) * 4
+
+
+def layer_flops(layer):
+    # FLOPs per row (one token) of the inference forward, a multiply-add counts as 2
+    if isinstance(layer, nn.Linear):
+        return 2 * layer.in_features * layer.out_features
+    elif isinstance(layer, Butterfly):
+        return butterfly_flops(layer)
+    elif isinstance(layer, LowRank):
+        return 2 * layer.rank * (layer.in_features + layer.out_features)
+    elif isinstance(layer, ButterflyLRLinear):
+        gate = 2 * layer.in_features if layer.gate is not None else 0
+        return butterfly_flops(layer.butterfly) + layer_flops(layer.low_rank) + gate + 3 * layer.out_features
+    raise NotImplementedError("Not supported layer %s" % type(layer).__name__)
+
+
+def run_benchmark(shapes, seq_lens, batch_sizes, threads, dtypes, layers=LAYERS, lr_ratio=0.1, warmup=5, runs=50):
+    """
+    Time every layer in both FFN directions (hidden -> ffn and ffn -> hidden) of every (hidden, ffn) shape, over the
+    cartesian product of sequence lengths, batch sizes, intra-op thread counts and dtypes, in inference on CPU.
+    Returns one row per point, with the latency statistics of latency_stats, the FLOP-normalized throughput of the
+    layer's own FLOPs (gflops) and of the dense layer of the same shape (dense_gflops, comparable across layers).
+    """
+    num_threads = torch.get_num_threads()
+    results = []
+    try:
+        for (hidden, ffn), (name, dtype_name) in itertools.product(shapes, itertools.product(layers, dtypes)):
+            for in_features, out_features in [(hidden, ffn), (ffn, hidden)]:
+                torch.manual_seed(0)
+                layer = make_layer(name, in_features, out_features, lr_ratio).to(DTYPES[dtype_name]).eval()
+                flops = layer_flops(layer)
+                for seq_len, batch_size, thread in itertools.product(seq_lens, batch_sizes, threads):
+                    torch.set_num_threads(thread)
+                    input = torch.randn(batch_size, seq_len, in_features).to(DTYPES[dtype_name])
+                    stats = latency_stats(time_runs(lambda: layer(input), warmup, runs, input.is_cuda))
+                    rows = batch_size * seq_len
+                    results.append(dict(layer=name, in_features=in_features, out_features=out_features, seq_len=seq_len,
+                                        batch_size=batch_size, threads=thread, dtype=dtype_name,
+                                        gflops=rows * flops / stats["median_ms"] / 1e6,
+                                        dense_gflops=rows * 2 * in_features * out_features / stats["median_ms"] / 1e6, **stats))
+                    print ("%-15s %5d -> %5d  batch %3d x seq %5d  threads %2d  %-8s  median %9.3f ms  p99 %9.3f ms  %7.2f GFLOP/s" % (
+                           name, in_features, out_features, batch_size, seq_len, thread, dtype_name,
+                           stats["median_ms"], stats["p99_ms"], results[-1]["gflops"]))
+    finally:
+        torch.set_num_threads(num_threads)
+    return results
+
+
+def result_key(result):
+    return tuple(result[key] for key in ["layer", "in_features", "out_features", "seq_len", "batch_size", "threads", "dtype"])
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Points of results whose median is slower than the baseline's by more than tolerance and outside the baseline's
+    confidence interval, as (key, baseline median, new median). Points missing from the baseline are ignored.
+    """
+    baseline = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old is None:
+            continue
+        if result["median_ms"] > old["median_ms"] * (1 + tolerance) and result["ci95_low_ms"] > old["ci95_high_ms"]:
+            regressions.append((result_key(result), old["median_ms"], result["median_ms"]))
+    return regressions
+
+
+def main(args):
+    shapes = [tuple(int(size) for size in shape.split("x")) for shape in args.shapes]
+    results = run_benchmark(shapes, args.seq_len, args.batch_size, args.threads, args.dtype, layers=args.layers,
+                            lr_ratio=args.lr_ratio, warmup=args.warmup, runs=args.runs)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"machine": machine_info(), "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for key, old, new in regressions:
+            print ("Regression %s: %.3f ms -> %.3f ms" % (key, old, new))
+        print ("%d regressions against %s" % (len(regressions), args.baseline))
+
+
+def unit_test():
+    # FLOP counts of known shapes and a tiny sweep through compare
+    assert layer_flops(nn.Linear(4, 8)) == 64
+    assert layer_flops(Butterfly(8, 8)) == 3 * 8 * 4
+    assert layer_flops(Butterfly(8, 32)) == 4 * 3 * 8 * 4
+    results = run_benchmark([(64, 256)], [16], [2], [1], ["float32"], warmup=1, runs=5)
+    assert len(results) == 2 * len(LAYERS) and compare(results, results) == []
+    slower = [dict(result, median_ms=result["median_ms"] * 2, ci95_low_ms=result["ci95_high_ms"] * 2) for result in results]
+    assert len(compare(slower, results)) == len(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shapes", default=["768x3072", "1024x4096"], type=str, nargs="+", help="FFN shapes as hiddenxffn")
+    parser.add_argument("--seq_len", default=[128, 512], type=int, nargs="+", help="Sequence lengths")
+    parser.add_argument("--batch_size", default=[1, 8], type=int, nargs="+", help="Batch sizes")
+    parser.add_argument("--threads", default=[torch.get_num_threads()], type=int, nargs="+", help="Intra-op thread counts")
+    parser.add_argument("--dtype", default=["float32"], type=str, nargs="+", help="Data types: float32, bfloat16, float16")
+    parser.add_argument("--layers", default=LAYERS, type=str, nargs="+", help="Layers: %s" % ", ".join(LAYERS))
+    parser.add_argument("--lr_ratio", default=0.1, type=float, help="Rank ratio of low_rank and bflylr")
+    parser.add_argument("--warmup", default=5, type=int, help="Untimed runs per point")
+    parser.add_argument("--runs", default=50, type=int, help="Timed runs per point")
+    parser.add_argument("--output", default="", type=str, help="Save the results as json")
+    parser.add_argument("--baseline", default="", type=str, help="Json of an earlier run, report the points that regressed")
+    parser.add_argument("--tolerance", default=0.1, type=float, help="Relative slowdown of the median counted as a regression")
+    parser.add_argument("--unit_test", action="store_true")
+    args = parser.parse_args()
+    if args.unit_test:
+        unit_test()
+    else:
+        main(args)
@@ -25,6 +25,8 @@ from transformers.models.bert.modeling_bert import BertAttention
 
 from torch_butterfly import Butterfly
 from src.bflylr import ButterflyLRLinear
+from src.bfly_kernel import Fused_Butterfly
+from src.fourier import fourier_mixing
 
 if is_scipy_available():
     from scipy import linalg
@@ -55,6 +57,15 @@ Sparse_Linear = Butterfly
 
 logger = logging.get_logger(__name__)
 
+
+def sparse_linear(config, in_features, out_features):
+    # Butterfly layer of the model, config.bfly_backend selects the stage-by-stage ("torch") or fused CPU ("fused") kernel
+    if config.bfly_backend == "torch":
+        return Sparse_Linear(in_features, out_features)
+    elif config.bfly_backend == "fused":
+        return Fused_Butterfly(in_features, out_features, max_fused_stages=config.bfly_fused_stages, block_rows=config.bfly_block_rows)
+    raise NotImplementedError("Not supported butterfly backend %s" % config.bfly_backend)
+
 _CHECKPOINT_FOR_DOC = "google/fnet-base"
 _CONFIG_FOR_DOC = "Bfly_FNetConfig"
 _TOKENIZER_FOR_DOC = "FNetTokenizer"
@@ -110,9 +121,9 @@ class Bfly_BertSelfAttention(nn.Module):
         self.attention_head_size = int(config.hidden_size / config.num_attention_heads)
         self.all_head_size = self.num_attention_heads * self.attention_head_size
 
-        self.query = Sparse_Linear(config.hidden_size, self.all_head_size)
-        self.key = Sparse_Linear(config.hidden_size, self.all_head_size)
-        self.value = Sparse_Linear(config.hidden_size, self.all_head_size)
+        self.query = sparse_linear(config, config.hidden_size, self.all_head_size)
+        self.key = sparse_linear(config, config.hidden_size, self.all_head_size)
+        self.value = sparse_linear(config, config.hidden_size, self.all_head_size)
 
         self.dropout = nn.Dropout(config.attention_probs_dropout_prob)
         self.position_embedding_type = position_embedding_type or getattr(
@@ -227,7 +238,7 @@ class Bfly_BertSelfAttention(nn.Module):
 class Bfly_BertSelfOutput(nn.Module):
     def __init__(self, config):
         super().__init__()
-        self.dense = Sparse_Linear(config.hidden_size, config.hidden_size)
+        self.dense = sparse_linear(config, config.hidden_size, config.hidden_size)
         self.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 
@@ -290,7 +301,7 @@ class Bfly_BertAttention(nn.Module):
 class Bfly_BertIntermediate(nn.Module):
     def __init__(self, config):
         super().__init__()
-        self.dense = Sparse_Linear(config.hidden_size, config.intermediate_size)
+        self.dense = sparse_linear(config, config.hidden_size, config.intermediate_size)
         if isinstance(config.hidden_act, str):
             self.intermediate_act_fn = ACT2FN[config.hidden_act]
         else:
@@ -305,7 +316,7 @@ class Bfly_BertIntermediate(nn.Module):
 class Bfly_BertOutput(nn.Module):
     def __init__(self, config):
         super().__init__()
-        self.dense = Sparse_Linear(config.intermediate_size, config.hidden_size)
+        self.dense = sparse_linear(config, config.intermediate_size, config.hidden_size)
         self.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 
@@ -391,7 +402,7 @@ class FNetEmbeddings(nn.Module):
         self.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         # NOTE: This is the project layer and will be needed. The original code allows for different embedding and different model dimensions.
         #self.projection = ButterflyLRLinear(config.hidden_size, config.hidden_size, rank=config.lr_ratio)
-        self.projection = Sparse_Linear(config.hidden_size, config.hidden_size)
+        self.projection = sparse_linear(config, config.hidden_size, config.hidden_size)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 
         # position_ids (1, len position emb) is contiguous in memory and exported when serialized
@@ -448,7 +459,8 @@ class FNetBasicFourierTransform(nn.Module):
 
     def _init_fourier_transform(self, config):
         if not config.use_tpu_fourier_optimizations:
-            self.fourier_transform = partial(torch.fft.fftn, dim=(1, 2))
+            self.fourier_transform = fourier_mixing(config.fourier_mixing, config.hidden_size,
+                                                    config.fourier_autotune_lengths, config.fourier_autotune_path)
         elif config.max_position_embeddings <= 4096:
             if is_scipy_available():
                 self.register_buffer(
@@ -507,7 +519,7 @@ class FNetIntermediate(nn.Module):
     def __init__(self, config):
         super().__init__()
         #self.dense = ButterflyLRLinear(config.hidden_size, config.intermediate_size, rank=config.lr_ratio)
-        self.dense = Sparse_Linear(config.hidden_size, config.intermediate_size)
+        self.dense = sparse_linear(config, config.hidden_size, config.intermediate_size)
         if isinstance(config.hidden_act, str):
             self.intermediate_act_fn = ACT2FN[config.hidden_act]
         else:
@@ -524,7 +536,7 @@ class FNetOutput(nn.Module):
     def __init__(self, config):
         super().__init__()
         #self.dense = ButterflyLRLinear(config.intermediate_size, config.hidden_size, rank=config.lr_ratio)
-        self.dense = Sparse_Linear(config.intermediate_size, config.hidden_size)
+        self.dense = sparse_linear(config, config.intermediate_size, config.hidden_size)
         self.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 
@@ -632,7 +644,7 @@ class FNetPooler(nn.Module):
     def __init__(self, config):
         super().__init__()
         #self.dense = ButterflyLRLinear(config.hidden_size, config.hidden_size, rank=config.lr_ratio)
-        self.dense = Sparse_Linear(config.hidden_size, config.hidden_size)
+        self.dense = sparse_linear(config, config.hidden_size, config.hidden_size)
         self.activation = nn.Tanh()
 
     def forward(self, hidden_states):
@@ -649,7 +661,7 @@ class FNetPredictionHeadTransform(nn.Module):
     def __init__(self, config):
         super().__init__()
         #self.dense = ButterflyLRLinear(config.hidden_size, config.hidden_size, rank=config.lr_ratio)
-        self.dense = Sparse_Linear(config.hidden_size, config.hidden_size)
+        self.dense = sparse_linear(config, config.hidden_size, config.hidden_size)
         if isinstance(config.hidden_act, str):
             self.transform_act_fn = ACT2FN[config.hidden_act]
         else:
@@ -671,7 +683,7 @@ class FNetLMPredictionHead(nn.Module):
         # The output weights are the same as the input embeddings, but there is
         # an output-only bias for each token.
         #self.decoder = ButterflyLRLinear(config.hidden_size, config.vocab_size, rank=config.lr_ratio)
-        self.decoder = Sparse_Linear(config.hidden_size, config.vocab_size)
+        self.decoder = sparse_linear(config, config.hidden_size, config.vocab_size)
 
         self.bias = nn.Parameter(torch.zeros(config.vocab_size))
         self.decoder.bias = self.bias
@@ -701,7 +713,7 @@ class FNetOnlyNSPHead(nn.Module):
     def __init__(self, config):
         super().__init__()
         #self.seq_relationship = ButterflyLRLinear(config.hidden_size, 2, rank=config.lr_ratio)
-        self.seq_relationship = Sparse_Linear(config.hidden_size, 2)
+        self.seq_relationship = sparse_linear(config, config.hidden_size, 2)
 
     def forward(self, pooled_output):
         seq_relationship_score = self.seq_relationship(pooled_output)
@@ -714,7 +726,7 @@ class FNetPreTrainingHeads(nn.Module):
         super().__init__()
         self.predictions = FNetLMPredictionHead(config)
         #self.seq_relationship = ButterflyLRLinear(config.hidden_size, 2, rank=config.lr_ratio)
-        self.seq_relationship = Sparse_Linear(config.hidden_size, 2)
+        self.seq_relationship = sparse_linear(config, config.hidden_size, 2)
 
     def forward(self, sequence_output, pooled_output):
         prediction_scores = self.predictions(sequence_output)
@@ -1186,7 +1198,7 @@ class Bfly_FNetForSequenceClassification(Bfly_FNetPreTrainedModel):
 
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
         #self.classifier = ButterflyLRLinear(config.hidden_size, config.num_labels, rank=config.lr_ratio)
-        self.classifier = Sparse_Linear(config.hidden_size, config.num_labels)
+        self.classifier = sparse_linear(config, config.hidden_size, config.num_labels)
 
         # Initialize weights and apply final processing
         self.post_init()
@@ -1270,7 +1282,7 @@ class Bfly_FNetForMultipleChoice(Bfly_FNetPreTrainedModel):
         self.fnet = Bfly_FNetModel(config)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
         #self.classifier = ButterflyLRLinear(config.hidden_size, 1, rank=config.lr_ratio)
-        self.classifier = Sparse_Linear(config.hidden_size, 1)
+        self.classifier = sparse_linear(config, config.hidden_size, 1)
 
         # Initialize weights and apply final processing
         self.post_init()
@@ -1352,7 +1364,7 @@ class Bfly_FNetForTokenClassification(Bfly_FNetPreTrainedModel):
 
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
         #self.classifier = ButterflyLRLinear(config.hidden_size, config.num_labels, rank=config.lr_ratio)
-        self.classifier = Sparse_Linear(config.hidden_size, config.num_labels)
+        self.classifier = sparse_linear(config, config.hidden_size, config.num_labels)
 
         # Initialize weights and apply final processing
         self.post_init()
@@ -1422,7 +1434,7 @@ class Bfly_FNetForQuestionAnswering(Bfly_FNetPreTrainedModel):
 
         self.fnet = Bfly_FNetModel(config)
         #self.qa_outputs = ButterflyLRLinear(config.hidden_size, config.num_labels, rank=config.lr_ratio)
-        self.qa_outputs = Sparse_Linear(config.hidden_size, config.num_labels)
+        self.qa_outputs = sparse_linear(config, config.hidden_size, config.num_labels)
 
         # Initialize weights and apply final processing
         self.post_init()
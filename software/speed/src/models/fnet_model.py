@@ -21,6 +21,8 @@ from transformers.file_utils import is_scipy_available
 from transformers.models.bert.modeling_bert import BertLayer
 ####################################
 
+from src.fourier import fourier_mixing
+
 if is_scipy_available():
     from scipy import linalg
 
@@ -158,7 +160,8 @@ class FNetBasicFourierTransform(nn.Module):
 
     def _init_fourier_transform(self, config):
         if not config.use_tpu_fourier_optimizations:
-            self.fourier_transform = partial(torch.fft.fftn, dim=(1, 2))
+            self.fourier_transform = fourier_mixing(config.fourier_mixing, config.hidden_size,
+                                                    config.fourier_autotune_lengths, config.fourier_autotune_path)
         elif config.max_position_embeddings <= 4096:
             if is_scipy_available():
                 self.register_buffer(
@@ -14,6 +14,7 @@ from src.models.modules.masking import FullMask, LengthMask
 from einops import repeat
 
 from src.models.modules.seq_common import ClassificationHead, PositionalEncoding, Mlp
+from src.fourier import fourier_mixing
 
 from transformers.file_utils import is_scipy_available
 
@@ -31,12 +32,12 @@ if is_scipy_available():
     from scipy import linalg
 
 class FNetBasicFourierTransform(nn.Module):
-    def __init__(self):
+    def __init__(self, fourier_mixing="fft", d_model=None):
         super().__init__()
-        self._init_fourier_transform()
+        self._init_fourier_transform(fourier_mixing, d_model)
 
-    def _init_fourier_transform(self):
-        self.fourier_transform = partial(torch.fft.fftn, dim=(1, 2))
+    def _init_fourier_transform(self, mixing, d_model):
+        self.fourier_transform = fourier_mixing(mixing, d_model)
 
     def forward(self, hidden_states):
 
@@ -58,9 +59,9 @@ class FNetBasicOutput(nn.Module):
         return hidden_states
 
 class FNetFourierTransform(nn.Module):
-    def __init__(self, d_model, layer_norm_eps):
+    def __init__(self, d_model, layer_norm_eps, fourier_mixing="fft"):
         super().__init__()
-        self.self = FNetBasicFourierTransform()
+        self.self = FNetBasicFourierTransform(fourier_mixing, d_model)
         self.output = FNetBasicOutput(d_model, layer_norm_eps)
 
     def forward(self, hidden_states):
@@ -103,11 +104,11 @@ class FnetEncoderLayer(nn.Module):
     def __init__(self, d_model, n_head, d_inner=2048, 
                  dropout=0.1, activation=F.relu,
                  layer_norm_eps=1e-5, batch_first=False, norm_first=False,
-                 device=None, dtype=None) -> None:
+                 device=None, dtype=None, fourier_mixing="fft") -> None:
         factory_kwargs = {'device': device, 'dtype': dtype}
         super().__init__()
         self.norm_first = norm_first
-        self.self_attn = FNetFourierTransform(d_model, layer_norm_eps)
+        self.self_attn = FNetFourierTransform(d_model, layer_norm_eps, fourier_mixing)
 
         # Legacy string support for activation function.
         if isinstance(activation, str):
@@ -234,7 +235,7 @@ class FNet(nn.Module):
     def __init__(self, d_model: int = 512, n_head: int = 8, n_layer: int = 6, d_inner: int = 2048,
                  dropout: float = 0.1, activation: Union[str, Callable[[Tensor], Tensor]] = F.relu,
                  layer_norm_eps: float = 1e-5, batch_first: bool = False, norm_first: bool = False,
-                 device=None, dtype=None) -> None:
+                 device=None, dtype=None, fourier_mixing: str = "fft") -> None:
         factory_kwargs = {'device': device, 'dtype': dtype}
         super().__init__()
         self.d_model = d_model
@@ -246,6 +247,7 @@ class FNet(nn.Module):
                                                 layer_norm_eps=layer_norm_eps,
                                                 batch_first=batch_first,
                                                 norm_first=norm_first,
+                                                fourier_mixing=fourier_mixing,
                                                 **factory_kwargs)
         encoder_norm = nn.LayerNorm(d_model, eps=layer_norm_eps, **factory_kwargs)
         self.encoder = FNetEncoder(encoder_layer, n_layer, encoder_norm)
@@ -306,7 +308,7 @@ class FNetClassifier(nn.Module):
                  pad_token_id : int, max_len : int,
                  norm_first=True, 
                  dropout: float = 0.1, activation: str = "gelu", layer_norm_eps: float = 1e-5,
-                 batch_first: bool = True, pooling_mode='CLS') -> None:
+                 batch_first: bool = True, pooling_mode='CLS', fourier_mixing: str = "fft") -> None:
         super().__init__()
         assert pooling_mode in ['MEAN', 'SUM', 'CLS'], 'pooling_mode not supported'
         self.pooling_mode = pooling_mode
@@ -317,7 +319,7 @@ class FNetClassifier(nn.Module):
         self.pos_encoder = PositionalEncoding(d_model, dropout,max_len=max_len, batch_first=batch_first)
         self.batch_first = batch_first
         self.transformer = FNet(d_model, n_head, n_layer, d_inner, dropout, activation, layer_norm_eps,
-                                       batch_first, norm_first)
+                                       batch_first, norm_first, fourier_mixing=fourier_mixing)
 
         self.classifier = ClassificationHead(d_model, d_inner, num_classes,
                                                  pooling_mode=pooling_mode, batch_first=batch_first)
@@ -0,0 +1,60 @@
+import math
+import os
+import platform
+import time
+import torch
+
+
+def time_runs(function, warmup=5, runs=50, synchronize=False):
+    # Latency of every timed call of function() in ms, after warmup untimed calls, synchronize for CUDA
+    with torch.no_grad():
+        for i in range(warmup):
+            function()
+        times = []
+        for i in range(runs):
+            if synchronize: torch.cuda.synchronize()
+            begin_time = time.perf_counter()
+            function()
+            if synchronize: torch.cuda.synchronize()
+            times.append((time.perf_counter() - begin_time) * 1000)
+    return times
+
+
+def percentile(sorted_times, q):
+    # Linear interpolation between the closest ranks, as numpy.percentile
+    position = (len(sorted_times) - 1) * q / 100
+    low, high = int(math.floor(position)), int(math.ceil(position))
+    return sorted_times[low] + (sorted_times[high] - sorted_times[low]) * (position - low)
+
+
+def latency_stats(times):
+    """
+    Median, p99, mean and std of the latencies in ms, and a 95% confidence interval of the median.
+    The interval is distribution-free: the ranks n/2 -+ 1.96 sqrt(n)/2 of the sorted samples (normal approximation of
+    the binomial), so that noisy outliers of a shared CPU do not widen it as they would a mean -+ std interval.
+    """
+    times = sorted(times)
+    num = len(times)
+    mean = sum(times) / num
+    half_width = 1.96 * math.sqrt(num) / 2
+    return {"median_ms": percentile(times, 50), "p99_ms": percentile(times, 99), "mean_ms": mean,
+            "std_ms": math.sqrt(sum((t - mean) ** 2 for t in times) / max(num - 1, 1)),
+            "ci95_low_ms": times[max(int(math.floor(num / 2 - half_width)), 0)],
+            "ci95_high_ms": times[min(int(math.ceil(num / 2 + half_width)), num - 1)], "runs": num}
+
+
+def machine_info():
+    return {"torch": torch.__version__, "processor": platform.processor() or platform.machine(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "python": platform.python_version()}
+
+
+def unit_test():
+    stats = latency_stats(list(range(1, 101)))
+    assert stats["median_ms"] == 50.5 and abs(stats["p99_ms"] - 99.01) < 1e-9
+    assert stats["ci95_low_ms"] <= stats["median_ms"] <= stats["ci95_high_ms"]
+    assert latency_stats([3.0])["median_ms"] == 3.0
+    assert len(time_runs(lambda: None, warmup=1, runs=4)) == 4
+
+
+if __name__ == "__main__":
+    unit_test()